@@ -0,0 +1,438 @@
+"""
+pedis基准测试，参照redis-benchmark：
+    启动一个pedis（子进程或当前进程的线程中，也可以连接已经在运行的服务器），多个客户端并发执行指定的命令，
+统计吞吐量和p50、p99、p999延迟。结果可以保存为JSON，并与之前保存的基线比较，吞吐量下降超过阈值时以状态1退出
+
+    python server/bin/benchmark.py -t get,set -c 50 -n 100000 -P 16 --json after.json --baseline before.json
+
+客户端同样是python实现，压力不够时用--procs分到多个进程
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+
+from server.conf import settings
+from server.src.cluster import reply_end, worker_port
+from server.src.resp_code import Resp
+
+
+RUN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'run.py')
+
+TESTS = ('get', 'set', 'mset', 'lpush', 'hgetall', 'sadd', 'zadd')
+
+# MSET一次设置的键数，与redis-benchmark一致
+MSET_KEYS = 10
+
+# 预先填充数据时每批的命令数
+PREPARE_BATCH = 1000
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='pedis benchmark')
+    parser.add_argument('--server', choices=('subprocess', 'inprocess', 'none'), default='subprocess',
+                        help='subprocess-用run.py在子进程中启动；inprocess-在当前进程的线程中启动，'
+                             '客户端与服务器争用GIL，只适合与同样方式的结果比较；none-连接已经在运行的服务器')
+    parser.add_argument('--host', default=settings.HOST)
+    parser.add_argument('-p', '--port', type=int, default=0,
+                        help='服务器端口，启动服务器时默认找一个空闲端口，none时默认为settings.PORT')
+    parser.add_argument('--workers', type=int, default=1, help='启动服务器时的工作进程数')
+    parser.add_argument('--transport', choices=('protocol', 'stream'), default=settings.TRANSPORT)
+    parser.add_argument('--event-loop', choices=('asyncio', 'uvloop'), default=settings.EVENT_LOOP)
+    parser.add_argument('-t', '--tests', default=','.join(TESTS), help='逗号分隔的测试，可选' + ','.join(TESTS))
+    parser.add_argument('-c', '--clients', type=int, default=50, help='并发连接数')
+    parser.add_argument('-n', '--requests', type=int, default=100000, help='每个测试的请求总数')
+    parser.add_argument('-P', '--pipeline', type=int, default=1, help='每个连接一次发送的请求数')
+    parser.add_argument('-d', '--data-size', type=int, default=3, help='值的字节数')
+    parser.add_argument('-r', '--keyspace', type=int, default=10000, help='随机键的个数')
+    parser.add_argument('--fields', type=int, default=10, help='HGETALL测试中每个hash的字段数')
+    parser.add_argument('--procs', type=int, default=1, help='客户端进程数')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='结果保存到该文件')
+    parser.add_argument('--baseline', help='与该文件中的结果比较')
+    parser.add_argument('--threshold', type=float, default=10,
+                        help='吞吐量比基线下降超过百分之多少视为退化')
+    opts = parser.parse_args(argv)
+
+    opts.tests = [t.strip().lower() for t in opts.tests.split(',') if t.strip()]
+    for test in opts.tests:
+        if test not in TESTS:
+            parser.error(f'unknown test {test!r}')
+    if opts.server == 'inprocess' and opts.workers > 1:
+        parser.error('--workers needs --server subprocess')
+    if opts.server == 'none' and not opts.port:
+        opts.port = settings.PORT
+    return opts
+
+
+def make_command(test, opts, rnd):
+    """:return: 每次调用生成一条请求的函数"""
+    value = b'x' * opts.data_size
+    keyspace = opts.keyspace
+    r = rnd.randrange
+
+    if test == 'get':
+        return lambda: Resp.array([b'GET', b'key:%d' % r(keyspace)])
+    if test == 'set':
+        return lambda: Resp.array([b'SET', b'key:%d' % r(keyspace), value])
+    if test == 'mset':
+        def mset():
+            # 同一条命令的键带相同的{tag}，多进程模式下落在同一个进程
+            tag = r(keyspace)
+            args = [b'MSET']
+            for i in range(MSET_KEYS):
+                args += [b'{key:%d}:%d' % (tag, i), value]
+            return Resp.array(args)
+        return mset
+    if test == 'lpush':
+        return lambda: Resp.array([b'LPUSH', b'list:%d' % r(keyspace), value])
+    if test == 'hgetall':
+        return lambda: Resp.array([b'HGETALL', b'hash:%d' % r(keyspace)])
+    if test == 'sadd':
+        return lambda: Resp.array([b'SADD', b'set:%d' % r(keyspace), b'element:%d' % r(keyspace)])
+    if test == 'zadd':
+        return lambda: Resp.array([b'ZADD', b'zset:%d' % r(keyspace), b'%d' % r(keyspace),
+                                   b'element:%d' % r(keyspace)])
+    raise ValueError(test)
+
+
+def prepare_commands(test, opts):
+    """读命令的测试先填充整个键空间"""
+    value = b'x' * opts.data_size
+    if test == 'get':
+        for i in range(opts.keyspace):
+            yield Resp.array([b'SET', b'key:%d' % i, value])
+    elif test == 'hgetall':
+        fields = []
+        for j in range(opts.fields):
+            fields += [b'field:%d' % j, value]
+        for i in range(opts.keyspace):
+            yield Resp.array([b'HMSET', b'hash:%d' % i] + fields)
+
+
+class Connection:
+    """只按RESP格式切分回复，不解析内容"""
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.buf = bytearray()
+        self.error = None
+
+    @classmethod
+    async def open(cls, host, port):
+        reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def request(self, data, count):
+        """发送一批请求并读完count条回复"""
+        self.writer.write(data)
+        buf = self.buf
+        pos = 0
+        while count:
+            end = reply_end(buf, pos)
+            if end < 0:
+                chunk = await self.reader.read(64 * 1024)
+                if not chunk:
+                    raise ConnectionError('server closed the connection')
+                buf += chunk
+                continue
+            if buf[pos] == 45 and self.error is None:  # b'-'
+                self.error = bytes(buf[pos+1:end-2]).decode(errors='replace')
+            pos = end
+            count -= 1
+        del buf[:pos]
+
+    def close(self):
+        self.writer.close()
+
+
+async def prepare(test, opts):
+    """填充数据，有错误回复时抛出RuntimeError，否则测试会在不存在的键上进行"""
+    conn = await Connection.open(opts.host, opts.port)
+    try:
+        batch = []
+        for req in prepare_commands(test, opts):
+            batch.append(req)
+            if len(batch) == PREPARE_BATCH:
+                await conn.request(b''.join(batch), len(batch))
+                batch = []
+        if batch:
+            await conn.request(b''.join(batch), len(batch))
+    finally:
+        conn.close()
+    if conn.error is not None:
+        raise RuntimeError(f'preparing {test} failed: {conn.error}')
+
+
+async def run_clients(test, opts, requests, clients, seed):
+    """
+    当前进程中的clients个连接共同完成requests个请求
+    :return: (每个请求的延迟（秒）, 开始时间, 结束时间, 第一个错误回复)
+    """
+    make = make_command(test, opts, random.Random(seed))
+    conns = [await Connection.open(opts.host, opts.port) for _ in range(clients)]
+    remaining = [requests]
+    latencies = []
+
+    async def client(conn):
+        pipeline = opts.pipeline
+        perf_counter = time.perf_counter
+        while remaining[0] > 0:
+            n = min(pipeline, remaining[0])
+            remaining[0] -= n
+            data = b''.join([make() for _ in range(n)])
+            start = perf_counter()
+            await conn.request(data, n)
+            # 与redis-benchmark一致，流水线中每个请求的延迟都记为整批的往返时间
+            latencies.extend([perf_counter() - start] * n)
+
+    start = time.monotonic()
+    await asyncio.gather(*(client(conn) for conn in conns))
+    end = time.monotonic()
+
+    error = next((conn.error for conn in conns if conn.error is not None), None)
+    for conn in conns:
+        conn.close()
+    return latencies, start, end, error
+
+
+def run_clients_process(args):
+    """客户端子进程的入口"""
+    return asyncio.run(run_clients(*args))
+
+
+def split(total, parts):
+    """把total尽量平均地分成parts份"""
+    return [total // parts + (i < total % parts) for i in range(parts)]
+
+
+def percentile(values, q):
+    """values已排序"""
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def run_test(test, opts):
+    asyncio.run(prepare(test, opts))
+
+    procs = max(1, min(opts.procs, opts.clients))
+    jobs = [(test, opts, requests, clients, opts.seed * 1000 + i)
+            for i, (requests, clients) in enumerate(zip(split(opts.requests, procs), split(opts.clients, procs)))]
+    if procs == 1:
+        parts = [run_clients_process(jobs[0])]
+    else:
+        with multiprocessing.get_context('fork').Pool(procs) as pool:
+            parts = pool.map(run_clients_process, jobs)
+
+    latencies = sorted(lat for part in parts for lat in part[0])
+    elapsed = max(part[2] for part in parts) - min(part[1] for part in parts)
+    return {
+        'requests': len(latencies),
+        'seconds': round(elapsed, 3),
+        'ops': round(len(latencies) / elapsed, 2),
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'p999_ms': round(percentile(latencies, 0.999) * 1000, 3),
+        'max_ms': round(latencies[-1] * 1000, 3),
+        'error': next((part[3] for part in parts if part[3] is not None), None),
+    }
+
+
+def port_free(host, port):
+    with socket.socket() as s:
+        try:
+            s.bind((host, port))
+        except OSError:
+            return False
+    return True
+
+
+def free_port(host, count=1):
+    """找count个连续的空闲端口，多进程模式下还要用到PORT+1+i"""
+    while True:
+        with socket.socket() as s:
+            s.bind((host, 0))
+            port = s.getsockname()[1]
+        if port + count < 65536 and all(port_free(host, port + i) for i in range(1, count)):
+            return port
+
+
+def wait_ready(host, ports, proc=None, timeout=30):
+    """等待所有端口都能连接"""
+    deadline = time.monotonic() + timeout
+    for port in ports:
+        while True:
+            if proc is not None and proc.poll() is not None:
+                raise RuntimeError(f'server exited with status {proc.returncode}')
+            try:
+                socket.create_connection((host, port), timeout=1).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f'server on port {port} is not ready') from None
+                time.sleep(0.05)
+
+
+class SubprocessServer:
+    """用run.py在子进程中启动服务器，数据文件放在临时目录，不影响server/db"""
+    def __init__(self, opts):
+        self.opts = opts
+        self.dir = None
+        self.proc = None
+
+    def start(self):
+        opts = self.opts
+        self.dir = tempfile.TemporaryDirectory(prefix='pedis-bench-')
+        cmd = [sys.executable, RUN, '--host', opts.host, '--port', str(opts.port), '--dir', self.dir.name,
+               '--workers', str(opts.workers), '--transport', opts.transport, '--event-loop', opts.event_loop]
+        self.proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL)
+        ports = [opts.port]
+        if opts.workers > 1:
+            ports += [worker_port(opts.port, i) for i in range(opts.workers)]
+        wait_ready(opts.host, ports, self.proc)
+
+    def stop(self):
+        if self.proc.poll() is None:
+            self.proc.send_signal(signal.SIGINT)
+            try:
+                self.proc.wait(30)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+                self.proc.wait()
+        self.dir.cleanup()
+
+
+class InProcessServer:
+    """在当前进程的线程中启动服务器"""
+    def __init__(self, opts):
+        self.opts = opts
+        self.dir = None
+        self.loop = None
+        self.task = None
+        self.thread = None
+
+    def start(self):
+        opts = self.opts
+        self.dir = tempfile.TemporaryDirectory(prefix='pedis-bench-')
+        # 服务器模块导入时就会加载数据，所以配置要在导入之前改好
+        settings.HOST = opts.host
+        settings.PORT = opts.port
+        settings.PDB_FILE = os.path.join(self.dir.name, os.path.basename(settings.PDB_FILE))
+        settings.AOF_FILE = os.path.join(self.dir.name, os.path.basename(settings.AOF_FILE))
+        settings.TRANSPORT = opts.transport
+        from server.src import pedis_server
+
+        pedis_server.setup_event_loop(opts.event_loop)
+        self.loop = asyncio.new_event_loop()
+        self.task = self.loop.create_task(pedis_server.main())
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        wait_ready(opts.host, [opts.port])
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self.task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            # 与asyncio.run一样，取消定时任务等剩下的任务后再关闭事件循环
+            tasks = asyncio.all_tasks(self.loop)
+            for task in tasks:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self.loop.close()
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.task.cancel)
+        self.thread.join(30)
+        self.dir.cleanup()
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(RUN),
+                              capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """
+    与基线比较并打印变化
+    :return: 吞吐量下降超过threshold%的测试
+    """
+    regressions = []
+    print(f'\ncompared with baseline (commit {baseline.get("meta", {}).get("commit")}):')
+    for name, cur in results.items():
+        old = baseline.get('results', {}).get(name)
+        if old is None:
+            print(f'{name}: not in baseline')
+            continue
+        change = (cur['ops'] - old['ops']) / old['ops'] * 100
+        flag = ''
+        if change < -threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f'{name}: {old["ops"]:.0f} -> {cur["ops"]:.0f} ops/sec ({change:+.1f}%), '
+              f'p99 {old["p99_ms"]:.3f} -> {cur["p99_ms"]:.3f} msec{flag}')
+    return regressions
+
+
+def main(argv=None):
+    opts = parse_args(argv)
+
+    server = None
+    if opts.server != 'none':
+        if not opts.port:
+            opts.port = free_port(opts.host, opts.workers + 1 if opts.workers > 1 else 1)
+        server = SubprocessServer(opts) if opts.server == 'subprocess' else InProcessServer(opts)
+        server.start()
+
+    results = {}
+    try:
+        for test in opts.tests:
+            result = results[test.upper()] = run_test(test, opts)
+            print(f'{test.upper()}: {result["ops"]:.2f} requests per second, p50={result["p50_ms"]:.3f} msec, '
+                  f'p99={result["p99_ms"]:.3f} msec, p999={result["p999_ms"]:.3f} msec')
+            if result['error'] is not None:
+                print(f'  error reply: {result["error"]}')
+    finally:
+        if server is not None:
+            server.stop()
+
+    options = {k: v for k, v in vars(opts).items() if k not in ('json', 'baseline', 'threshold')}
+    report = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'options': options,
+        },
+        'results': results,
+    }
+    if opts.json:
+        with open(opts.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if opts.baseline:
+        with open(opts.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, opts.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
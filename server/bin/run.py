@@ -1,14 +1,94 @@
+import argparse
 import asyncio
+import signal
 import sys
 import os
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
 
+from server.conf import settings
 
-if __name__ == '__main__':
-    from server.src.pedis_server import main
 
+def parse_args():
+    parser = argparse.ArgumentParser(description='pedis server')
+    parser.add_argument('--host', default=settings.HOST)
+    parser.add_argument('--port', type=int, default=settings.PORT)
+    parser.add_argument('--dir', help='快照和AOF文件所在目录，默认为settings中的位置')
+    parser.add_argument('--workers', type=int, default=settings.WORKERS,
+                        help='工作进程数，大于1时按槽分片')
+    parser.add_argument('--foreign-slot', choices=('forward', 'moved'), default=settings.FOREIGN_SLOT,
+                        help='键不属于当前进程时转发还是回复MOVED')
+    parser.add_argument('--transport', choices=('protocol', 'stream'), default=settings.TRANSPORT,
+                        help='基于asyncio.Protocol还是StreamReader/StreamWriter处理连接')
+    parser.add_argument('--event-loop', choices=('asyncio', 'uvloop'), default=settings.EVENT_LOOP,
+                        help='事件循环，uvloop未安装时退回标准库')
+    return parser.parse_args()
+
+
+def shard_file(filename, worker):
+    """进程各自的持久化文件，如dump.pdb -> dump-0.pdb"""
+    root, ext = os.path.splitext(filename)
+    return f'{root}-{worker}{ext}'
+
+
+def serve(worker=0, workers=1):
+    # 服务器模块导入时就会加载数据，所以配置要在导入之前改好
+    from server.src.pedis_server import main, setup_event_loop
+
+    setup_event_loop()
     try:
-        asyncio.run(main())
+        asyncio.run(main(worker, workers))
     except KeyboardInterrupt as e:
         print('exit')
+
+
+def run_workers(workers):
+    """fork出工作进程，父进程只负责把退出信号转给子进程并等待它们结束"""
+    children = []
+    for i in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            # 单独的进程组，终端的Ctrl-C只发给父进程，由父进程转发，避免子进程收到两次
+            os.setpgrp()
+            settings.PDB_FILE = shard_file(settings.PDB_FILE, i)
+            settings.AOF_FILE = shard_file(settings.AOF_FILE, i)
+            code = 1
+            try:
+                serve(i, workers)
+                code = 0
+            finally:
+                os._exit(code)
+        children.append(pid)
+
+    def stop(signum, frame):
+        for child in children:
+            try:
+                os.kill(child, signal.SIGINT)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    while children:
+        pid, status = os.wait()
+        children.remove(pid)
+        print(f'worker {pid} exited with status {os.waitstatus_to_exitcode(status)}')
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    settings.HOST = args.host
+    settings.PORT = args.port
+    if args.dir:
+        settings.PDB_FILE = os.path.join(args.dir, os.path.basename(settings.PDB_FILE))
+        settings.AOF_FILE = os.path.join(args.dir, os.path.basename(settings.AOF_FILE))
+    settings.WORKERS = args.workers
+    settings.FOREIGN_SLOT = args.foreign_slot
+    settings.TRANSPORT = args.transport
+    settings.EVENT_LOOP = args.event_loop
+
+    if args.workers > 1:
+        run_workers(args.workers)
+    else:
+        serve()
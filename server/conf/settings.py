@@ -4,10 +4,34 @@ pedis配置文件
 import os
 
 
+# 监听地址和端口
+HOST = '127.0.0.1'
+PORT = 12345
+
 # 数据保存到磁盘位置，可以填具体绝对路径
 PDB_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'db', 'dump.pdb')
 
 
+# ------------AOF持久化---------------------- #
+
+# 是否开启AOF，开启后启动时优先通过重放AOF文件恢复数据
+APPEND_ONLY = False
+
+# AOF文件位置
+AOF_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'db', 'appendonly.aof')
+
+# fsync策略：always-每批写命令都fsync，最安全也最慢；everysec-每秒fsync一次，最多丢1秒数据；no-交给操作系统
+APPEND_FSYNC = 'everysec'
+
+# AOF比上次重写后增长超过百分之多少时自动后台重写，0表示不自动重写
+AUTO_AOF_REWRITE_PERCENTAGE = 100
+
+# AOF小于多少字节时不自动重写
+AUTO_AOF_REWRITE_MIN_SIZE = 64 * 1024 * 1024
+
+# ----------------------------------------- #
+
+
 # ------------同步机制---------------------- #
 # 为保证最佳性能请不要乱修改
 
@@ -21,3 +45,147 @@ SEC_COUNT = 100
 MIN_COUNT = 10
 
 # ----------------------------------------- #
+
+
+# ------------键过期---------------------- #
+
+# 过期键处理的时间间隔（秒），同一间隔内到期的键放在同一个桶中处理
+EXPIRE_INTERVAL = 0.1
+
+# 主动过期每轮取多少个到期的键
+ACTIVE_EXPIRE_KEYS = 20
+
+# 一轮中超过百分之多少的键确实过期才继续下一轮
+ACTIVE_EXPIRE_STALE = 25
+
+# 每次主动过期最多占用EXPIRE_INTERVAL的百分之多少时间
+ACTIVE_EXPIRE_CYCLE_PERC = 25
+
+# ----------------------------------------- #
+
+
+# ------------客户端连接---------------------- #
+
+# 单个客户端一批回复的输出缓冲区上限（字节），超出后先写出并等待客户端接收
+CLIENT_OUTPUT_BUFFER_LIMIT = 1024 * 1024
+
+# 订阅者的输出缓冲区限制（硬上限字节, 软上限字节, 秒），推送的消息积压超过硬上限，或持续超过软上限指定秒数时断开连接，0表示不限制
+CLIENT_OUTPUT_BUFFER_LIMIT_PUBSUB = (32 * 1024 * 1024, 8 * 1024 * 1024, 60)
+
+# 连接处理方式：'protocol'-基于asyncio.Protocol，收到数据直接回调解析执行；'stream'-基于StreamReader/StreamWriter
+TRANSPORT = 'protocol'
+
+# 事件循环：'asyncio'-标准库（Linux下为epoll）；'uvloop'-基于libuv，需另外安装，未安装时退回标准库
+EVENT_LOOP = 'asyncio'
+
+# 监听队列长度，大量客户端同时连接时避免被拒绝
+TCP_BACKLOG = 511
+
+# 请求的协议限制，超出时回复协议错误并断开连接，与redis一致
+# 单个参数的最大字节数，即redis的proto-max-bulk-len
+PROTO_MAX_BULK_LEN = 512 * 1024 * 1024
+# 一条命令的最大参数个数
+PROTO_MAX_MULTIBULK_LEN = 1024 * 1024
+# 内联命令以及'*'、'$'长度行的最大字节数
+PROTO_INLINE_MAX_SIZE = 64 * 1024
+# 单个客户端还未解析完的请求数据上限（字节），即redis的client-query-buffer-limit
+CLIENT_QUERY_BUFFER_LIMIT = 1024 * 1024 * 1024
+
+# ----------------------------------------- #
+
+
+# ------------键索引---------------------- #
+
+# 额外维护按字典序排列的键索引，带字面量前缀的模式（如session:*）在KEYS、SCAN MATCH中只访问匹配前缀的键
+# 代价是每次新建、删除键时多一次有序插入删除，以及每个键多占一个引用的内存
+KEY_INDEX = True
+
+# ----------------------------------------- #
+
+
+# ------------紧凑编码---------------------- #
+
+# 字段数和字段、值长度都不超过阈值的hash保存为字段值交替的列表，超过后转换为dict
+HASH_MAX_ZIPLIST_ENTRIES = 128
+HASH_MAX_ZIPLIST_VALUE = 64
+
+# 元素个数和长度都不超过阈值的list保存为普通列表，超过后转换为deque
+LIST_MAX_ZIPLIST_ENTRIES = 128
+LIST_MAX_ZIPLIST_VALUE = 64
+
+# 只含整数且个数不超过阈值的set保存为有序整数数组，超过后转换为set
+SET_MAX_INTSET_ENTRIES = 512
+
+# ----------------------------------------- #
+
+
+# ------------多进程---------------------- #
+
+# 工作进程数，大于1时每个进程负责一段槽（键按CRC16分到16384个槽），通过SO_REUSEPORT共用PORT，
+# 另外各自监听PORT+1+进程编号；每个进程单独持久化自己的分片（如dump-0.pdb），进程数改变后原有分片不会重新分配
+WORKERS = 1
+
+# 键不属于当前进程时的处理方式：'forward'-转发给所属进程执行，'moved'-回复MOVED重定向到所属进程的端口
+FOREIGN_SLOT = 'forward'
+
+# ----------------------------------------- #
+
+
+# ------------内存上限---------------------- #
+
+# 键估算的内存占用之和的上限（字节），超出后执行写命令前按策略淘汰键，0表示不限制
+MAXMEMORY = 0
+
+# 淘汰策略：noeviction-不淘汰，超出后拒绝会增加内存的写命令；allkeys-lru、volatile-lru-淘汰最久未访问的键；
+# allkeys-lfu、volatile-lfu-淘汰访问频率最低的键；volatile-ttl-淘汰最早过期的键；allkeys-random、volatile-random-随机淘汰
+# volatile开头的策略只淘汰设置了过期时间的键
+MAXMEMORY_POLICY = 'noeviction'
+
+# 每次淘汰抽样的键数，越大越接近真正的LRU/LFU，也越慢
+MAXMEMORY_SAMPLES = 5
+
+# LFU计数的对数因子，越大计数增长越慢；计数每隔多少分钟减1
+LFU_LOG_FACTOR = 10
+LFU_DECAY_TIME = 1
+
+# ----------------------------------------- #
+
+
+# ------------慢查询与延迟监控---------------------- #
+
+# 执行时间超过多少微秒的命令记入慢查询日志（SLOWLOG），0表示记录所有命令，负数表示关闭
+SLOWLOG_LOG_SLOWER_THAN = 10000
+
+# 慢查询日志最多保留多少条
+SLOWLOG_MAX_LEN = 128
+
+# 阻塞事件循环超过多少毫秒的事件记入延迟监控（LATENCY），0表示关闭
+LATENCY_MONITOR_THRESHOLD = 100
+
+# ----------------------------------------- #
+
+
+# ------------统计---------------------- #
+
+# 是否记录每个命令的耗时直方图，INFO latencystats中显示分位数
+LATENCY_TRACKING = True
+
+# INFO latencystats中显示的分位数
+LATENCY_TRACKING_PERCENTILES = (50, 99, 99.9)
+
+# ----------------------------------------- #
+
+
+# ------------惰性释放---------------------- #
+
+# 以下情况删除的值元素较多时只从键空间中摘下，交给后台线程分块释放，不阻塞事件循环
+# 淘汰的键、过期的键、被SET覆盖的旧值
+LAZYFREE_LAZY_EVICTION = False
+LAZYFREE_LAZY_EXPIRE = False
+LAZYFREE_LAZY_SERVER_DEL = False
+
+# DEL等同于UNLINK；FLUSHALL、FLUSHDB不带参数时等同于ASYNC
+LAZYFREE_LAZY_USER_DEL = False
+LAZYFREE_LAZY_USER_FLUSH = False
+
+# ----------------------------------------- #
@@ -0,0 +1,270 @@
+"""
+AOF持久化，记录每条改变了数据的写命令，以RESP格式追加到文件，启动时重放
+"""
+import asyncio
+import os
+import time
+
+from server.src.resp_code import Resp, RespParser, RespError
+from server.src.bgsave import CHILDREN
+from server.src.latency import LATENCY
+from server.src.zset import format_score
+from server.conf.settings import AUTO_AOF_REWRITE_PERCENTAGE, AUTO_AOF_REWRITE_MIN_SIZE
+
+
+# AOF文件同步到磁盘的策略
+FSYNC_ALWAYS = 'always'
+FSYNC_EVERYSEC = 'everysec'
+FSYNC_NO = 'no'
+
+# 重写时每条命令最多包含的元素个数
+REWRITE_ITEMS_PER_CMD = 64
+
+
+class AppendOnlyFile:
+    """写命令先追加到内存缓冲区，每批命令执行完后写入文件，再按策略fsync"""
+    def __init__(self, filename, fsync=FSYNC_EVERYSEC):
+        if fsync not in (FSYNC_ALWAYS, FSYNC_EVERYSEC, FSYNC_NO):
+            raise ValueError(f'unknown fsync policy {fsync!r}')
+        self.filename = filename
+        self.fsync = fsync
+
+        self.buf = []
+        self.file = open(filename, 'ab')
+        self.size = self.file.tell()
+
+        # 已写入文件但还未fsync的字节数
+        self.unsynced = 0
+        self.last_fsync = time.time()
+
+        # 上次重写后的文件大小，用于按增长比例自动重写
+        self.base_size = self.size
+        # 后台重写的子进程号，以及重写期间新产生的写命令
+        self.child = None
+        self.rewrite_buf = None
+        # 有其他子进程（BGSAVE）在运行时，等其结束后再重写
+        self.scheduled = False
+
+    def feed(self, commands):
+        """
+        记录写命令
+        :param commands: 命令参数列表的序列，每条命令参数均为bytes
+        """
+        for args in commands:
+            data = Resp.array(args)
+            self.buf.append(data)
+            if self.rewrite_buf is not None:
+                self.rewrite_buf.append(data)
+
+    def flush(self):
+        """把缓冲区写入文件，在回复客户端之前调用"""
+        if not self.buf:
+            return
+        data = b''.join(self.buf)
+        self.buf.clear()
+
+        with LATENCY.measure('aof-write'):
+            self.file.write(data)
+            self.file.flush()
+        self.size += len(data)
+        self.unsynced += len(data)
+
+        if self.fsync == FSYNC_ALWAYS:
+            with LATENCY.measure('aof-fsync-always'):
+                self._fsync()
+
+    def _fsync(self):
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.last_fsync = time.time()
+
+    async def cron(self, db, t=0.1):
+        """
+        AOF的时间事件，每t秒检查后台重写是否完成、是否需要自动重写，
+        everysec策略下每秒在线程池中fsync一次，不阻塞事件循环
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(t)
+            if self.child is not None:
+                self.check_rewrite()
+            elif not CHILDREN and (self.scheduled or self.need_rewrite()):
+                self.start_rewrite(db)
+
+            if self.fsync == FSYNC_EVERYSEC and self.unsynced and time.time() - self.last_fsync >= 1:
+                self.unsynced = 0
+                self.last_fsync = time.time()
+                await loop.run_in_executor(None, os.fsync, self.file.fileno())
+
+    def need_rewrite(self):
+        """文件超过最小大小，且相比上次重写后增长超过设定比例"""
+        if not AUTO_AOF_REWRITE_PERCENTAGE or self.size < AUTO_AOF_REWRITE_MIN_SIZE:
+            return False
+        base = self.base_size or 1
+        return (self.size - base) * 100 / base >= AUTO_AOF_REWRITE_PERCENTAGE
+
+    def start_rewrite(self, db):
+        """
+        后台重写AOF，fork出的子进程拥有数据的时间点副本，由子进程生成最精简的命令写入临时文件，
+        重写期间的写命令另外缓存，子进程结束后追加到临时文件再原子替换
+        :return: 'started'，已在重写返回'in progress'，有其他子进程在运行时返回'scheduled'
+        """
+        if self.child is not None:
+            return 'in progress'
+        if CHILDREN:
+            self.scheduled = True
+            return 'scheduled'
+        self.scheduled = False
+
+        if not hasattr(os, 'fork'):
+            # 不支持fork的平台只能在当前进程中重写
+            rewrite(db, self.filename)
+            self._reopen()
+            return 'started'
+
+        self.flush()
+        with LATENCY.measure('fork'):
+            pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                rewrite(db, self._temp_file(os.getpid()), rename=False)
+                code = 0
+            finally:
+                os._exit(code)
+
+        self.child = pid
+        self.rewrite_buf = []
+        CHILDREN.add(pid)
+        return 'started'
+
+    def check_rewrite(self):
+        """检查后台重写子进程是否结束，结束则完成替换"""
+        pid, status = os.waitpid(self.child, os.WNOHANG)
+        if pid == 0:
+            return
+
+        temp = self._temp_file(self.child)
+        buf = self.rewrite_buf
+        CHILDREN.discard(self.child)
+        self.child = None
+        self.rewrite_buf = None
+
+        if not os.WIFEXITED(status) or os.WEXITSTATUS(status) != 0:
+            print('AOF重写失败')
+            if os.path.exists(temp):
+                os.remove(temp)
+            return
+
+        self.flush()
+        with open(temp, 'ab') as f:
+            f.write(b''.join(buf))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, self.filename)
+        self._reopen()
+        print('AOF重写完成')
+
+    def _temp_file(self, pid):
+        return os.path.join(os.path.dirname(self.filename), f'temp-rewriteaof-{pid}.aof')
+
+    def _reopen(self):
+        """重写后切换到新的AOF文件"""
+        self.file.close()
+        self.file = open(self.filename, 'ab')
+        self.size = self.base_size = self.file.tell()
+        self.unsynced = 0
+
+    def close(self):
+        if self.child is not None:
+            os.waitpid(self.child, 0)
+            self.check_rewrite()
+        self.flush()
+        if self.fsync != FSYNC_NO:
+            self._fsync()
+        self.file.close()
+
+
+def rewrite(db, filename, rename=True):
+    """
+    根据当前数据生成最精简的AOF：每个键一条（元素多时分成几条）写入命令，过期时间记录为PEXPIREAT
+    :param rename: 先写临时文件再原子替换，在子进程中由父进程负责替换
+    """
+    temp = f'{filename}.{os.getpid()}.tmp' if rename else filename
+    with open(temp, 'wb') as f:
+        for key, tp, value, when in db.iter_data():
+            if tp == 0:
+                f.write(Resp.array([b'SET', key, value]))
+            elif tp == 1:
+                items = [x for item in value.items() for x in item]
+                _write_batches(f, b'HMSET', key, items, 2)
+            elif tp == 2:
+                _write_batches(f, b'RPUSH', key, list(value))
+            elif tp == 3:
+                _write_batches(f, b'SADD', key, list(value))
+            elif tp == 4:
+                items = [x for member, score in value for x in (format_score(score), member)]
+                _write_batches(f, b'ZADD', key, items, 2)
+
+            if when is not None:
+                f.write(Resp.array([b'PEXPIREAT', key, b'%d' % (when * 1000)]))
+
+        f.flush()
+        os.fsync(f.fileno())
+
+    if rename:
+        os.replace(temp, filename)
+
+
+def _write_batches(f, name, key, items, width=1):
+    """元素较多时分成多条命令，每条最多REWRITE_ITEMS_PER_CMD个元素"""
+    step = REWRITE_ITEMS_PER_CMD * width
+    for i in range(0, len(items), step):
+        f.write(Resp.array([name, key, *items[i:i+step]]))
+
+
+def load(filename, execute, chunk=1024 * 1024):
+    """
+    重放AOF文件，每条命令都交给execute执行，即走正常的命令处理流程
+    文件末尾不完整的命令（写入时宕机）会被截掉
+    :return: 重放的命令条数，文件不存在时返回-1
+    """
+    if not os.path.exists(filename):
+        return -1
+
+    parser = RespParser()
+    count = 0
+    with open(filename, 'rb') as f:
+        while True:
+            data = f.read(chunk)
+            if not data:
+                break
+            parser.feed(data)
+            try:
+                commands = parser.parse()
+            except RespError as e:
+                raise RespError(f'bad AOF format near offset {f.tell() - len(parser.buf)}: {e}') from None
+            for args in commands:
+                execute(args)
+            count += len(commands)
+
+        size = f.tell()
+
+    tail = len(parser.buf) + _partial(parser)
+    if tail:
+        print(f'AOF末尾有{tail}字节不完整的命令，已截掉')
+        with open(filename, 'r+b') as f:
+            f.truncate(size - tail)
+    return count
+
+
+def _partial(parser):
+    """解析器中未完成的命令帧已经消耗掉的字节数，AOF中的命令都是标准格式，可以直接算出"""
+    if not parser.multibulk:
+        return 0
+    size = len(b'*%d\r\n' % (len(parser.args) + parser.multibulk))
+    for arg in parser.args:
+        size += len(b'$%d\r\n' % len(arg)) + len(arg) + 2
+    if parser.bulklen >= 0:
+        size += len(b'$%d\r\n' % parser.bulklen)
+    return size
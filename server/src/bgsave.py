@@ -0,0 +1,154 @@
+"""
+后台保存快照，fork出的子进程共享父进程内存（写时复制），同一时间只允许一个子进程
+"""
+import os
+import signal
+import time
+
+from server.src import snapshot
+from server.src.latency import LATENCY
+from server.conf.settings import PDB_FILE
+
+
+# 正在运行的后台子进程（BGSAVE和AOF重写），同一时间只允许一个
+CHILDREN = set()
+
+
+class BackgroundSave:
+    """BGSAVE管理：单个子进程、保存期间再次请求则在结束后补一次，记录每次保存的状态"""
+    def __init__(self, filename=PDB_FILE):
+        self.filename = filename
+
+        self.child = None
+        self.pipe = None
+        self.start_time = 0
+        # fork时数据库的修改次数，保存成功后从db.modify中减去
+        self.dirty = 0
+        # 保存期间又有保存请求时，当前保存结束后再保存一次
+        self.scheduled = False
+
+        # 最近一次成功保存的时间、最近一次后台保存的结果、耗时和写时复制的内存大小
+        self.last_save = int(time.time())
+        self.last_status = 'ok'
+        self.last_duration = -1
+        self.last_cow = 0
+
+    def save(self, db):
+        """前台保存，会阻塞所有客户端"""
+        with LATENCY.measure('save'):
+            snapshot.dump(db, self.filename)
+        db.modify = 0
+        self.last_save = int(time.time())
+        print('async over')
+
+    def bgsave(self, db):
+        """
+        开始后台保存
+        :return: 'started'，或者已有子进程在运行时安排在其结束后保存，返回'scheduled'
+        """
+        if self.child is not None or CHILDREN:
+            self.scheduled = True
+            return 'scheduled'
+        self.scheduled = False
+
+        if not hasattr(os, 'fork'):
+            # 不支持fork的平台只能前台保存
+            self.save(db)
+            return 'started'
+
+        r, w = os.pipe()
+        with LATENCY.measure('fork'):
+            pid = os.fork()
+        if pid == 0:
+            os.close(r)
+            code = 1
+            try:
+                snapshot.dump(db, self.filename)
+                os.write(w, b'%d' % private_dirty())
+                code = 0
+            finally:
+                os._exit(code)
+
+        os.close(w)
+        self.child = pid
+        self.pipe = r
+        self.start_time = time.time()
+        self.dirty = db.modify
+        CHILDREN.add(pid)
+        return 'started'
+
+    def check(self, db):
+        """检查子进程是否结束，结束则记录结果，有待执行的保存请求则再次开始"""
+        if self.child is None:
+            if self.scheduled and not CHILDREN:
+                self.bgsave(db)
+            return
+
+        pid, status = os.waitpid(self.child, os.WNOHANG)
+        if pid == 0:
+            return
+        self._done(status, db)
+
+        if self.scheduled:
+            self.bgsave(db)
+
+    def _done(self, status, db=None):
+        CHILDREN.discard(self.child)
+        self.child = None
+        self.last_duration = int(time.time() - self.start_time)
+
+        cow = os.read(self.pipe, 32)
+        os.close(self.pipe)
+        self.pipe = None
+
+        if os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0:
+            self.last_status = 'ok'
+            self.last_save = int(time.time())
+            self.last_cow = int(cow or 0)
+            # 保存期间的修改还没有写入快照
+            if db is not None:
+                db.modify = max(db.modify - self.dirty, 0)
+            print('async over')
+        else:
+            self.last_status = 'err'
+            print('后台保存失败')
+
+    def kill(self):
+        """停止正在运行的子进程，关闭服务器时使用"""
+        if self.child is not None:
+            pid = self.child
+            os.kill(pid, signal.SIGKILL)
+            _, status = os.waitpid(pid, 0)
+            self._done(status)
+
+            temp = snapshot.temp_file(self.filename, pid)
+            if os.path.exists(temp):
+                os.remove(temp)
+
+    def info(self, db):
+        """INFO persistence中快照相关的字段"""
+        return {
+            'rdb_changes_since_last_save': db.modify,
+            'rdb_bgsave_in_progress': int(self.child is not None),
+            'rdb_last_save_time': self.last_save,
+            'rdb_last_bgsave_status': self.last_status,
+            'rdb_last_bgsave_time_sec': self.last_duration,
+            'rdb_current_bgsave_time_sec': int(time.time() - self.start_time) if self.child is not None else -1,
+            'rdb_last_cow_size': self.last_cow,
+            'rdb_saves_scheduled': int(self.scheduled),
+        }
+
+
+def private_dirty():
+    """当前进程被修改过（写时复制产生）的私有内存字节数，只支持linux"""
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                if line.startswith('Private_Dirty:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+SAVER = BackgroundSave()
@@ -0,0 +1,184 @@
+"""
+阻塞的列表弹出BLPOP、BRPOP、BLMOVE：
+    列表都为空时把客户端登记到每个键的FIFO等待队列中，LPUSH、RPUSH使有客户端等待的键变为非空时标记为就绪，
+命令执行完后按登记顺序每个元素唤醒一个客户端。所有客户端的超时共用一个按到期时间排序的堆和一个定时器，不为每个客户端创建任务
+"""
+import asyncio
+import heapq
+from collections import deque
+
+from server.src.resp_code import Resp
+
+
+class Waiter:
+    """
+    一个阻塞的客户端
+    keys: 等待的键，按命令中的顺序
+    left: 从列表左端弹出
+    destination: BLMOVE的目标键，BLPOP、BRPOP为None
+    to_left: BLMOVE插入到目标列表的左端
+    """
+    __slots__ = ('client', 'keys', 'left', 'destination', 'to_left', 'future')
+
+    def __init__(self, client, keys, left, destination, to_left, future):
+        self.client = client
+        self.keys = keys
+        self.left = left
+        self.destination = destination
+        self.to_left = to_left
+        self.future = future
+
+    def timeout_reply(self):
+        return Resp.NIL if self.destination is not None else Resp.NIL_ARRAY
+
+
+class BlockingKeys:
+    def __init__(self):
+        # 键 -> 等待该键的Waiter队列
+        self.waiters = {}
+        # 变为非空且有客户端等待的键，dict当作有序集合
+        self.ready = {}
+        # (到期时间, 序号, Waiter)的最小堆，已唤醒的Waiter留在堆中，到期时跳过
+        self.timeouts = []
+        self.seq = 0
+        # 堆顶到期时触发的定时器
+        self.handle = None
+
+    def block(self, client, keys, timeout, left, destination=None, to_left=False):
+        """
+        登记阻塞的客户端
+        :param timeout: 秒，0表示一直等待
+        :return: 唤醒或超时后得到回复的Future
+        """
+        loop = asyncio.get_running_loop()
+        waiter = Waiter(client, keys, left, destination, to_left, loop.create_future())
+        for key in keys:
+            queue = self.waiters.get(key)
+            if queue is None:
+                queue = self.waiters[key] = deque()
+            queue.append(waiter)
+        client.blocked = waiter
+
+        if timeout:
+            deadline = loop.time() + timeout
+            heapq.heappush(self.timeouts, (deadline, self.seq, waiter))
+            self.seq += 1
+            if self.handle is None or deadline < self.handle.when():
+                self._schedule(loop)
+        return waiter.future
+
+    def signal(self, key):
+        """键因push变为非空"""
+        if key in self.waiters:
+            self.ready[key] = None
+
+    def unblock(self, client):
+        """客户端断开连接时取消等待"""
+        waiter = client.blocked
+        if waiter is not None:
+            self._remove(waiter)
+            waiter.future.cancel()
+
+    def serve(self, db):
+        """
+        按登记顺序唤醒就绪键上等待的客户端，每个元素只唤醒一个
+        :return: 需要记录到AOF的命令，与客户端实际执行的弹出等价
+        """
+        commands = []
+        while self.ready:
+            key = next(iter(self.ready))
+            del self.ready[key]
+            queue = self.waiters.get(key)
+            while queue:
+                waiter = queue[0]
+                if waiter.client.is_closed():
+                    # 已断开但还未被取消的客户端，不能把元素发给它
+                    self._remove(waiter)
+                    waiter.future.cancel()
+                    continue
+
+                if waiter.destination is None:
+                    value = db.lpop(key) if waiter.left else db.rpop(key)
+                    if value is None or value is False:
+                        break
+                    reply = Resp.array([key, value])
+                    commands.append([b'LPOP' if waiter.left else b'RPOP', key])
+                else:
+                    # BLMOVE，目标键可能使其他键就绪，由外层循环继续处理
+                    value = db.lmove(key, waiter.destination, waiter.left, waiter.to_left)
+                    if value is None:
+                        break
+                    if value is False:
+                        reply = Resp.encode(False)
+                    else:
+                        reply = Resp.encode(value, '$')
+                        commands.append([b'LMOVE', key, waiter.destination, side(waiter.left), side(waiter.to_left)])
+
+                self._remove(waiter)
+                waiter.future.set_result(reply)
+        return commands
+
+    def _remove(self, waiter):
+        waiter.client.blocked = None
+        for key in waiter.keys:
+            queue = self.waiters.get(key)
+            if queue is None:
+                continue
+            try:
+                queue.remove(waiter)
+            except ValueError:
+                continue
+            if not queue:
+                del self.waiters[key]
+
+    def _schedule(self, loop):
+        """定时器指向未唤醒的最早到期的客户端"""
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+        timeouts = self.timeouts
+        while timeouts and timeouts[0][2].future.done():
+            heapq.heappop(timeouts)
+        if timeouts:
+            self.handle = loop.call_at(timeouts[0][0], self._expire)
+
+    def _expire(self):
+        self.handle = None
+        loop = asyncio.get_running_loop()
+        # 定时器可能比到期时间略早触发，留1毫秒余量，与redis超时的精度一致
+        now = loop.time() + 0.001
+        timeouts = self.timeouts
+        while timeouts and timeouts[0][0] <= now:
+            waiter = heapq.heappop(timeouts)[2]
+            if not waiter.future.done():
+                self._remove(waiter)
+                waiter.future.set_result(waiter.timeout_reply())
+        self._schedule(loop)
+
+
+def side(left):
+    return b'LEFT' if left else b'RIGHT'
+
+
+def parse_timeout(value):
+    """超时时间为非负的秒数，可以是小数，格式错误时抛出ValueError"""
+    try:
+        timeout = float(value)
+    except ValueError:
+        raise ValueError('timeout is not a float or out of range') from None
+    if timeout != timeout or timeout == float('inf'):
+        raise ValueError('timeout is not a float or out of range')
+    if timeout < 0:
+        raise ValueError('timeout is negative')
+    return timeout
+
+
+def parse_side(value):
+    """LEFT | RIGHT，:return: 是否为LEFT"""
+    value = value.lower()
+    if value not in (b'left', b'right'):
+        raise ValueError('syntax error')
+    return value == b'left'
+
+
+BLOCKING = BlockingKeys()
@@ -0,0 +1,336 @@
+"""
+多进程模式下的键空间分片，参照redis集群：键按CRC16分到16384个槽，每个工作进程负责连续的一段槽。
+所有进程通过SO_REUSEPORT共用一个端口接收连接，另外各自监听一个端口用于MOVED重定向和进程间转发，
+命令的键不属于当前进程时，转发给所属进程执行，或者回复MOVED。
+KEYS、FLUSHALL、INFO等不带键的命令在所有进程上执行后合并回复，SCAN的游标中带有进程编号，依次遍历每个进程
+"""
+import asyncio
+from binascii import crc_hqx
+from collections import deque
+
+from server.src.resp_code import Resp
+from server.src.stats import bytes_human
+
+
+CLUSTER_SLOTS = 16384
+
+# 键不属于当前进程时的处理方式
+FOREIGN_FORWARD = 'forward'
+FOREIGN_MOVED = 'moved'
+
+
+def key_slot(key):
+    """键所在的槽，与redis集群一致：键中有非空的{...}时只对其中的内容计算"""
+    start = key.find(b'{')
+    if start >= 0:
+        end = key.find(b'}', start + 1)
+        if end > start + 1:
+            key = key[start+1:end]
+    return crc_hqx(key, 0) & (CLUSTER_SLOTS - 1)
+
+
+def slot_range(worker, workers):
+    """进程负责的槽范围[start, end)"""
+    return worker * CLUSTER_SLOTS // workers, (worker + 1) * CLUSTER_SLOTS // workers
+
+
+def worker_port(port, worker):
+    """进程单独监听的端口，紧接在共用端口之后"""
+    return port + 1 + worker
+
+
+class Cluster:
+    """当前进程在分片中的位置，以及到其他进程的连接"""
+    def __init__(self, worker, workers, host, port, foreign=FOREIGN_FORWARD):
+        if foreign not in (FOREIGN_FORWARD, FOREIGN_MOVED):
+            raise ValueError(f'unknown foreign slot policy {foreign!r}')
+        self.worker = worker
+        self.workers = workers
+        self.host = host
+        self.port = worker_port(port, worker)
+        self.foreign = foreign
+
+        # 槽 -> 所属进程
+        self.owners = [0] * CLUSTER_SLOTS
+        self.ports = []
+        for i in range(workers):
+            start, end = slot_range(i, workers)
+            self.owners[start:end] = [i] * (end - start)
+            self.ports.append(worker_port(port, i))
+
+        # 到其他进程的转发连接，用到时再建立
+        self.peers = {}
+
+    def peer(self, worker):
+        peer = self.peers.get(worker)
+        if peer is None:
+            peer = self.peers[worker] = Peer(self.host, self.ports[worker])
+        return peer
+
+    def route(self, cmd, args):
+        """
+        检查命令的键是否属于当前进程
+        :return: None表示在本进程执行，否则为回复（bytes）或等待转发结果的Future
+        """
+        keys = cmd.get_keys(args)
+        if not keys:
+            return None
+        slot = key_slot(keys[0])
+        owner = self.owners[slot]
+        for key in keys[1:]:
+            if self.owners[key_slot(key)] != owner:
+                return Resp.error("Keys in request don't hash to the same worker", 'CROSSSLOT')
+        if owner == self.worker:
+            return None
+
+        # 阻塞命令转发后会堵住共用的转发连接，只能让客户端重定向
+        if self.foreign == FOREIGN_MOVED or 'blocking' in cmd.flags:
+            return Resp.error(f'{slot} {self.host}:{self.ports[owner]}', 'MOVED')
+        return self.peer(owner).forward(args)
+
+    def broadcast(self, args, local, merge):
+        """
+        在其他所有进程上执行同样的命令
+        :param local: 当前进程的回复
+        :param merge: 合并各进程回复的函数，见BROADCAST
+        :return: 等待合并后回复的Task
+        """
+        futures = [self.peer(i).forward(args) for i in range(self.workers) if i != self.worker]
+        return asyncio.ensure_future(self._gather(local, futures, merge))
+
+    @staticmethod
+    async def _gather(local, futures, merge):
+        return merge([local] + list(await asyncio.gather(*futures)))
+
+    def split_cursor(self, cursor):
+        """SCAN的游标 -> (进程编号, 该进程内的游标)"""
+        return cursor % self.workers, cursor // self.workers
+
+    def join_cursor(self, worker, cursor):
+        """进程内的游标为0时转到下一个进程，所有进程都遍历完为0"""
+        if cursor:
+            return cursor * self.workers + worker
+        return worker + 1 if worker + 1 < self.workers else 0
+
+    def scan(self, worker, cursor, args):
+        """
+        转发SCAN给worker，args为cursor之后的参数
+        :return: 等待回复的Task，回复中的游标换成带进程编号的游标
+        """
+        fut = self.peer(worker).forward([b'SCAN', b'%d' % cursor] + args)
+        return asyncio.ensure_future(self._scan_reply(worker, fut))
+
+    async def _scan_reply(self, worker, fut):
+        reply = await fut
+        if reply[:1] != b'*':
+            return reply
+        # *2\r\n$n\r\ncursor\r\n*m\r\n...，只替换游标，键列表原样返回
+        line = reply.index(b'\r\n', 4)
+        end = line + 2 + int(reply[5:line])
+        cursor = b'%d' % self.join_cursor(worker, int(reply[line+2:end]))
+        return b'*2\r\n$%d\r\n%s\r\n' % (len(cursor), cursor) + reply[end+2:]
+
+    def slots(self):
+        """CLUSTER SLOTS 的回复内容"""
+        ret = []
+        for i in range(self.workers):
+            start, end = slot_range(i, self.workers)
+            ret.append([start, end - 1, [self.host, self.ports[i]]])
+        return ret
+
+
+class Peer:
+    """
+    到另一个进程的转发连接，请求按顺序流水线发送，回复按先后顺序对应到等待中的Future
+    """
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.writer = None
+        self.connecting = None
+        self.pending = deque()
+
+    def forward(self, args):
+        """:return: Future，结果为对方回复的原始字节"""
+        fut = asyncio.get_running_loop().create_future()
+        if self.writer is not None:
+            self._send(args, fut)
+        else:
+            if self.connecting is None:
+                self.connecting = asyncio.ensure_future(self._connect())
+            # 连接建立之前的请求按顺序排在连接之后发送
+            self.connecting.add_done_callback(lambda _: self._send(args, fut))
+        return fut
+
+    def _send(self, args, fut):
+        if self.writer is None:
+            fut.set_result(Resp.error(f'worker on port {self.port} is unreachable'))
+            return
+        self.pending.append(fut)
+        self.writer.write(Resp.array(args))
+
+    async def _connect(self):
+        try:
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+        except OSError:
+            self.connecting = None
+            return
+        # 先声明是进程间的转发连接，对方在该连接上只在本进程执行命令，不再广播
+        writer.write(Resp.array([b'CLUSTER', b'PEER']))
+        self.pending.append(asyncio.get_running_loop().create_future())
+        self.writer = writer
+        asyncio.ensure_future(self._read(reader))
+
+    async def _read(self, reader):
+        buf = bytearray()
+        try:
+            while True:
+                data = await reader.read(64 * 1024)
+                if not data:
+                    break
+                buf += data
+                pos = 0
+                while self.pending:
+                    end = reply_end(buf, pos)
+                    if end < 0:
+                        break
+                    fut = self.pending.popleft()
+                    if not fut.done():
+                        fut.set_result(bytes(buf[pos:end]))
+                    pos = end
+                del buf[:pos]
+        except ConnectionError:
+            pass
+
+        # 连接断开，等待中的请求都返回错误，下次转发时重新连接
+        self.writer.close()
+        self.writer = None
+        self.connecting = None
+        while self.pending:
+            fut = self.pending.popleft()
+            if not fut.done():
+                fut.set_result(Resp.error(f'connection to worker on port {self.port} lost'))
+
+
+def first_error(replies):
+    return next((reply for reply in replies if reply[:1] == b'-'), None)
+
+
+def merge_status(replies):
+    """FLUSHALL等，所有进程都成功时返回当前进程的回复"""
+    return first_error(replies) or replies[0]
+
+
+def merge_arrays(replies):
+    """KEYS，拼接各进程的数组"""
+    error = first_error(replies)
+    if error is not None:
+        return error
+    count = 0
+    items = []
+    for reply in replies:
+        # 空列表的回复为'+(empty list or set)'
+        if reply[:1] != b'*':
+            continue
+        line = reply.index(b'\r\n')
+        count += int(reply[1:line])
+        items.append(reply[line+2:])
+    if not count:
+        return replies[0]
+    return b'*%d\r\n' % count + b''.join(items)
+
+
+def merge_integers(replies):
+    """PUBLISH，各进程收到消息的客户端数相加"""
+    error = first_error(replies)
+    if error is not None:
+        return error
+    return Resp.integer(sum(int(reply[1:-2]) for reply in replies))
+
+
+def merge_min(replies):
+    """LASTSAVE，所有进程中最早的一次保存时间"""
+    error = first_error(replies)
+    if error is not None:
+        return error
+    return Resp.integer(min(int(reply[1:-2]) for reply in replies))
+
+
+# INFO中各进程相加的字段，对应的*_human字段按相加后的值重新生成
+INFO_SUMMED = ('used_memory', 'used_memory_rss', 'used_memory_peak', 'lazyfree_pending_objects')
+
+
+def merge_info(replies):
+    """INFO，内存和键空间部分为所有进程之和，其他部分为当前进程的信息"""
+    error = first_error(replies)
+    if error is not None:
+        return error
+    texts = [reply[reply.index(b'\r\n')+2:-2].decode() for reply in replies]
+    totals = {}
+    keyspace = {'keys': 0, 'expires': 0}
+    for text in texts:
+        for line in text.split('\r\n'):
+            name, _, value = line.partition(':')
+            if name in INFO_SUMMED:
+                totals[name] = totals.get(name, 0) + int(value)
+            elif name == 'db0':
+                for item in value.split(','):
+                    field, _, n = item.partition('=')
+                    keyspace[field] += int(n)
+
+    lines = []
+    for line in texts[0].split('\r\n'):
+        name = line.partition(':')[0]
+        if name == 'db0':
+            continue
+        if name in totals:
+            line = f'{name}:{totals[name]}'
+        elif name.endswith('_human') and name[:-6] in totals:
+            line = f'{name}:{bytes_human(totals[name[:-6]])}'
+        lines.append(line)
+        if line == '# Keyspace' and keyspace['keys']:
+            lines.append(f"db0:keys={keyspace['keys']},expires={keyspace['expires']}")
+    return Resp.encode('\r\n'.join(lines), '$')
+
+
+# 不带键、作用于所有进程的命令 -> 合并各进程回复的函数，只有部分子命令需要时键为(命令, 子命令)
+BROADCAST = {
+    'keys': merge_arrays,
+    'flushall': merge_status,
+    'flushdb': merge_status,
+    'info': merge_info,
+    # 每个进程保存自己的快照文件
+    'save': merge_status,
+    'bgsave': merge_status,
+    'bgrewriteaof': merge_status,
+    'lastsave': merge_min,
+    ('config', b'resetstat'): merge_status,
+    ('slowlog', b'reset'): merge_status,
+    # 订阅者分布在各个进程上，消息要发布到所有进程
+    'publish': merge_integers,
+}
+
+
+def reply_end(buf, pos):
+    """从pos开始的一个完整回复的结束位置，不完整时返回-1"""
+    line = buf.find(b'\r\n', pos)
+    if line < 0:
+        return -1
+    kind = buf[pos]
+    if kind in b'+-:':
+        return line + 2
+
+    n = int(buf[pos+1:line])
+    if kind == 36:  # b'$'
+        if n < 0:
+            return line + 2
+        end = line + 2 + n + 2
+        return end if end <= len(buf) else -1
+
+    # 数组，逐个元素找结束位置
+    pos = line + 2
+    for _ in range(n):
+        pos = reply_end(buf, pos)
+        if pos < 0:
+            return -1
+    return pos
@@ -0,0 +1,103 @@
+"""
+命令表，命令名到处理函数、参数个数、标志、键位置的映射，导入时构建一次
+"""
+
+from server.src.resp_code import Resp
+from server.src.stats import Histogram
+
+
+class Command:
+    """
+    单条命令的元信息，参照redis命令表
+    arity: 参数个数（包括命令名），正数表示固定个数，负数表示至少-arity个
+    flags: write-修改数据，readonly-只读，denyoom-可能增加内存，超出maxmemory时拒绝，fast-O(1)或O(log n)，admin-管理命令，
+        blocking-可能阻塞客户端，pubsub-发布订阅
+    first_key, last_key, step: 键在参数中的位置，last_key为-1表示到最后一个参数
+    其余为INFO commandstats的统计：调用次数、总耗时（纳秒）、参数错误被拒绝次数、回复错误次数、耗时直方图
+    """
+    __slots__ = ('name', 'proc', 'arity', 'flags', 'first_key', 'last_key', 'step',
+                 'calls', 'nsec', 'rejected_calls', 'failed_calls', 'histogram')
+
+    def __init__(self, name, proc, arity, flags, first_key, last_key, step):
+        self.name = name
+        self.proc = proc
+        self.arity = arity
+        self.flags = frozenset(flags.split())
+        self.first_key = first_key
+        self.last_key = last_key
+        self.step = step
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.calls = 0
+        self.nsec = 0
+        self.rejected_calls = 0
+        self.failed_calls = 0
+        self.histogram = Histogram()
+
+    def check_arity(self, args):
+        """args包括命令名"""
+        arity = self.arity
+        if arity > 0:
+            return len(args) == arity
+        return len(args) >= -arity
+
+    def get_keys(self, args):
+        """从完整参数中取出所有键"""
+        if not self.first_key:
+            return []
+        last = self.last_key
+        if last < 0:
+            last += len(args)
+        return args[self.first_key:last+1:self.step]
+
+    def info(self):
+        """COMMAND INFO 返回的信息"""
+        return [self.name.encode(), self.arity, sorted(self.flags),
+                self.first_key, self.last_key, self.step]
+
+
+# 命令名（大写和小写两种形式的bytes）-> Command
+COMMANDS = {}
+
+
+def command(arity, flags='', first_key=1, last_key=1, step=1):
+    """
+    注册命令的装饰器，命令名即被装饰的方法名
+    :param arity: 参数个数，见Command
+    :param flags: 空格分隔的标志
+    """
+    def decorator(func):
+        name = func.__name__.lower()
+        cmd = Command(name, func, arity, flags, first_key, last_key, step)
+        COMMANDS[name.encode()] = cmd
+        COMMANDS[name.upper().encode()] = cmd
+        return func
+    return decorator
+
+
+def lookup(name):
+    """根据客户端发送的命令名查找命令，大小写不敏感"""
+    cmd = COMMANDS.get(name)
+    if cmd is None:
+        cmd = COMMANDS.get(name.lower())
+    return cmd
+
+
+def all_commands():
+    """所有命令，每个命令只出现一次"""
+    return {cmd.name: cmd for cmd in COMMANDS.values()}
+
+
+def total_calls():
+    """所有命令的调用次数之和"""
+    return sum(cmd.calls for cmd in all_commands().values())
+
+
+def reset_stats():
+    for cmd in all_commands().values():
+        cmd.reset_stats()
+
+
+def arity_error(name):
+    return Resp.error(f"wrong number of arguments for '{name}' command")
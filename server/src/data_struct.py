@@ -1,373 +1,786 @@
 """
-数据组指形式，内存中的数据结构，多个hash表组成
+数据组指形式，内存中的数据结构，整个键空间是一个字典，键 -> RedisObject
 """
 
-from collections import deque
-from collections import UserDict
-import pickle
-import multiprocessing
+from itertools import takewhile
+import math
+import os
 import time
-
-from server.conf.settings import PDB_FILE
-
-
-class RedisDict(UserDict):
-    """基本k-v结构，用于存放普通键值对，对应redis string类型"""
-    def __missing__(self, key):
-        return None
-
-
-class RedisHash(UserDict):
-    """对应hash结构，因为缺失时返回一个字典"""
-    def __missing__(self, key):
-        self[key] = RedisDict()
-        return self[key]
-
-
-class RedisList(UserDict):
-    """对应list结构，缺失时返回队列用以支持redis操作"""
-    def __missing__(self, key):
-        self[key] = deque()
-        return self[key]
-
-
-class RedisSet(UserDict):
-    def __missing__(self, key):
-        self[key] = set()
-        return self[key]
-
-
-class RedisZset(UserDict):
-    def __missing__(self, key):
-        self[key] = set()
-        return self[key]
-
-
-class RedisKey(UserDict):
-    """保存数据库中所有键，值为数据类型，方便查找，同时避免不同数据类型键重复。
-    0-string，1-hash, 2-list, 3-set, 4-zset"""
-    def __init__(self, *args):
-        """
-        :param args: 对应数据结构的引用，方便删除键
-        """
-        super().__init__()
-        self.zip = args
-
-        # 记录当前数据被修改次数，已对应采取不同同步策略
-        self.modify = 0
-
-    def __missing__(self, key):
-        return None
-
-    def pop(self, k):
-        """默认删除对应数据结构中的数据"""
-        if self[k] is not None:
-            del self.zip[self[k]][k]
-            del self[k]
-            self.modify += 1
-            return True
-        return False
-
-
-class RedisExpires(UserDict):
-    """键过期时间设置，值为对应的过期时间戳"""
-    def __init__(self, keys):
-        super().__init__()
-        self.KEYS = keys
-
-    def __missing__(self, key):
-        """如果key不在KEYS中，此时key不存在，否则key存在但是还未设置过期时间，返回不同值"""
-        if self.KEYS[key] is None:
-            return -2
-        return -1
-
-    def pop(self, k):
-        """方便直接通过k删除对应键值"""
-        self.KEYS.pop(k)
-        del self[k]
+from sys import getsizeof
+
+from server.src import snapshot
+from server.src.scan import KeySlots, SCAN_SLOTS, prefix_scan, scan_members
+from server.src.pattern import compile_pattern, split_prefix
+from server.src.sortedlist import SortedList
+from server.src.zset import Zset
+from server.src.encoding import IntSet, hash_update, list_push, list_set, set_add, set_remove, encoding_of
+from server.src.stats import STATS
+from server.src.evict import lfu_init, lfu_touch, lfu_decay
+from server.src.blocking import BLOCKING
+from server.src.lazyfree import LAZYFREE, release_keyspace, release_nested
+from server.src.memory import KEY_OVERHEAD, container_size, elements_size, hash_entry_size, zset_entry_size, key_size
+from server.conf.settings import PDB_FILE, APPEND_ONLY, AOF_FILE, KEY_INDEX, MAXMEMORY_POLICY, \
+    LAZYFREE_LAZY_EXPIRE, LAZYFREE_LAZY_SERVER_DEL
+
+
+# 类型编号对应的类型名，0-string，1-hash, 2-list, 3-set, 4-zset
+TYPES = ('string', 'hash', 'list', 'set', 'zset')
+
+
+class RedisObject:
+    """
+    键空间中的值
+    type: 类型编号，见TYPES
+    value: string为bytes，hash为ZipHash或HashTable，list为ZipList或deque，set为IntSet或HashSet，zset为Zset
+    expire: 过期时间戳（秒），None表示不过期
+    lru: 最近访问时间（秒），LFU策略下为(分钟时间 << 8) | 对数访问计数，见evict.py
+    size: 估算的内存占用，包括键本身，每次修改时按增量更新，见memory.py
+    """
+    __slots__ = ('type', 'value', 'expire', 'lru', 'size')
+
+    def __init__(self, tp, value, expire=None, lru=0):
+        self.type = tp
+        self.value = value
+        self.expire = expire
+        self.lru = lru
+        self.size = 0
 
 
 class RedisData:
     # 减小类大小，同时设计为单例模式
-    __slots__ = ('STRING', 'HASH', 'LIST', 'SET', 'ZSET', 'KEYS', 'EXPIRES')
+    __slots__ = ('KEYS', 'index', 'sorted', 'modify', 'volatile', 'expires', 'clock', 'lfu', 'used_memory')
 
     # TODO 线程不安全
     _obj = None
 
     def _init(self):
         # 只在未通过磁盘加载成功时初始化
-        self.STRING = RedisDict()
-        self.HASH = RedisHash()
-        self.LIST = RedisList()
-        self.SET = RedisSet()
-        self.ZSET = RedisZset()
+        # 键 -> RedisObject，查找一个键只需要一次字典查找
+        self.KEYS = {}
 
-        self.KEYS = RedisKey(self.STRING, self.HASH, self.LIST, self.SET, self.ZSET)
-        self.EXPIRES = RedisExpires(self.KEYS)
+        # 键的槽索引，用于SCAN增量遍历
+        self.index = KeySlots()
+        # 按字典序排列的键索引，用于按前缀查找键
+        self.sorted = SortedList() if KEY_INDEX else None
+
+        # 记录当前数据被修改次数，已对应采取不同同步策略
+        self.modify = 0
+        # 设置了过期时间的键数
+        self.volatile = 0
+        # 过期队列ExpireQueue，由Timer设置，键被删除或取消过期时从中移除
+        self.expires = None
+
+        # 键访问时间的时钟（秒），由定时任务更新
+        self.clock = int(time.time())
+        # 是否按LFU记录访问
+        self.lfu = 'lfu' in MAXMEMORY_POLICY
+        # 所有键估算的内存占用之和
+        self.used_memory = 0
 
     def __new__(cls, *args, **kwargs):
         if cls._obj is None:
-            cls._obj = super().__new__(cls)
-            if load(PDB_FILE) is None:
-                cls._obj._init()
+            obj = super().__new__(cls)
+            obj._init()
+            # 开启AOF且AOF文件存在时，由服务器启动时重放AOF恢复数据，否则从快照恢复
+            # 快照损坏时直接报错，不能当作空数据库启动，否则下次保存会覆盖掉原有数据
+            if not (APPEND_ONLY and os.path.exists(AOF_FILE)):
+                snapshot.load(obj, PDB_FILE)
+            cls._obj = obj
 
         return cls._obj
 
-    def _check_key(self, key, tp):
-        """检查key对应值类型是否是给定类型"""
-        real_tp = self.KEYS[key]
-        if real_tp is None or real_tp == tp:
-            return 1
-        return 0
+    def iter_data(self):
+        """逐个返回未过期的(键, 类型, 值, 过期时间戳)，用于持久化"""
+        now = time.time()
+        for key, obj in self.KEYS.items():
+            when = obj.expire
+            if when is not None and when <= now:
+                continue
+            yield key, obj.type, obj.value, when
+
+    def iter_expires(self):
+        """逐个返回设置了过期时间的(键, 过期时间戳)，包括已过期还未删除的"""
+        for key, obj in self.KEYS.items():
+            if obj.expire is not None:
+                yield key, obj.expire
+
+    def restore(self, key, tp, value, when=None):
+        """从持久化数据中恢复一个键，hash值为(字段, 值)序列，list、set值为元素序列，zset值为(成员, 分值)序列"""
+        if when is not None and when <= time.time():
+            return
+        if tp == 1:
+            value = hash_update(None, dict(value))[0]
+        elif tp == 2:
+            value = list_push(None, value)
+        elif tp == 3:
+            value = set_add(None, value)[0]
+        elif tp == 4:
+            zset = Zset()
+            for member, score in value:
+                zset.add(member, score)
+            value = zset
+        obj = self._add(key, tp, value, elements_size(tp, value))
+        if when is not None:
+            obj.expire = when
+            self.volatile += 1
+
+    def _add(self, key, tp, value, elements=0):
+        """新建键，调用前需确认键不存在，elements为元素占用的字节数"""
+        obj = self.KEYS[key] = RedisObject(tp, value, None, lfu_init(self.clock) if self.lfu else self.clock)
+        obj.size = getsizeof(key) + KEY_OVERHEAD + container_size(tp, value) + elements
+        self.used_memory += obj.size
+        self.index.add(key)
+        if self.sorted is not None:
+            self.sorted.add(key)
+        return obj
+
+    def _resize(self, obj, before, delta):
+        """
+        值修改后更新键的内存占用
+        :param before: 修改前容器本身的大小，见container_size
+        :param delta: 元素增减的字节数
+        """
+        delta += container_size(obj.type, obj.value) - before
+        obj.size += delta
+        self.used_memory += delta
+
+    def _lookup(self, key, touch=True):
+        """
+        查找键，访问时顺便惰性删除已过期的键，:return: RedisObject，不存在返回None
+        :param touch: 是否更新访问时间，TYPE、TTL、SCAN等不算访问
+        """
+        obj = self.KEYS.get(key)
+        if obj is None:
+            return None
+        if obj.expire is not None and obj.expire <= time.time():
+            self._delete(key, LAZYFREE_LAZY_EXPIRE)
+            STATS.expired_keys += 1
+            return None
+        if touch:
+            obj.lru = lfu_touch(obj.lru, self.clock) if self.lfu else self.clock
+        return obj
+
+    def fetch(self, key, tp):
+        """
+        取给定类型的值，读命令的入口，只有一次字典查找
+        :return: 值，键不存在返回None，类型不对返回False
+        """
+        obj = self.KEYS.get(key)
+        if obj is None:
+            return None
+        if obj.expire is not None and obj.expire <= time.time():
+            self._delete(key, LAZYFREE_LAZY_EXPIRE)
+            STATS.expired_keys += 1
+            return None
+        if obj.type != tp:
+            return False
+        obj.lru = lfu_touch(obj.lru, self.clock) if self.lfu else self.clock
+        return obj.value
+
+    def _delete(self, key, lazy=False):
+        """删除键，连同过期时间一起删除，lazy时值较大的交给后台线程释放"""
+        obj = self.KEYS.pop(key, None)
+        if obj is None:
+            return False
+        if obj.expire is not None:
+            self._unexpire(key)
+        self.used_memory -= obj.size
+        self.index.remove(key)
+        if self.sorted is not None:
+            self.sorted.discard(key)
+        self.modify += 1
+        if lazy:
+            LAZYFREE.free(obj.value)
+        return True
+
+    def flush(self, lazy=False):
+        """
+        清空数据库，lazy时整个键空间交给后台线程释放
+        :return: 删除的键数
+        """
+        count = len(self.KEYS)
+        old = self.KEYS, self.index.slots, self.sorted
+        self.KEYS = {}
+        self.index = KeySlots()
+        self.sorted = SortedList() if KEY_INDEX else None
+        self.volatile = 0
+        self.used_memory = 0
+        self.modify += count
+        if self.expires is not None:
+            self.expires.clear(lazy)
+        if lazy:
+            space, slots, index = old
+            LAZYFREE.submit(space, release_keyspace)
+            LAZYFREE.submit(slots, release_nested)
+            if index is not None:
+                LAZYFREE.submit(index)
+        return count
 
-    def keys(self, pattern: str):
-        """获取所有满足pattern的key"""
-
-        def match(string):
-            """结合redis的*通配符的字符串匹配函数，未经过大量测试"""
-            i = j = 0
-            while i < len(pattern) and j < len(string):
-                if pattern[i] == '*':
-                    i += 1
-                elif pattern[i] != string[j]:
-                    j += 1
-                else:
-                    i += 1
-                    j += 1
-
-            if pattern[i:] != '*' * len(pattern[i:]):
-                return False
-            if j != len(string) and pattern[-1] != '*':
-                return False
-            return True
-
-        return [key for key in self.KEYS if match(key)]
+    def keys(self, pattern: bytes):
+        """获取所有满足pattern的key，有字面量前缀且开启了有序键索引时只访问匹配前缀的键"""
+        matcher = compile_pattern(pattern)
+        prefix = split_prefix(pattern)[0]
+        index = self.sorted
+        if prefix and index is not None:
+            keys = takewhile(lambda key: key.startswith(prefix), index.irange(prefix))
+        else:
+            keys = self.KEYS
+
+        # 遍历时不能删除，已过期的键只跳过
+        space = self.KEYS
+        now = time.time()
+        ret = []
+        for key in keys:
+            if matcher(key):
+                when = space[key].expire
+                if when is None or when > now:
+                    ret.append(key)
+        return ret
+
+    def scan(self, cursor, count, pattern=None, tp=None):
+        """
+        从游标开始增量遍历键空间，已过期的键顺便删除
+        有字面量前缀的模式在有序键索引上遍历，游标不小于SCAN_SLOTS，否则按槽遍历
+        :param tp: 只返回该类型的键，如'string'
+        :return: (下一个游标, 键列表)
+        """
+        matcher = compile_pattern(pattern) if pattern is not None else None
+        prefix = split_prefix(pattern)[0] if pattern is not None else b''
+        index = self.sorted
+        if prefix and index is not None and (cursor == 0 or cursor >= SCAN_SLOTS):
+            cursor, keys = prefix_scan(index, prefix, cursor, count)
+        else:
+            cursor, keys = self.index.scan(cursor, count)
+
+        ret = []
+        for key in keys:
+            obj = self._lookup(key, False)
+            if obj is None:
+                continue
+            if matcher is not None and not matcher(key):
+                continue
+            if tp is not None and TYPES[obj.type] != tp:
+                continue
+            ret.append(key)
+        return cursor, ret
 
     def type_(self, key):
         """获取key值类型"""
-        if self.KEYS[key] is not None:
-            return self.__slots__[self.KEYS[key]].lower()
+        obj = self._lookup(key, False)
+        if obj is not None:
+            return TYPES[obj.type]
         return 'none'
 
-    def del_(self, keys):
-        """删除key"""
+    def encoding(self, key):
+        """值的内部编码，键不存在返回None"""
+        obj = self._lookup(key, False)
+        if obj is None:
+            return None
+        return encoding_of(obj.type, obj.value)
+
+    def idletime(self, key):
+        """距最近一次访问的秒数，键不存在返回None，LFU策略下返回False"""
+        obj = self._lookup(key, False)
+        if obj is None:
+            return None
+        if self.lfu:
+            return False
+        return self.clock - obj.lru
+
+    def freq(self, key):
+        """LFU访问计数，键不存在返回None，非LFU策略下返回False"""
+        obj = self._lookup(key, False)
+        if obj is None:
+            return None
+        if not self.lfu:
+            return False
+        return lfu_decay(obj.lru, self.clock)
+
+    def memory_usage(self, key, samples=None):
+        """
+        键占用的字节数，键不存在返回None
+        :param samples: None时返回增量维护的大小，否则重新估算，0表示计算全部元素
+        """
+        obj = self._lookup(key, False)
+        if obj is None:
+            return None
+        if samples is None:
+            return obj.size
+        return key_size(key, obj, samples)
+
+    def del_(self, keys, lazy=False):
+        """删除key，lazy时值较大的交给后台线程释放，即UNLINK"""
         count = 0
         for key in keys:
-            count += self.KEYS.pop(key)
+            count += self._delete(key, lazy)
         return count
 
     def expire(self, key, seconds):
         """设置失效时间"""
-        if self.EXPIRES[key] == -2:
+        return self.expireat(key, time.time() + seconds)
+
+    def expireat(self, key, when):
+        """设置失效时间戳，单位秒"""
+        obj = self._lookup(key)
+        if obj is None:
             return False
-        self.EXPIRES[key] = time.time() + seconds
+        if obj.expire is None:
+            self.volatile += 1
+        obj.expire = when
 
-        self.KEYS.modify += 1
+        self.modify += 1
         return True
 
+    def get_expire(self, key):
+        """过期时间戳，不存在或未设置返回None，不做惰性删除"""
+        obj = self.KEYS.get(key)
+        return obj.expire if obj is not None else None
+
     def persist(self, key):
-        """取消失效设置，与Timer模块设计不同，只是单纯的从EXPIRES里删除，只是测试用"""
-        if self.EXPIRES[key] < 0:
+        """取消失效设置"""
+        obj = self._lookup(key)
+        if obj is None or obj.expire is None:
             return False
 
-        self.KEYS.modify += 1
-        del self.EXPIRES[key]
+        self.modify += 1
+        obj.expire = None
+        self._unexpire(key)
+        return True
+
+    def _unexpire(self, key):
+        """键不再有过期时间，同时从过期队列中移除，否则队列中的记录要等到原来的到期时间才清理"""
+        self.volatile -= 1
+        if self.expires is not None:
+            self.expires.discard(key)
 
     def ttl(self, key):
-        """获取距离失效时间，单位秒"""
-        if self.EXPIRES[key] < 0:
-            return self.EXPIRES[key]
-        if self.EXPIRES[key] == 0:
+        """获取距离失效时间，单位秒，不存在返回-2，未设置返回-1"""
+        obj = self._lookup(key, False)
+        if obj is None:
             return -2
-        return int(self.EXPIRES[key] - time.time() + 0.5)
+        if obj.expire is None:
+            return -1
+        return int(obj.expire - time.time() + 0.5)
 
     def get(self, m=False, *keys):
-        if not m and not self._check_key(keys[0], 0):
-            return False
-        return [self.STRING[key] for key in keys]
+        if not m:
+            value = self.fetch(keys[0], 0)
+            return False if value is False else [value]
+        ret = []
+        for key in keys:
+            value = self.fetch(key, 0)
+            ret.append(value if value is not False else None)
+        return ret
 
-    def set(self, **mapping):
+    def set(self, mapping):
+        """mapping中键值均为bytes，原样保存"""
+        space = self.KEYS
         for k, v in mapping.items():
-            if self.KEYS[k] is not None and self.KEYS[k] > 0:
-                self.KEYS.pop(k)
-            self.KEYS[k] = 0
-            self.STRING[k] = v
-            self.KEYS.modify += 1
+            obj = space.get(k)
+            if obj is None:
+                self._add(k, 0, v)
+            else:
+                # 覆盖旧值，同时清除旧的过期时间
+                if obj.expire is not None:
+                    obj.expire = None
+                    self._unexpire(k)
+                if LAZYFREE_LAZY_SERVER_DEL:
+                    LAZYFREE.free(obj.value)
+                obj.type = 0
+                obj.value = v
+                size = getsizeof(k) + KEY_OVERHEAD + getsizeof(v)
+                self.used_memory += size - obj.size
+                obj.size = size
+            self.modify += 1
 
-    def hget(self, key, *fields):
-        if not self._check_key(key, 1):
+    def strlen(self, key):
+        value = self.fetch(key, 0)
+        if value is False:
             return False
-        return [self.HASH[key][field] for field in fields]
+        return 0 if value is None else len(value)
 
-    def hset(self, key, **mapping):
-        if not self._check_key(key, 1):
+    def hget(self, key, *fields):
+        h = self.fetch(key, 1)
+        if h is False:
+            return False
+        if h is None:
+            return [None] * len(fields)
+        return [h.get(field) for field in fields]
+
+    def hset(self, key, mapping):
+        obj = self._lookup(key)
+        if obj is None:
+            self._add(key, 1, hash_update(None, mapping)[0], sum(hash_entry_size(f, v) for f, v in mapping.items()))
+        elif obj.type != 1:
             return False
-        self.KEYS[key] = 1
-        self.HASH[key].update(mapping)
-        self.KEYS.modify += 1
+        else:
+            h = obj.value
+            before = container_size(1, h)
+            delta = 0
+            for f, v in mapping.items():
+                old = h.get(f)
+                delta += hash_entry_size(f, v) if old is None else getsizeof(v) - getsizeof(old)
+            obj.value = hash_update(h, mapping)[0]
+            self._resize(obj, before, delta)
+        self.modify += 1
         return True
 
     def hlen(self, key):
-        if not self._check_key(key, 1):
+        h = self.fetch(key, 1)
+        if h is False:
             return False
-        return len(self.HASH[key])
+        return len(h) if h is not None else 0
 
     def hkeys(self, key):
-        if not self._check_key(key, 1):
+        h = self.fetch(key, 1)
+        if h is False:
             return False
-        return self.HASH[key].keys()
+        return h.keys() if h is not None else []
 
     def hgetall(self, key):
-        if not self._check_key(key, 1):
+        h = self.fetch(key, 1)
+        if h is False:
             return False
-        return self.HASH[key].items()
+        return h.items() if h is not None else []
 
-    def lpush(self, key, values):
-        if not self._check_key(key, 2):
+    def hscan(self, key, cursor, count, pattern=None):
+        """:return: (下一个游标, 字段值交替的列表)"""
+        fields = self.fetch(key, 1)
+        if fields is False:
             return False
-
-        self.KEYS[key] = 2
-
-        for v in values:
-            self.LIST[key].appendleft(v)
-            self.KEYS.modify += 1
-        return self.llen(key)
-
-    def rpush(self, key, values):
-        if not self._check_key(key, 2):
+        if fields is None:
+            return 0, []
+        cursor, items = scan_members(fields, fields.slots, cursor, count)
+        matcher = compile_pattern(pattern) if pattern is not None else None
+        ret = []
+        for field in items:
+            if matcher is None or matcher(field):
+                ret.append(field)
+                ret.append(fields.get(field))
+        return cursor, ret
+
+    def _push(self, key, values, left):
+        obj = self._lookup(key)
+        delta = sum(map(getsizeof, values))
+        if obj is None:
+            obj = self._add(key, 2, list_push(None, values, left), delta)
+        elif obj.type != 2:
             return False
+        else:
+            before = container_size(2, obj.value)
+            obj.value = list_push(obj.value, values, left)
+            self._resize(obj, before, delta)
+        self.modify += len(values)
+        # 有客户端阻塞在该键上时，命令执行完后唤醒
+        if key in BLOCKING.waiters:
+            BLOCKING.signal(key)
+        return len(obj.value)
 
-        self.KEYS[key] = 2
+    def lpush(self, key, values):
+        return self._push(key, values, True)
 
-        for v in values:
-            self.LIST[key].append(v)
-            self.KEYS.modify += 1
-        return self.llen(key)
+    def rpush(self, key, values):
+        return self._push(key, values, False)
 
-    def lpop(self, key):
-        if self.KEYS[key] is None:
+    def _pop(self, key, left):
+        obj = self._lookup(key)
+        if obj is None:
             return None
+        if obj.type != 2:
+            return False
 
-        if self.KEYS[key] == 2:
-            ret = self.LIST[key].popleft()
-            self.KEYS.modify += 1
+        lst = obj.value
+        before = container_size(2, lst)
+        ret = lst.popleft() if left else lst.pop()
+        self.modify += 1
+        if not lst:
+            self._delete(key)
+        else:
+            self._resize(obj, before, -getsizeof(ret))
+        return ret
 
-            if not self.LIST[key]:
-                self.KEYS.pop(key)
-            return ret
-        return False
+    def lpop(self, key):
+        return self._pop(key, True)
 
     def rpop(self, key):
-        if self.KEYS[key] is None:
-            return None
+        return self._pop(key, False)
 
-        if self.KEYS[key] == 2:
-            ret = self.LIST[key].popleft()
-            self.KEYS.modify += 1
-
-            if not self.LIST[key]:
-                self.KEYS.pop(key)
-            return ret
-        return False
+    def lmove(self, source, destination, left, to_left):
+        """
+        从source的一端弹出元素，插入destination的一端，两者可以是同一个键
+        :return: 移动的元素，source不存在返回None，任一键类型不对返回False
+        """
+        src = self._lookup(source)
+        if src is None:
+            return None
+        dst = self._lookup(destination)
+        if src.type != 2 or (dst is not None and dst.type != 2):
+            return False
+        value = self._pop(source, left)
+        self._push(destination, [value], to_left)
+        return value
 
     def llen(self, key):
-        if not self._check_key(key, 2):
+        lst = self.fetch(key, 2)
+        if lst is False:
             return False
-        return len(self.LIST[key])
+        return len(lst) if lst is not None else 0
 
     def lindex(self, key, index):
-        if not self._check_key(key, 2):
-            return False
+        lst = self.fetch(key, 2)
+        if not lst:
+            return lst
         try:
-            return self.LIST[key][index]
+            return lst[index]
         except IndexError:
             return None
 
     def lset(self, key, index, value):
-        if not self._check_key(key, 2):
+        obj = self._lookup(key)
+        if obj is None:
+            return 1
+        if obj.type != 2:
             return -1
+        before = container_size(2, obj.value)
         try:
-            self.LIST[key][index] = value
-            self.KEYS.modify += 1
-            return 0
+            obj.value, old = list_set(obj.value, index, value)
         except IndexError:
             return 1
+        self.modify += 1
+        self._resize(obj, before, getsizeof(value) - getsizeof(old))
+        return 0
 
     def sadd(self, key, members):
-        if not self._check_key(key, 3):
+        obj = self._lookup(key)
+        if obj is None:
+            value, added = set_add(None, members)
+            self._add(key, 3, value, elements_size(3, value))
+        elif obj.type != 3:
             return False
-        self.KEYS[key] = 3
-
-        self.SET[key].update(members)
-
-        self.KEYS.modify += len(members)
+        else:
+            s = obj.value
+            before = container_size(3, s)
+            if type(s) is IntSet:
+                obj.value, added = set_add(s, members)
+                # 转换为set后成员才单独占用内存，只在转换时计算一次全部成员
+                self._resize(obj, before, elements_size(3, obj.value))
+            else:
+                # 只有新成员需要计算大小，成员都已存在时什么也不用做
+                fresh = [m for m in members if m not in s]
+                if len(fresh) > 1:
+                    fresh = set(fresh)
+                added = len(fresh)
+                if added:
+                    s.update(fresh)
+                    self._resize(obj, before, sum(map(getsizeof, fresh)))
+
+        self.modify += added
 
         return True
 
     def spop(self, key):
-        if self.KEYS[key] is None:
+        obj = self._lookup(key)
+        if obj is None:
             return None
+        if obj.type != 3:
+            return False
 
-        if self.KEYS[key] == 3:
-            ret = self.SET[key].pop()
-            self.KEYS.modify += 1
+        s = obj.value
+        before = container_size(3, s)
+        ret = s.pop()
+        self.modify += 1
 
-            if not self.SET[key]:
-                self.KEYS.pop(key)
-            return ret
-        return False
+        if not s:
+            self._delete(key)
+        else:
+            self._resize(obj, before, 0 if type(s) is IntSet else -getsizeof(ret))
+        return ret
 
     def scard(self, key):
-        if not self._check_key(key, 3):
+        s = self.fetch(key, 3)
+        if s is False:
             return False
-
-        return len(self.SET[key])
+        return len(s) if s is not None else 0
 
     def smembers(self, key):
-        if not self._check_key(key, 3):
-            return False
-        return self.SET[key]
+        s = self.fetch(key, 3)
+        if s is None:
+            return []
+        return s
 
     def srem(self, key, values):
-        if not self._check_key(key, 3):
+        obj = self._lookup(key)
+        if obj is None:
+            return 0
+        if obj.type != 3:
             return False
 
-        self.SET[key] -= values
-
-        return len(self.SET[key])
-
-    def save(self):
-        dump(self, PDB_FILE)
-        print('async over')
-
-    def bgsave(self):
-        # 由于linux和windows多进程实现机制不一样，在linux下性能更佳
-        work = multiprocessing.Process(target=self.save)
-        work.start()
-
+        s = obj.value
+        before = container_size(3, s)
+        delta = 0 if type(s) is IntSet else -sum(getsizeof(m) for m in values if m in s)
+        removed = set_remove(s, values)
+        self.modify += removed
+        if not s:
+            self._delete(key)
+        elif removed:
+            self._resize(obj, before, delta)
+
+        return len(s)
+
+    def sscan(self, key, cursor, count, pattern=None):
+        """:return: (下一个游标, 成员列表)"""
+        members = self.fetch(key, 3)
+        if members is False:
+            return False
+        if members is None:
+            return 0, []
+        cursor, items = scan_members(members, members.slots, cursor, count)
+        matcher = compile_pattern(pattern) if pattern is not None else None
+        return cursor, [m for m in items if matcher is None or matcher(m)]
 
-def dump(obj, file):
-    try:
-        with open(file, 'wb') as f:
-            pickle.dump(obj, f)
-    except Exception as e:
-        print(repr(e))
+    def zadd(self, key, pairs, nx=False, xx=False, gt=False, lt=False, incr=False):
+        """
+        :param pairs: (分值, 成员)序列，incr时只有一对，分值为增量
+        :return: (新增成员数, 分值变化的已有成员数, 最后一个成员的新分值，未更新时为None)
+        """
+        obj = self._lookup(key)
+        if obj is not None and obj.type != 4:
+            return False
+        new = obj is None
+        zset = Zset() if new else obj.value
+        before = container_size(4, zset)
+
+        added = changed = delta = 0
+        score = None
+        for score, member in pairs:
+            old = zset.score(member)
+            if old is None:
+                if xx:
+                    score = None
+                    continue
+                zset.add(member, score)
+                added += 1
+                delta += zset_entry_size(member)
+                continue
+
+            if nx:
+                score = None
+                continue
+            if incr:
+                score += old
+                if math.isnan(score):
+                    raise ValueError('resulting score is not a number (NaN)')
+            if (gt and score <= old) or (lt and score >= old):
+                score = None
+                continue
+            changed += zset.add(member, score)
+
+        if new:
+            if added:
+                self._add(key, 4, zset, delta)
+        elif added:
+            self._resize(obj, before, delta)
+        self.modify += added + changed
+        return added, changed, score
+
+    def zrem(self, key, members):
+        obj = self._lookup(key)
+        if obj is None:
+            return 0
+        if obj.type != 4:
+            return False
 
+        zset = obj.value
+        before = container_size(4, zset)
+        count = delta = 0
+        for member in members:
+            if zset.remove(member):
+                count += 1
+                delta -= zset_entry_size(member)
+        self.modify += count
+        if not zset:
+            self._delete(key)
+        elif count:
+            self._resize(obj, before, delta)
+        return count
 
-def load(file):
-    try:
-        with open(file, 'rb') as f:
-            return pickle.load(f)
-    except Exception as e:
-        print('恢复失败，初始化')
-        print(repr(e))
+    def zcard(self, key):
+        zset = self.fetch(key, 4)
+        if zset is False:
+            return False
+        return len(zset) if zset is not None else 0
+
+    def zscore(self, key, member):
+        zset = self.fetch(key, 4)
+        if not zset:
+            return zset
+        return zset.score(member)
+
+    def zrank(self, key, member, reverse=False):
+        zset = self.fetch(key, 4)
+        if not zset:
+            return zset
+        return zset.rank(member, reverse)
+
+    def zcount(self, key, low, high):
+        zset = self.fetch(key, 4)
+        if not zset:
+            return 0 if zset is None else zset
+        return zset.count(low, high)
+
+    def zrange(self, key, start, stop, reverse=False):
+        """按排名取范围，返回(分值, 成员)列表"""
+        zset = self.fetch(key, 4)
+        if not zset:
+            return [] if zset is None else zset
+        return zset.range_by_rank(start, stop, reverse)
+
+    def zrangebyscore(self, key, low, high, reverse=False, offset=0, count=-1):
+        """按分值取范围，返回(分值, 成员)列表"""
+        zset = self.fetch(key, 4)
+        if not zset:
+            return [] if zset is None else zset
+        return zset.range_by_score(low, high, reverse, offset, count)
+
+    def zremrangebyscore(self, key, low, high):
+        obj = self._lookup(key)
+        if obj is None:
+            return 0
+        if obj.type != 4:
+            return False
+        zset = obj.value
+        before = container_size(4, zset)
+        items = zset.range_by_score(low, high)
+        delta = 0
+        for _, member in items:
+            zset.remove(member)
+            delta -= zset_entry_size(member)
+        self.modify += len(items)
+        if not zset:
+            self._delete(key)
+        elif items:
+            self._resize(obj, before, delta)
+        return len(items)
+
+    def zscan(self, key, cursor, count, pattern=None):
+        """:return: (下一个游标, (成员, 分值)列表)"""
+        zset = self.fetch(key, 4)
+        if not zset:
+            return (0, []) if zset is None else zset
+        scores = zset.scores
+        cursor, items = scan_members(scores, zset.slots, cursor, count)
+        matcher = compile_pattern(pattern) if pattern is not None else None
+        ret = []
+        for member in items:
+            if matcher is None or matcher(member):
+                ret.append((member, scores[member]))
+        return cursor, ret
 
 
 if __name__ == '__main__':
     RD = RedisData()
 
-    # RD.hset('b', a='b', b='b')
-    # RD.set(a='b')
-    # dump(RD, PDB_FILE)
-    print(RD.get('a'))
-    RD.save()
+    # RD.hset(b'b', {b'a': b'b', b'b': b'b'})
+    # RD.set({b'a': b'b'})
+    print(RD.get(False, b'a'))
+    snapshot.dump(RD, PDB_FILE)
@@ -0,0 +1,285 @@
+"""
+小对象的紧凑编码，参照redis的listpack和intset：
+    小hash存为字段值交替的扁平列表，小list存为普通列表，只含整数的小set存为有序的64位整数数组，
+元素个数或长度超过settings中的阈值后自动转换为HashTable、deque、HashSet，转换后不再转回
+"""
+from array import array
+from bisect import bisect_left
+from collections import deque
+import random
+
+from server.src.scan import SCAN_SMALL, member_slots
+from server.conf.settings import HASH_MAX_ZIPLIST_ENTRIES, HASH_MAX_ZIPLIST_VALUE, \
+    LIST_MAX_ZIPLIST_ENTRIES, LIST_MAX_ZIPLIST_VALUE, SET_MAX_INTSET_ENTRIES
+
+
+class ZipHash(list):
+    """字段和值交替存放的列表，提供hash需要的dict接口，查找为线性扫描"""
+    __slots__ = ()
+    # 元素不多，HSCAN一次返回全部字段，不需要槽索引
+    slots = None
+
+    def _find(self, field):
+        """字段所在位置，不存在返回-1"""
+        i = 0
+        try:
+            while True:
+                i = self.index(field, i)
+                # 值可能和字段相同，只认偶数位置
+                if not i & 1:
+                    return i
+                i += 1
+        except ValueError:
+            return -1
+
+    def __len__(self):
+        return list.__len__(self) // 2
+
+    def __iter__(self):
+        return iter(self[::2])
+
+    def __contains__(self, field):
+        return self._find(field) >= 0
+
+    def get(self, field, default=None):
+        i = self._find(field)
+        return self[i+1] if i >= 0 else default
+
+    def update(self, mapping):
+        for field, value in mapping.items():
+            i = self._find(field)
+            if i >= 0:
+                self[i+1] = value
+            else:
+                self.append(field)
+                self.append(value)
+
+    def pop(self, field, default=None):
+        i = self._find(field)
+        if i < 0:
+            return default
+        value = self[i+1]
+        del self[i:i+2]
+        return value
+
+    def keys(self):
+        return self[::2]
+
+    def values(self):
+        return self[1::2]
+
+    def items(self):
+        return zip(self[::2], self[1::2])
+
+
+class ZipList(list):
+    """小list，补上deque的两端操作，元素少时头部插入删除的移动开销可以忽略"""
+    __slots__ = ()
+
+    def appendleft(self, value):
+        self.insert(0, value)
+
+    def extendleft(self, values):
+        self[0:0] = reversed(values)
+
+    def popleft(self):
+        return self.pop(0)
+
+
+class IntSet(array):
+    """有序的64位整数数组，对外的成员仍是bytes"""
+    __slots__ = ()
+    slots = None
+
+    def __new__(cls, values=()):
+        return super().__new__(cls, 'q', sorted(values))
+
+    def __iter__(self):
+        return (b'%d' % n for n in array.__iter__(self))
+
+    def __contains__(self, member):
+        n = as_int(member)
+        if n is None:
+            return False
+        i = bisect_left(self, n)
+        return i < len(self) and self[i] == n
+
+    def add(self, n):
+        """:return: 新增返回True"""
+        i = bisect_left(self, n)
+        if i < len(self) and self[i] == n:
+            return False
+        self.insert(i, n)
+        return True
+
+    def discard(self, member):
+        """:return: 存在并删除返回True"""
+        n = as_int(member)
+        if n is None:
+            return False
+        i = bisect_left(self, n)
+        if i < len(self) and self[i] == n:
+            del self[i]
+            return True
+        return False
+
+    def pop(self):
+        """随机弹出一个成员"""
+        if not len(self):
+            raise KeyError('pop from an empty set')
+        return b'%d' % array.pop(self, random.randrange(len(self)))
+
+
+class HashTable(dict):
+    """大hash，字段超过SCAN_SMALL个后维护字段的槽索引，供HSCAN使用"""
+    __slots__ = ('slots',)
+
+    def __init__(self, items=()):
+        dict.__init__(self, items)
+        self.slots = member_slots(self) if len(self) > SCAN_SMALL else None
+
+    def update(self, mapping):
+        slots = self.slots
+        if slots is not None:
+            for field in mapping:
+                if field not in self:
+                    slots.add(field)
+        dict.update(self, mapping)
+        if slots is None and len(self) > SCAN_SMALL:
+            self.slots = member_slots(self)
+
+
+class HashSet(set):
+    """大set，成员超过SCAN_SMALL个后维护成员的槽索引，供SSCAN使用"""
+    __slots__ = ('slots',)
+
+    def __init__(self, members=()):
+        set.__init__(self, members)
+        self.slots = member_slots(self) if len(self) > SCAN_SMALL else None
+
+    def update(self, members):
+        slots = self.slots
+        if slots is None:
+            set.update(self, members)
+            if len(self) > SCAN_SMALL:
+                self.slots = member_slots(self)
+            return
+        for member in members:
+            if member not in self:
+                set.add(self, member)
+                slots.add(member)
+
+    def discard(self, member):
+        if self.slots is not None and member in self:
+            self.slots.remove(member)
+        set.discard(self, member)
+
+    def pop(self):
+        member = set.pop(self)
+        if self.slots is not None:
+            self.slots.remove(member)
+        return member
+
+
+def as_int(value):
+    """value为规范形式（无前导0、空白、正号）的64位整数时返回该整数，否则返回None"""
+    if not 0 < len(value) <= 20:
+        return None
+    try:
+        n = int(value)
+    except ValueError:
+        return None
+    if b'%d' % n != value or not -2**63 <= n < 2**63:
+        return None
+    return n
+
+
+def hash_update(h, mapping):
+    """
+    更新hash，需要时转换为dict
+    :param h: 原来的hash，None表示新建
+    :return: (更新后应保存的hash, 新增字段数)
+    """
+    if h is None:
+        h = ZipHash()
+    size = len(h)
+    if type(h) is ZipHash and (size + sum(f not in h for f in mapping) > HASH_MAX_ZIPLIST_ENTRIES or any(
+            len(k) > HASH_MAX_ZIPLIST_VALUE or len(v) > HASH_MAX_ZIPLIST_VALUE for k, v in mapping.items())):
+        h = HashTable(h.items())
+    h.update(mapping)
+    return h, len(h) - size
+
+
+def list_push(lst, values, left=False):
+    """
+    从左边或右边插入元素，需要时转换为deque
+    :param lst: 原来的list，None表示新建
+    :return: 插入后应保存的list
+    """
+    if lst is None:
+        lst = ZipList()
+    if type(lst) is ZipList and (len(lst) + len(values) > LIST_MAX_ZIPLIST_ENTRIES or any(
+            len(v) > LIST_MAX_ZIPLIST_VALUE for v in values)):
+        lst = deque(lst)
+    if left:
+        lst.extendleft(values)
+    else:
+        lst.extend(values)
+    return lst
+
+
+def list_set(lst, index, value):
+    """
+    替换index处的元素，值过长时转换为deque
+    :return: 替换后应保存的list，index越界抛出IndexError
+    """
+    old = lst[index]
+    if type(lst) is ZipList and len(value) > LIST_MAX_ZIPLIST_VALUE:
+        lst = deque(lst)
+    lst[index] = value
+    return lst, old
+
+
+def set_add(s, members):
+    """
+    添加成员，只含整数时保存为IntSet，需要时转换为set
+    :param s: 原来的set，None表示新建
+    :return: (添加后应保存的set, 新增成员数)
+    """
+    if s is None:
+        s = IntSet()
+    size = len(s)
+    if type(s) is IntSet:
+        ints = [as_int(m) for m in members]
+        if None not in ints and size + len(ints) <= SET_MAX_INTSET_ENTRIES:
+            for n in ints:
+                s.add(n)
+            return s, len(s) - size
+        s = HashSet(s)
+    s.update(members)
+    return s, len(s) - size
+
+
+def set_remove(s, members):
+    """:return: 删除的成员数"""
+    count = 0
+    for m in members:
+        if m in s:
+            s.discard(m)
+            count += 1
+    return count
+
+
+def encoding_of(tp, value):
+    """OBJECT ENCODING 返回的编码名称，与redis一致"""
+    if tp == 0:
+        if as_int(value) is not None:
+            return 'int'
+        return 'embstr' if len(value) <= 44 else 'raw'
+    if tp == 1:
+        return 'listpack' if type(value) is ZipHash else 'hashtable'
+    if tp == 2:
+        return 'listpack' if type(value) is ZipList else 'quicklist'
+    if tp == 3:
+        return 'intset' if type(value) is IntSet else 'hashtable'
+    return 'skiplist'
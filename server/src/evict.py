@@ -0,0 +1,154 @@
+"""
+内存上限与键淘汰，参照redis的近似LRU/LFU：
+    每个键的RedisObject.lru保存最近访问时间（秒），LFU策略下保存(分钟时间 << 8) | 对数访问计数，访问键时更新；
+淘汰时随机抽样几个键，按空闲程度放入固定大小的淘汰池，每次淘汰池中最该被淘汰的键
+"""
+import random
+import time
+
+from server.src.stats import STATS
+from server.conf.settings import MAXMEMORY, MAXMEMORY_POLICY, MAXMEMORY_SAMPLES, LFU_LOG_FACTOR, LFU_DECAY_TIME, \
+    LAZYFREE_LAZY_EVICTION
+
+
+NOEVICTION = 'noeviction'
+ALLKEYS_LRU = 'allkeys-lru'
+VOLATILE_LRU = 'volatile-lru'
+ALLKEYS_LFU = 'allkeys-lfu'
+VOLATILE_LFU = 'volatile-lfu'
+VOLATILE_TTL = 'volatile-ttl'
+ALLKEYS_RANDOM = 'allkeys-random'
+VOLATILE_RANDOM = 'volatile-random'
+
+POLICIES = (NOEVICTION, ALLKEYS_LRU, VOLATILE_LRU, ALLKEYS_LFU, VOLATILE_LFU,
+            VOLATILE_TTL, ALLKEYS_RANDOM, VOLATILE_RANDOM)
+
+# 淘汰池大小
+EVPOOL_SIZE = 16
+
+# 一次最多连续淘汰多久（秒），超出后先执行命令，剩下的留到下一条写命令
+EVICT_TIME_LIMIT = 0.005
+
+# 新键的LFU计数初始值，避免刚写入就被淘汰
+LFU_INIT_VAL = 5
+
+
+def lfu_init(clock):
+    """新键的lru字段，clock为秒"""
+    return ((clock // 60) & 0xFFFF) << 8 | LFU_INIT_VAL
+
+
+def lfu_decay(lru, clock):
+    """按距上次访问经过的时间衰减后的访问计数"""
+    ldt, counter = lru >> 8, lru & 255
+    if not LFU_DECAY_TIME:
+        return counter
+    now = (clock // 60) & 0xFFFF
+    elapsed = now - ldt if now >= ldt else 0xFFFF - ldt + now
+    return max(counter - elapsed // LFU_DECAY_TIME, 0)
+
+
+def lfu_touch(lru, clock):
+    """访问一次，计数先衰减再按对数概率加1，:return: 新的lru字段"""
+    counter = lfu_decay(lru, clock)
+    if counter < 255:
+        base = max(counter - LFU_INIT_VAL, 0)
+        if random.random() < 1.0 / (base * LFU_LOG_FACTOR + 1):
+            counter += 1
+    return ((clock // 60) & 0xFFFF) << 8 | counter
+
+
+class Evictor:
+    def __init__(self, maxmemory=MAXMEMORY, policy=MAXMEMORY_POLICY, samples=MAXMEMORY_SAMPLES):
+        if policy not in POLICIES:
+            raise ValueError(f'unknown maxmemory policy {policy!r}')
+        self.maxmemory = maxmemory
+        self.policy = policy
+        self.samples = samples
+        self.volatile = policy.startswith('volatile')
+        # (分数, 键)，按分数升序，分数越大越该被淘汰
+        self.pool = []
+
+    def score(self, obj, clock):
+        """键的淘汰分数"""
+        policy = self.policy
+        if policy in (ALLKEYS_LRU, VOLATILE_LRU):
+            return clock - obj.lru
+        if policy in (ALLKEYS_LFU, VOLATILE_LFU):
+            return 255 - lfu_decay(obj.lru, clock)
+        # volatile-ttl，越早过期分数越大
+        return -obj.expire
+
+    def sample(self, db, expires):
+        """随机取几个候选键，volatile策略从过期队列中取"""
+        if self.volatile:
+            return expires.sample(self.samples)
+        return db.index.sample(self.samples)
+
+    def populate(self, db, expires):
+        """抽样并把比池中更该被淘汰的键放入淘汰池"""
+        pool = self.pool
+        space = db.KEYS
+        clock = db.clock
+        for key in self.sample(db, expires):
+            obj = space.get(key)
+            if obj is None or (self.volatile and obj.expire is None):
+                continue
+            score = self.score(obj, clock)
+            if len(pool) >= EVPOOL_SIZE and score <= pool[0][0]:
+                continue
+            # 同一个键只保留一份
+            for i, (_, k) in enumerate(pool):
+                if k == key:
+                    del pool[i]
+                    break
+            pool.append((score, key))
+            pool.sort(key=lambda item: item[0])
+            if len(pool) > EVPOOL_SIZE:
+                del pool[0]
+
+    def victim(self, db, expires):
+        """选出下一个要淘汰的键，没有可淘汰的键时返回None"""
+        if self.policy in (ALLKEYS_RANDOM, VOLATILE_RANDOM):
+            for key in self.sample(db, expires):
+                obj = db.KEYS.get(key)
+                if obj is not None and not (self.volatile and obj.expire is None):
+                    return key
+            return None
+
+        self.populate(db, expires)
+        pool = self.pool
+        while pool:
+            _, key = pool.pop()
+            # 池中的键可能已被删除或取消了过期时间
+            obj = db.KEYS.get(key)
+            if obj is not None and not (self.volatile and obj.expire is None):
+                return key
+        return None
+
+    def evict(self, db, expires):
+        """
+        淘汰键直到内存低于上限
+        :param expires: 过期队列，volatile策略从中抽样
+        :return: (是否可以执行写命令, 淘汰的键列表)
+        """
+        if self.policy == NOEVICTION:
+            return db.used_memory <= self.maxmemory, []
+
+        evicted = []
+        deadline = time.perf_counter() + EVICT_TIME_LIMIT
+        while db.used_memory > self.maxmemory:
+            key = self.victim(db, expires)
+            if key is None:
+                # 没有可淘汰的键，比如volatile策略下没有设置过期时间的键
+                break
+            db.del_((key,), LAZYFREE_LAZY_EVICTION)
+            evicted.append(key)
+            if time.perf_counter() > deadline:
+                # 剩下的留到下一条写命令，本条命令照常执行
+                break
+        STATS.evicted_keys += len(evicted)
+        return db.used_memory <= self.maxmemory or bool(evicted), evicted
+
+
+EVICTOR = Evictor()
@@ -0,0 +1,89 @@
+"""
+延迟监控，参照redis的LATENCY：记录阻塞事件循环超过LATENCY_MONITOR_THRESHOLD毫秒的事件，
+如慢命令、前台保存、fork、主动过期、AOF写入，另外定时检查事件循环本身被阻塞了多久，
+每个事件保留最近LATENCY_HISTORY_LEN个采样，同一秒内只保留最大的一次
+"""
+import asyncio
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from server.conf.settings import LATENCY_MONITOR_THRESHOLD
+
+
+LATENCY_HISTORY_LEN = 160
+
+
+class LatencyEvent:
+    __slots__ = ('history', 'max')
+
+    def __init__(self):
+        # [时间戳（秒）, 延迟（毫秒）]
+        self.history = deque(maxlen=LATENCY_HISTORY_LEN)
+        self.max = 0
+
+
+class LatencyMonitor:
+    # 检查事件循环是否被阻塞的时间间隔（秒）
+    WATCH_INTERVAL = 0.1
+
+    def __init__(self, threshold=LATENCY_MONITOR_THRESHOLD):
+        self.threshold = threshold
+        self.events = {}
+
+    def add(self, name, ms):
+        """记录一次延迟，未开启或低于阈值时忽略"""
+        ms = int(ms)
+        if self.threshold <= 0 or ms < self.threshold:
+            return
+        event = self.events.get(name)
+        if event is None:
+            event = self.events[name] = LatencyEvent()
+
+        now = int(time.time())
+        history = event.history
+        if history and history[-1][0] == now:
+            history[-1][1] = max(history[-1][1], ms)
+        else:
+            history.append([now, ms])
+        event.max = max(event.max, ms)
+
+    @contextmanager
+    def measure(self, name):
+        """记录with语句块的耗时"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter() - start) * 1000)
+
+    def latest(self):
+        """LATENCY LATEST：[事件名, 最近一次的时间, 最近一次的延迟, 最大延迟]"""
+        return [[name, *event.history[-1], event.max] for name, event in sorted(self.events.items())]
+
+    def history(self, name):
+        event = self.events.get(name)
+        if event is None:
+            return []
+        return [list(sample) for sample in event.history]
+
+    def reset(self, names=None):
+        """:return: 清除的事件数"""
+        if not names:
+            count = len(self.events)
+            self.events.clear()
+            return count
+        return sum(self.events.pop(name, None) is not None for name in names)
+
+    async def watch(self):
+        """定时醒来，醒来时比预定时间晚了多少就是事件循环被阻塞的时间"""
+        if self.threshold <= 0:
+            return
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.WATCH_INTERVAL)
+            self.add('event-loop', (loop.time() - start - self.WATCH_INTERVAL) * 1000)
+
+
+LATENCY = LatencyMonitor()
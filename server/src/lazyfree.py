@@ -0,0 +1,136 @@
+"""
+惰性释放，参照redis的lazyfree：
+    CPython释放一个容器时要逐个释放其中的元素，删除上千万元素的list会阻塞事件循环。
+元素较多的值只从键空间中摘下，交给后台线程分块清空，每块之间让出GIL，事件循环在块之间照常运行
+"""
+from collections import deque
+from operator import attrgetter
+from queue import SimpleQueue
+import threading
+import time
+
+from server.src.sortedlist import SortedList
+from server.src.zset import Zset
+
+
+# 元素个数超过该值才交给后台线程，小的值直接释放更快，与redis一致
+LAZYFREE_THRESHOLD = 64
+
+# 后台线程每块释放的元素个数
+LAZYFREE_CHUNK = 1024
+
+
+def free_effort(value):
+    """释放值需要的工作量，约为元素个数，string和IntSet只需释放一块内存，记为1"""
+    if isinstance(value, (dict, set, list, deque, Zset, SortedList)):
+        return len(value)
+    return 1
+
+
+def release(value):
+    """分块清空容器，每块之间让出GIL，容器的元素为bytes、float等不可再分的对象"""
+    slots = getattr(value, 'slots', None)
+    if slots is not None:
+        # 先释放hash、set、zset的槽索引，之后逐个弹出成员时不用再维护索引
+        value.slots = None
+        release_nested(slots.slots)
+    if type(value) is Zset:
+        release(value.scores)
+        release(value.index)
+        return
+    if type(value) is SortedList:
+        # 每块最多BLOCK_SIZE个元素，整块释放
+        blocks = value.blocks
+        value.maxes.clear()
+        while blocks:
+            blocks.pop()
+            time.sleep(0)
+        return
+
+    if isinstance(value, list):
+        while value:
+            del value[-LAZYFREE_CHUNK:]
+            time.sleep(0)
+        return
+    if isinstance(value, dict):
+        pop = value.popitem
+    elif isinstance(value, (set, deque)):
+        pop = value.pop
+    else:
+        return
+    while value:
+        for _ in range(min(LAZYFREE_CHUNK, len(value))):
+            pop()
+        time.sleep(0)
+
+
+def release_nested(mapping, unwrap=None):
+    """
+    分块清空值本身也是容器的字典，如整个键空间、槽索引，每块的工作量按值的元素个数计算
+    :param unwrap: 从字典的值中取出要释放的容器，键空间中为RedisObject.value
+    """
+    budget = LAZYFREE_CHUNK
+    while mapping:
+        value = mapping.popitem()[1]
+        if unwrap is not None:
+            value = unwrap(value)
+        effort = free_effort(value)
+        if effort > LAZYFREE_THRESHOLD:
+            release(value)
+        else:
+            budget -= effort
+        del value
+        if budget <= 0:
+            budget = LAZYFREE_CHUNK
+            time.sleep(0)
+
+
+def release_keyspace(space):
+    release_nested(space, attrgetter('value'))
+
+
+class LazyFree:
+    """后台释放线程，第一次用到时启动"""
+
+    def __init__(self):
+        self.jobs = SimpleQueue()
+        self.thread = None
+        # 交给后台线程的对象数只由主线程修改，已释放的对象数只由后台线程修改，不需要加锁
+        self.queued = 0
+        self.freed = 0
+
+    @property
+    def pending(self):
+        """INFO中的lazyfree_pending_objects"""
+        return self.queued - self.freed
+
+    def free(self, value):
+        """
+        值较大时交给后台线程释放
+        :return: 是否交给了后台线程，否则调用方丢弃引用时同步释放
+        """
+        if free_effort(value) <= LAZYFREE_THRESHOLD:
+            return False
+        self.submit(value)
+        return True
+
+    def submit(self, value, func=release):
+        """
+        不论大小都交给后台线程，如FLUSHALL ASYNC摘下的整个键空间
+        :param func: 释放value的函数
+        """
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name='lazyfree', daemon=True)
+            self.thread.start()
+        self.queued += 1
+        self.jobs.put((func, value))
+
+    def _run(self):
+        while True:
+            func, value = self.jobs.get()
+            func(value)
+            del value
+            self.freed += 1
+
+
+LAZYFREE = LazyFree()
@@ -0,0 +1,66 @@
+"""
+键的内存估算，按python对象的实际大小（sys.getsizeof）计算：
+    键的大小 = 键 + 固定开销 + 容器本身 + 元素，RedisData在每次修改时按增量更新，
+MEMORY USAGE指定SAMPLES时只抽样前几个元素按平均大小估算，与redis一样是近似值
+"""
+from sys import getsizeof
+from itertools import islice
+
+from server.src.encoding import IntSet
+
+
+# 每个键固定的额外开销：RedisObject、键空间字典的表项、槽索引中集合的表项、有序键索引中的引用
+KEY_OVERHEAD = 56 + 48 + 48 + 8
+
+# 有序集合每个成员在分块有序列表中的开销：(分值, 成员)元组、float、列表中的引用
+ZSET_ENTRY_OVERHEAD = 56 + 24 + 8
+
+
+def container_size(tp, value):
+    """值本身的大小，不含元素，string即为bytes的大小"""
+    if tp == 4:
+        return getsizeof(value) + getsizeof(value.scores)
+    return getsizeof(value)
+
+
+def hash_entry_size(field, value):
+    return getsizeof(field) + getsizeof(value)
+
+
+def zset_entry_size(member):
+    return getsizeof(member) + ZSET_ENTRY_OVERHEAD
+
+
+def elements_size(tp, value, samples=0):
+    """元素占用的字节数，samples为0时计算全部元素，否则抽样估算"""
+    if tp == 0 or type(value) is IntSet:
+        # IntSet的元素直接保存在数组中
+        return 0
+    n = len(value)
+    if not n:
+        return 0
+
+    if tp == 1:
+        items = value.items()
+        picked = list(islice(items, samples)) if samples else list(items)
+        total = sum(hash_entry_size(f, v) for f, v in picked)
+    elif tp == 4:
+        members = value.scores
+        picked = list(islice(members, samples)) if samples else list(members)
+        total = sum(zset_entry_size(m) for m in picked)
+    else:
+        picked = list(islice(value, samples)) if samples else list(value)
+        total = sum(getsizeof(e) for e in picked)
+    if len(picked) == n:
+        return total
+    return int(total / len(picked) * n)
+
+
+def value_size(tp, value, samples=0):
+    """值占用的字节数"""
+    return container_size(tp, value) + elements_size(tp, value, samples)
+
+
+def key_size(key, obj, samples=0):
+    """键、值以及键空间中各索引的开销"""
+    return getsizeof(key) + KEY_OVERHEAD + value_size(obj.type, obj.value, samples)
@@ -0,0 +1,108 @@
+"""
+redis风格的glob模式匹配，模式编译一次后缓存，KEYS、SCAN MATCH等命令共用
+    *       任意个字符
+    ?       任意一个字符
+    [abc]   其中一个字符，[^abc]取反，[a-z]范围
+    \\x      转义，匹配字符x本身
+"""
+import re
+from functools import lru_cache
+
+
+# 缓存的已编译模式个数
+PATTERN_CACHE_SIZE = 256
+
+_SPECIAL = b'*?[\\'
+
+
+@lru_cache(maxsize=PATTERN_CACHE_SIZE)
+def compile_pattern(pattern: bytes):
+    """
+    把模式编译成匹配函数，纯字面量和“前缀*”的模式直接用bytes方法，其他的转成正则表达式
+    :return: 参数为bytes的函数，匹配时返回真值
+    """
+    prefix, rest = split_prefix(pattern)
+    if not rest:
+        return prefix.__eq__
+    if rest.strip(b'*') == b'':
+        return lambda string: string.startswith(prefix)
+    return re.compile(_translate(pattern), re.DOTALL).fullmatch
+
+
+def match(pattern, string):
+    return bool(compile_pattern(pattern)(string))
+
+
+def split_prefix(pattern):
+    """
+    分出模式开头的字面量前缀，如b'user:\\*:*'分为(b'user:*:', b'*')
+    :return: (前缀, 剩余的模式)
+    """
+    prefix = bytearray()
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == 92 and i + 1 < len(pattern):  # b'\\'
+            prefix.append(pattern[i+1])
+            i += 2
+            continue
+        if c in _SPECIAL:
+            break
+        prefix.append(c)
+        i += 1
+    return bytes(prefix), pattern[i:]
+
+
+def _translate(pattern):
+    """glob模式转为等价的正则表达式"""
+    res = bytearray()
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        i += 1
+        if c == 42:  # b'*'
+            if not res.endswith(b'.*'):
+                res += b'.*'
+        elif c == 63:  # b'?'
+            res += b'.'
+        elif c == 91:  # b'['
+            i = _translate_class(pattern, i, res)
+        elif c == 92 and i < n:  # b'\\'
+            res += re.escape(pattern[i:i+1])
+            i += 1
+        else:
+            res += re.escape(bytes((c,)))
+    return bytes(res)
+
+
+def _translate_class(pattern, i, res):
+    """
+    翻译[...]，与redis一致：没有闭合的]时到模式结尾为止，范围两端反了也可以，[]不匹配任何字符，[^]匹配任意字符
+    :return: ]之后的位置
+    """
+    n = len(pattern)
+    negate = i < n and pattern[i] == 94  # b'^'
+    if negate:
+        i += 1
+
+    items = []
+    while i < n and pattern[i] != 93:  # b']'
+        c = pattern[i]
+        if c == 92 and i + 1 < n:
+            items.append(re.escape(pattern[i+1:i+2]))
+            i += 2
+        elif i + 2 < n and pattern[i+1] == 45 and pattern[i+2] != 93:  # a-z
+            lo, hi = sorted((c, pattern[i+2]))
+            items.append(re.escape(bytes((lo,))) + b'-' + re.escape(bytes((hi,))))
+            i += 3
+        else:
+            items.append(re.escape(bytes((c,))))
+            i += 1
+
+    if not items:
+        res += b'.' if negate else b'(?!)'
+    else:
+        res += b'[^' if negate else b'['
+        res += b''.join(items)
+        res += b']'
+    return i + 1
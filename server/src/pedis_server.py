@@ -4,295 +4,718 @@
 
 
 import asyncio
-
-from server.src.resp_code import Resp
+import math
+import os
+import platform
+import sys
+import time
+from time import perf_counter_ns
+
+from server.src.resp_code import Resp, RespParser, RespError
 from server.src.data_struct import *
 from server.src.timer import Timer
+from server.src.command import command, lookup, all_commands, arity_error, total_calls, reset_stats
+from server.src.stats import STATS, multiplexing_api, memory_rss, memory_peak, bytes_human
+from server.src.slowlog import SLOWLOG, SLOWLOG_NS
+from server.src.latency import LATENCY
+from server.src.evict import EVICTOR
+from server.src.lazyfree import LAZYFREE
+from server.src.blocking import BLOCKING, parse_timeout, parse_side
+from server.src.pubsub import PUBSUB, SUBSCRIBER_COMMANDS
+from server.src import aof, scan
+from server.src.cluster import BROADCAST, Cluster, key_slot
+from server.src.zset import parse_score, parse_bound, format_score
+from server.src.bgsave import SAVER
+from server.conf.settings import CLIENT_OUTPUT_BUFFER_LIMIT, CLIENT_OUTPUT_BUFFER_LIMIT_PUBSUB, APPEND_ONLY, AOF_FILE, APPEND_FSYNC, \
+    HOST, PORT, WORKERS, FOREIGN_SLOT, TRANSPORT, EVENT_LOOP, TCP_BACKLOG, LATENCY_TRACKING, \
+    LATENCY_TRACKING_PERCENTILES, MAXMEMORY, MAXMEMORY_POLICY, LAZYFREE_LAZY_USER_DEL, LAZYFREE_LAZY_USER_FLUSH
 
 
 # 数据初始化
 DB = RedisData()
 TIME = Timer()
 
-# 支持命令列表
-COMMAND = {
-    'KEYS', 'DEL', 'TYPE', 'EXPIRE', 'PERSIST', 'TTL',
-    'GET', 'MGET', 'SET', 'MSET', 'STRLEN',
-    'HSET', 'HGET', 'HMSET', 'HMGET', 'HLEN', 'HKEYS', 'HGETALL',
-    'LPUSH', 'RPUSH', 'LPOP', 'RPOP', 'LLEN', 'LINDEX', 'LSET',
-    'SADD', 'SPOP', 'SCARD', 'SMEMBERS', 'SREM',
-    'SAVE', 'BGSAVE',
+# 每次从socket读取的最大字节数
+READ_SIZE = 64 * 1024
 
-}
+# 执行时间超过该值（纳秒）的命令需要记入慢查询日志或延迟监控
+SLOW_NS = min(SLOWLOG_NS if SLOWLOG_NS is not None else math.inf,
+              LATENCY.threshold * 1000000 if LATENCY.threshold > 0 else math.inf)
 
 
 class PedisServer:
     """简易版redis服务器实现"""
+
+    # 开启AOF时为AppendOnlyFile对象，所有连接共用
+    aof = None
+    # 多进程模式下为Cluster对象，负责判断键是否属于当前进程
+    cluster = None
+    # 设置了maxmemory时为Evictor对象，写命令执行前检查内存并淘汰键
+    evictor = None
+
     def __init__(self, reader, writer, database=None):
         self.reader = reader
         self.writer = writer
         self.db = database
-
-    @staticmethod
-    def command_process(data, opt='*'):
-        """解析'*，$'等后面跟的数字"""
-        if data[0] == opt and data[1:].isdigit():
-            return int(data[1:])
-        return 0
-
-    async def recv(self):
-        """接收数据，直到\r\n"""
-        try:
-            data = await self.reader.readuntil(separator=b'\r\n')
-        except (asyncio.IncompleteReadError, ConnectionResetError):
-            return -1
-        return data.decode().strip('\r\n')
+        self.parser = RespParser()
+
+        # 写命令需要以其他形式记录到AOF时（如相对时间改为绝对时间），由处理函数设置
+        self.rewrite = None
+        # 阻塞在BLPOP等命令上时为blocking.Waiter
+        self.blocked = None
+
+        # 订阅的频道和模式，有订阅时进入订阅模式，只能执行SUBSCRIBER_COMMANDS中的命令
+        self.channels = {}
+        self.patterns = {}
+        self.subscribed = False
+        # 订阅者输出缓冲区开始超过软上限的时间
+        self.soft_limit_since = None
+        # 多进程模式下其他进程的转发连接，不带键的命令只在本进程执行
+        self.peer = False
 
     async def _handle(self):
         """每个客户端连接时的回调函数"""
+        parser = self.parser
+        # 阻塞期间收到了数据，先解析缓冲区中的命令再读取
+        pending = False
         while True:
-            # 接收*...，表示接下来会收到几个指令
-            data = await self.recv()
-            if data == -1:
-                break
-
-            count = self.command_process(data.strip())
-
-            if count < 1:
-                continue
-
-            # 接收第一个命令前表示命令长度的数据
-            await self.recv()
-
-            # 第一个命令
-            com = (await self.recv()).upper()
-
-            # 根据第一个命令选择处理方式
-            if com not in COMMAND:
-                info = Resp.error(f'unknown command {com}')
-            else:
-                info = await getattr(self, com)(count-1)
-
-            # 返回给客户端
-            self.writer.write(info)
+            if not pending:
+                try:
+                    data = await self.reader.read(READ_SIZE)
+                except ConnectionResetError:
+                    break
+                if not data:
+                    break
+
+                STATS.net_input_bytes += len(data)
+                parser.feed(data)
+            pending = False
             try:
-                await self.writer.drain()
-            except ConnectionResetError:
-                continue
-
-    async def get_key(self):
-        """用于接收1个键值"""
-        r = await self.recv()
-        length = self.command_process(r, '$')
-        return (await self.reader.readexactly(length + 2)).decode().strip('\r\n')
-
-    async def get_key_value(self, count):
-        """用于接收1个键值对"""
-        mapping = {}
-        for i in range(count):
-            k = await self.get_key()
-            v = await self.get_key()
-            mapping[k] = v
-        return mapping
-
-    async def TYPE(self, count):
-        if count != 1:
-            return Resp.error('wrong number of arguments for TYPE command')
-
-        key = await self.get_key()
-
-        return Resp.ok(self.db.type_(key))
-
-    async def DEL(self, count):
-        if count < 1:
-            return Resp.error('wrong number of arguments for TYPE command')
-
-        keys = {await self.get_key() for _ in range(count)}
-
-        return Resp.integer(self.db.del_(keys))
+                commands = parser.parse()
+            except RespError as e:
+                self.writer.write(Resp.error(f'Protocol error: {e}'))
+                break
 
-    async def KEYS(self, count):
-        if count != 1:
-            return Resp.error('wrong number of arguments for KEYS command')
-        pattern = await self.get_key()
-        return Resp.encode(self.db.keys(pattern))
+            # 执行缓冲区中所有完整命令，回复先攒在输出缓冲区，最后一次性写出
+            out = []
+            size = 0
+            for args in commands:
+                info = self.execute(args)
+                if self.blocked is not None:
+                    # 阻塞命令，先写出前面的回复，等唤醒或超时后再执行后面的命令
+                    self.flush_aof()
+                    if out and not await self.flush(out):
+                        return
+                    out = []
+                    size = 0
+                    info, fed = await self.wait_blocked(info)
+                    if info is None:
+                        return
+                    pending = pending or fed
+                out.append(info)
+                if isinstance(info, bytes):
+                    size += len(info)
+
+                # 输出缓冲区超出上限时先写出并等待对端接收，慢客户端由此得到背压
+                if size >= CLIENT_OUTPUT_BUFFER_LIMIT:
+                    self.flush_aof()
+                    if not await self.flush(out):
+                        return
+                    out = []
+                    size = 0
+
+            self.flush_aof()
+            if out and not await self.flush(out):
+                return
+
+    async def wait_blocked(self, fut):
+        """
+        等待阻塞命令的回复，同时继续读取连接以便发现客户端断开，期间收到的数据先放进解析器
+        :return: (回复, 是否收到了数据)，客户端断开时回复为None，由disconnected取消阻塞
+        """
+        fed = False
+        while True:
+            read = asyncio.ensure_future(self.reader.read(READ_SIZE))
+            await asyncio.wait((fut, read), return_when=asyncio.FIRST_COMPLETED)
+            if not read.done():
+                # 等到取消真正完成，否则下次read时StreamReader仍认为有协程在等待数据
+                read.cancel()
+                await asyncio.wait((read,))
+            if not read.cancelled():
+                try:
+                    data = read.result()
+                except ConnectionResetError:
+                    data = b''
+                if not data:
+                    return None, fed
+                STATS.net_input_bytes += len(data)
+                self.parser.feed(data)
+                fed = True
+            if fut.done():
+                return fut.result(), fed
+
+    def flush_aof(self):
+        """回复客户端之前先把这批写命令写入AOF"""
+        if self.aof is not None:
+            self.aof.flush()
+
+    async def flush(self, out):
+        """把一批回复一次性写给客户端，连接断开时返回False"""
+        if self.cluster is not None:
+            # 转发给其他进程的命令，按顺序等待回复
+            for i, info in enumerate(out):
+                if not isinstance(info, bytes):
+                    out[i] = await info
+        STATS.net_output_bytes += sum(map(len, out))
+        self.writer.writelines(out)
+        try:
+            await self.writer.drain()
+        except ConnectionResetError:
+            return False
+        return True
+
+    def execute(self, args):
+        """执行一条已解析好的命令，args[0]为命令名"""
+        cmd = lookup(args[0])
+
+        # 根据命令表选择处理方式，参数个数在调用处理函数之前统一检查
+        if cmd is None:
+            return Resp.error(f"unknown command '{args[0].decode(errors='replace')}'")
+        if not cmd.check_arity(args):
+            cmd.rejected_calls += 1
+            return arity_error(cmd.name)
+        if self.subscribed and cmd.name not in SUBSCRIBER_COMMANDS:
+            cmd.rejected_calls += 1
+            return Resp.error(f"Can't execute '{cmd.name}': only (P)SUBSCRIBE / (P)UNSUBSCRIBE / PING "
+                              f"are allowed in this context")
+        if self.cluster is not None:
+            info = self.cluster.route(cmd, args)
+            if info is not None:
+                return info
+
+        write = 'write' in cmd.flags
+        if write and self.evictor is not None and self.db.used_memory > self.evictor.maxmemory:
+            if not self.free_memory() and 'denyoom' in cmd.flags:
+                cmd.rejected_calls += 1
+                return Resp.error("command not allowed when used memory > 'maxmemory'.", 'OOM')
+
+        aof_ = self.aof if write else None
+        if aof_ is not None:
+            dirty = self.db.modify
+            self.rewrite = None
+
+        start = perf_counter_ns()
+        info = cmd.proc(self, args[1:])
+        duration = perf_counter_ns() - start
+
+        # INFO commandstats、latencystats的统计
+        cmd.calls += 1
+        cmd.nsec += duration
+        if LATENCY_TRACKING:
+            cmd.histogram.record(duration)
+        if not isinstance(info, bytes):
+            # 阻塞的命令或转发给其他进程的SCAN返回Future，唤醒、超时或转发回复后才有回复
+            return info
+        if info[0] == 45:  # b'-'
+            cmd.failed_calls += 1
+        if duration >= SLOW_NS:
+            self.slow(cmd, args, duration)
+
+        # 只有真正改变了数据的写命令才记录到AOF
+        if aof_ is not None and self.db.modify != dirty:
+            aof_.feed(self.rewrite or (args,))
+        if BLOCKING.ready:
+            self.serve_blocked()
+        if self.cluster is not None and not self.peer:
+            merge = BROADCAST.get(cmd.name)
+            if merge is None and len(args) > 1:
+                merge = BROADCAST.get((cmd.name, args[1].lower()))
+            if merge is not None:
+                # KEYS、FLUSHALL等还要在其他进程上执行，合并回复
+                return self.cluster.broadcast(args, info, merge)
+        return info
+
+    def serve_blocked(self):
+        """唤醒阻塞在就绪键上的客户端，它们执行的弹出在AOF中记为LPOP、RPOP、LMOVE"""
+        served = BLOCKING.serve(self.db)
+        if served and self.aof is not None:
+            self.aof.feed(served)
+
+    def disconnected(self):
+        """连接断开后取消阻塞和订阅"""
+        BLOCKING.unblock(self)
+        PUBSUB.unsubscribe_all(self)
+
+    def subscriptions(self):
+        return len(self.channels) + len(self.patterns)
+
+    def deliver(self, data):
+        """推送发布的消息，积压的输出超出订阅者的限制时断开连接"""
+        # StreamWriter或Protocol的transport
+        transport = getattr(self.writer, 'transport', self.writer)
+        if transport.is_closing():
+            return
+        transport.write(data)
+        STATS.net_output_bytes += len(data)
+
+        hard, soft, seconds = CLIENT_OUTPUT_BUFFER_LIMIT_PUBSUB
+        size = transport.get_write_buffer_size()
+        if soft and size > soft:
+            now = time.monotonic()
+            if self.soft_limit_since is None:
+                self.soft_limit_since = now
+            elif now - self.soft_limit_since >= seconds:
+                hard = size
+        else:
+            self.soft_limit_since = None
+        if hard and size >= hard:
+            # 丢弃积压的输出，断开后由connection_lost退订
+            STATS.output_buffer_disconnections += 1
+            transport.abort()
+
+    def is_closed(self):
+        """客户端连接是否已断开"""
+        if self.reader is not None and self.reader.at_eof():
+            return True
+        return self.writer is not None and self.writer.is_closing()
+
+    def free_memory(self):
+        """
+        按淘汰策略淘汰键直到内存低于maxmemory，淘汰的键在AOF中记为DEL
+        :return: 是否可以执行会增加内存的写命令
+        """
+        ok, evicted = self.evictor.evict(self.db, Timer._queue)
+        if evicted and self.aof is not None:
+            self.aof.feed([[b'DEL', key] for key in evicted])
+        return ok
+
+    def slow(self, cmd, args, duration):
+        """记录执行时间过长的命令"""
+        if SLOWLOG_NS is not None and duration >= SLOWLOG_NS:
+            SLOWLOG.add(args, duration // 1000, self.client_addr())
+        LATENCY.add('fast-command' if 'fast' in cmd.flags else 'command', duration / 1000000)
+
+    def client_addr(self):
+        """客户端地址ip:port，重放AOF时为空"""
+        peer = self.writer.get_extra_info('peername') if self.writer is not None else None
+        if not peer:
+            return ''
+        return f'{peer[0]}:{peer[1]}'
+
+    @command(-1, 'readonly', 0, 0, 0)
+    def COMMAND(self, args):
+        """COMMAND [COUNT | INFO name ...]"""
+        commands = all_commands()
+        if not args:
+            return Resp.array([cmd.info() for cmd in commands.values()])
+
+        sub = args[0].lower()
+        if sub == b'count' and len(args) == 1:
+            return Resp.integer(len(commands))
+        if sub == b'info':
+            info = []
+            for name in args[1:]:
+                cmd = lookup(name)
+                info.append(cmd.info() if cmd is not None else None)
+            return Resp.array(info)
+        return Resp.error(f"unknown subcommand '{args[0].decode(errors='replace')}'")
+
+    @command(-2, 'readonly', 0, 0, 0)
+    def CLUSTER(self, args):
+        """CLUSTER KEYSLOT key | SLOTS | PEER，PEER由进程间的转发连接在建立时发送"""
+        sub = args[0].lower()
+        if sub == b'keyslot' and len(args) == 2:
+            return Resp.integer(key_slot(args[1]))
+        if sub == b'slots' and len(args) == 1:
+            if self.cluster is None:
+                return Resp.error('This instance has cluster support disabled')
+            return Resp.array(self.cluster.slots())
+        if sub == b'peer' and len(args) == 1:
+            self.peer = True
+            return Resp.ok()
+        return Resp.error(f"unknown subcommand '{args[0].decode(errors='replace')}'")
+
+    @command(-1, 'fast', 0, 0, 0)
+    def PING(self, args):
+        """PING [message]"""
+        if len(args) > 1:
+            return arity_error('ping')
+        if self.subscribed:
+            return Resp.array([b'pong', args[0] if args else b''])
+        return Resp.encode(args[0], '$') if args else Resp.ok('PONG')
+
+    @command(-2, 'pubsub', 0, 0, 0)
+    def SUBSCRIBE(self, args):
+        return PUBSUB.subscribe(self, args)
+
+    @command(-1, 'pubsub', 0, 0, 0)
+    def UNSUBSCRIBE(self, args):
+        return PUBSUB.unsubscribe(self, args)
+
+    @command(-2, 'pubsub', 0, 0, 0)
+    def PSUBSCRIBE(self, args):
+        return PUBSUB.psubscribe(self, args)
+
+    @command(-1, 'pubsub', 0, 0, 0)
+    def PUNSUBSCRIBE(self, args):
+        return PUBSUB.punsubscribe(self, args)
+
+    @command(3, 'pubsub fast', 0, 0, 0)
+    def PUBLISH(self, args):
+        return Resp.integer(PUBSUB.publish(args[0], args[1]))
+
+    @command(-2, 'pubsub', 0, 0, 0)
+    def PUBSUB(self, args):
+        """PUBSUB CHANNELS [pattern] | NUMSUB [channel ...] | NUMPAT"""
+        sub = args[0].lower()
+        if sub == b'channels' and len(args) <= 2:
+            return Resp.array(PUBSUB.active_channels(args[1] if len(args) == 2 else None))
+        if sub == b'numsub':
+            return Resp.array(PUBSUB.numsub(args[1:]))
+        if sub == b'numpat' and len(args) == 1:
+            return Resp.integer(len(PUBSUB.patterns))
+        return Resp.error(f"unknown subcommand '{args[0].decode(errors='replace')}'")
+
+    @command(2, 'readonly fast')
+    def TYPE(self, args):
+        return Resp.ok(self.db.type_(args[0]))
+
+    @command(-2, 'write', 1, -1)
+    def DEL(self, args):
+        return Resp.integer(self.db.del_(set(args), LAZYFREE_LAZY_USER_DEL))
+
+    @command(-2, 'write fast', 1, -1)
+    def UNLINK(self, args):
+        """与DEL相同，但元素较多的值交给后台线程释放"""
+        return Resp.integer(self.db.del_(set(args), True))
+
+    @command(-1, 'write', 0, 0, 0)
+    def FLUSHALL(self, args):
+        """FLUSHALL [ASYNC | SYNC]，只有一个数据库，与FLUSHDB相同"""
+        return self.flush_db(args)
+
+    @command(-1, 'write', 0, 0, 0)
+    def FLUSHDB(self, args):
+        """FLUSHDB [ASYNC | SYNC]"""
+        return self.flush_db(args)
+
+    def flush_db(self, args):
+        if len(args) > 1:
+            return Resp.error('syntax error')
+        lazy = LAZYFREE_LAZY_USER_FLUSH
+        if args:
+            mode = args[0].lower()
+            if mode not in (b'async', b'sync'):
+                return Resp.error('syntax error')
+            lazy = mode == b'async'
+        self.db.flush(lazy)
+        return Resp.ok()
 
-    async def EXPIRE(self, count):
-        if count != 2:
-            return Resp.error('wrong number of arguments for EXPIRE command')
-        key = await self.get_key()
+    @command(3, 'readonly', 2, 2)
+    def OBJECT(self, args):
+        """OBJECT ENCODING | IDLETIME | FREQ key"""
+        sub = args[0].lower()
+        if sub == b'encoding':
+            encoding = self.db.encoding(args[1])
+            return Resp.encode(encoding, '$') if encoding is not None else Resp.NIL
+        if sub == b'idletime':
+            idle = self.db.idletime(args[1])
+            if idle is False:
+                return Resp.error('An LFU maxmemory policy is selected, idle time not tracked.')
+            return Resp.integer(idle) if idle is not None else Resp.NIL
+        if sub == b'freq':
+            freq = self.db.freq(args[1])
+            if freq is False:
+                return Resp.error('An LFU maxmemory policy is not selected, access frequency not tracked.')
+            return Resp.integer(freq) if freq is not None else Resp.NIL
+        return Resp.error(f"unknown subcommand '{args[0].decode(errors='replace')}'")
+
+    @command(-2, 'readonly', 2, 2)
+    def MEMORY(self, args):
+        """MEMORY USAGE key [SAMPLES count] | STATS"""
+        sub = args[0].lower()
+        if sub == b'usage' and len(args) in (2, 4):
+            samples = None
+            if len(args) == 4:
+                if args[2].lower() != b'samples':
+                    return Resp.error('syntax error')
+                try:
+                    samples = int(args[3])
+                except ValueError:
+                    return Resp.error('value is not an integer or out of range')
+                if samples < 0:
+                    return Resp.error('value is out of range')
+            usage = self.db.memory_usage(args[1], samples)
+            return Resp.integer(usage) if usage is not None else Resp.NIL
+        if sub == b'stats' and len(args) == 1:
+            return Resp.array(self.memory_stats())
+        return Resp.error(f"unknown subcommand '{args[0].decode(errors='replace')}'")
+
+    def memory_stats(self):
+        """MEMORY STATS，字段与redis一致的部分：进程内存、数据集估算的内存及其占比"""
+        rss = memory_rss()
+        dataset = self.db.used_memory
+        keys = len(self.db.KEYS)
+        percentage = dataset * 100 / rss if rss else 0
+        return [
+            'peak.allocated', memory_peak(),
+            'total.allocated', rss,
+            'overhead.total', max(rss - dataset, 0),
+            'keys.count', keys,
+            'keys.bytes-per-key', dataset // keys if keys else 0,
+            'dataset.bytes', dataset,
+            'dataset.percentage', f'{percentage:.2f}',
+        ]
+
+    @command(2, 'readonly', 0, 0, 0)
+    def KEYS(self, args):
+        return Resp.encode(self.db.keys(args[0]))
+
+    @command(-2, 'readonly', 0, 0, 0)
+    def SCAN(self, args):
+        """SCAN cursor [MATCH pattern] [COUNT count] [TYPE type]"""
+        try:
+            cursor = scan.parse_cursor(args[0])
+            pattern, count, tp = scan.parse_args(args[1:], with_type=True)
+        except ValueError as e:
+            return Resp.error(str(e))
+        cluster = self.cluster
+        if cluster is not None and not self.peer:
+            # 游标的低位为进程编号，依次遍历每个进程的键空间
+            worker, cursor = cluster.split_cursor(cursor)
+            if worker != cluster.worker:
+                return cluster.scan(worker, cursor, args[1:])
+        cursor, keys = self.db.scan(cursor, count, pattern, tp)
+        if cluster is not None and not self.peer:
+            cursor = cluster.join_cursor(worker, cursor)
+        return Resp.array([b'%d' % cursor, keys])
+
+    def scan_container(self, method, args):
+        """HSCAN、SSCAN key cursor [MATCH pattern] [COUNT count]"""
+        try:
+            cursor = scan.parse_cursor(args[1])
+            pattern, count, _ = scan.parse_args(args[2:])
+        except ValueError as e:
+            return Resp.error(str(e))
+        ret = method(args[0], cursor, count, pattern)
+        if ret is False:
+            return Resp.encode(False)
+        return Resp.array([b'%d' % ret[0], ret[1]])
 
-        seconds = await self.get_key()
+    @command(3, 'write fast')
+    def EXPIRE(self, args):
+        key, seconds = args
 
         try:
             seconds = int(seconds)
         except ValueError:
             return Resp.error('value is not an integer')
 
-        if self.db.expire(key, seconds):
-            TIME.expire(key)
-            return Resp.integer(1)
-        return Resp.integer(0)
+        return Resp.integer(self.expireat(key, time.time() + seconds))
 
-    async def PERSIST(self, count):
-        if count != 1:
-            return Resp.error('wrong number of arguments for PERSIST command')
-        key = await self.get_key()
-        return Resp.integer(TIME.persist(key))
+    @command(3, 'write fast')
+    def PEXPIREAT(self, args):
+        key, when = args
 
-    async def TTL(self, count):
-        if count != 1:
-            return Resp.error('wrong number of arguments for TTL command')
-        key = await self.get_key()
+        try:
+            when = int(when)
+        except ValueError:
+            return Resp.error('value is not an integer')
 
-        return Resp.integer(self.db.ttl(key))
+        return Resp.integer(self.expireat(key, when / 1000))
 
-    async def MGET(self, count, opt='*'):
-        if count < 1:
-            return Resp.error('wrong number of arguments for MGET command')
+    def expireat(self, key, when):
+        """设置过期时间戳，AOF中统一记录为PEXPIREAT，重放时不受重放时间影响"""
+        if self.db.expireat(key, when):
+            TIME.expire(key)
+            self.rewrite = [[b'PEXPIREAT', key, b'%d' % (when * 1000)]]
+            return 1
+        return 0
 
-        keys = [await self.get_key() for _ in range(count)]
+    @command(2, 'write fast')
+    def PERSIST(self, args):
+        return Resp.integer(TIME.persist(args[0]))
 
-        m = True if opt == '*' else False
+    @command(2, 'readonly fast')
+    def TTL(self, args):
+        return Resp.integer(self.db.ttl(args[0]))
 
-        return Resp.encode(self.db.get(m, *keys), opt)
+    @command(-2, 'readonly fast', 1, -1)
+    def MGET(self, args, opt='*'):
+        m = True if opt == '*' else False
 
-    async def GET(self, count):
-        if count != 1:
-            return Resp.error('wrong number of arguments for GET command')
-        return await self.MGET(1, '$')
+        return Resp.encode(self.db.get(m, *args), opt)
 
-    async def MSET(self, count):
-        if count % 2:
-            return Resp.error('wrong number of arguments for MSET')
+    @command(2, 'readonly fast')
+    def GET(self, args):
+        value = self.db.fetch(args[0], 0)
+        if value is None:
+            return Resp.NIL
+        if value is False:
+            return Resp.encode(False)
+        return b'$%d\r\n%s\r\n' % (len(value), value)
 
-        mapping = await self.get_key_value(count//2)
+    @command(-3, 'write denyoom', 1, -1, 2)
+    def MSET(self, args):
+        if len(args) % 2:
+            return arity_error('mset')
 
-        self.db.set(**mapping)
+        self.db.set(dict(zip(args[::2], args[1::2])))
         return Resp.ok()
 
-    async def SET(self, count):
-        if count < 2:
-            return Resp.error('wrong number of arguments for SET command')
-        key = await self.get_key()
-        val = await self.get_key()
-
-        cmd = [await self.get_key() for _ in range(count-2)]
+    @command(-3, 'write denyoom')
+    def SET(self, args):
+        key, val, *cmd = args
 
         if not cmd:
-            self.db.set(**{key: val})
+            self.db.set({key: val})
             return Resp.ok()
 
-        if len(cmd) == 2 and cmd[0].lower() == 'ex':
+        if len(cmd) == 2 and cmd[0].lower() == b'ex':
             try:
                 sec = int(cmd[1])
             except ValueError:
                 return Resp.error('value is not an integer')
-            self.db.set(**{key: val})
-            self.db.expire(key, sec)
-            TIME.expire(key)
+            self.db.set({key: val})
+            self.expireat(key, time.time() + sec)
+            self.rewrite.insert(0, [b'SET', key, val])
             return Resp.ok()
         return Resp.error('syntax error')
 
-    async def HMGET(self, count, opt='*'):
-        if count < 2:
-            return Resp.error('wrong number of arguments for HMGET command')
-        key = await self.get_key()
+    @command(2, 'readonly fast')
+    def STRLEN(self, args):
+        return Resp.encode(self.db.strlen(args[0]))
 
-        fields = [await self.get_key() for _ in range(count-1)]
+    @command(-3, 'readonly fast')
+    def HMGET(self, args, opt='*'):
+        key, *fields = args
 
         return Resp.encode(self.db.hget(key, *fields), opt)
 
-    async def HGET(self, count):
-        if count != 2:
-            return Resp.error('wrong number of arguments for HGET command')
-        return await self.HMGET(2, '$')
+    @command(3, 'readonly fast')
+    def HGET(self, args):
+        return self.HMGET(args, '$')
 
-    async def HMSET(self, count):
-        count -= 1
-        if count % 2:
-            return Resp.error('ERR wrong number of arguments for HMSET')
+    @command(-4, 'write denyoom fast')
+    def HMSET(self, args):
+        if len(args) % 2 == 0:
+            return arity_error('hmset')
 
-        key = await self.get_key()
+        key = args[0]
+        mapping = dict(zip(args[1::2], args[2::2]))
 
-        mapping = await self.get_key_value(count//2)
+        return Resp.encode(self.db.hset(key, mapping))
 
-        if len(mapping) == count // 2:
-            return Resp.encode(self.db.hset(key, **mapping))
+    @command(4, 'write denyoom fast')
+    def HSET(self, args):
+        return self.HMSET(args)
 
-        return Resp.error('fail')
+    @command(2, 'readonly fast')
+    def HLEN(self, args):
+        return Resp.encode(self.db.hlen(args[0]))
 
-    async def HSET(self, count):
-        if count != 3:
-            return Resp.error('wrong number of arguments for HSET command')
-        return await self.HMSET(3)
-
-    async def HLEN(self, count):
-        if count != 1:
-            return Resp.error('wrong number of arguments for HLEN command')
-        key = await self.get_key()
-
-        return Resp.encode(self.db.hlen(key))
-
-    async def HKEYS(self, count):
-        if count != 1:
-            return Resp.error('wrong number of arguments for HKEYS command')
-        key = await self.get_key()
-        return Resp.encode(self.db.hkeys(key))
-
-    async def HGETALL(self, count):
-        if count != 1:
-            return Resp.error('wrong number of arguments for HGETALL command')
-        key = await self.get_key()
+    @command(2, 'readonly')
+    def HKEYS(self, args):
+        return Resp.encode(self.db.hkeys(args[0]))
 
+    @command(2, 'readonly')
+    def HGETALL(self, args):
         info = []
-        for k, v in self.db.hgetall(key):
+        for k, v in self.db.hgetall(args[0]):
             info.append(k)
             info.append(v)
         return Resp.encode(info)
 
-    async def LPUSH(self, count):
-        if count < 2:
-            return Resp.error('wrong number of arguments for LPUSH command')
-        key = await self.get_key()
+    @command(-3, 'readonly')
+    def HSCAN(self, args):
+        return self.scan_container(self.db.hscan, args)
 
-        values = [await self.get_key() for _ in range(count-1)]
+    @command(-3, 'write denyoom fast')
+    def LPUSH(self, args):
+        key, *values = args
 
         return Resp.encode(self.db.lpush(key, values))
 
-    async def RPUSH(self, count):
-        if count < 2:
-            return Resp.error('wrong number of arguments for RPUSH command')
-        key = await self.get_key()
-
-        values = [await self.get_key() for _ in range(count - 1)]
+    @command(-3, 'write denyoom fast')
+    def RPUSH(self, args):
+        key, *values = args
 
         return Resp.encode(self.db.rpush(key, values))
 
-    async def LPOP(self, count):
-        if count != 1:
-            return Resp.error('wrong number of arguments for LPOP command')
-        key = await self.get_key()
-        return Resp.encode(self.db.lpop(key), '$')
+    @command(2, 'write fast')
+    def LPOP(self, args):
+        return Resp.encode(self.db.lpop(args[0]), '$')
 
-    async def RPOP(self, count):
-        if count != 1:
-            return Resp.error('wrong number of arguments for RPOP command')
-        key = await self.get_key()
-        return Resp.encode(self.db.rpop(key), '$')
+    @command(2, 'write fast')
+    def RPOP(self, args):
+        return Resp.encode(self.db.rpop(args[0]), '$')
 
-    async def LLEN(self, count):
-        if count != 1:
-            return Resp.error('wrong number of arguments for LLEN command')
-        key = await self.get_key()
-        return Resp.encode(self.db.llen(key))
+    @command(-3, 'write blocking', 1, -2)
+    def BLPOP(self, args):
+        """BLPOP key [key ...] timeout"""
+        return self.blocking_pop(args, True)
 
-    async def LINDEX(self, count):
-        if count != 2:
-            return Resp.error('wrong number of arguments for LLEN command')
+    @command(-3, 'write blocking', 1, -2)
+    def BRPOP(self, args):
+        """BRPOP key [key ...] timeout"""
+        return self.blocking_pop(args, False)
 
-        key = await self.get_key()
-        index = await self.get_key()
+    def blocking_pop(self, args, left):
+        *keys, timeout = args
+        try:
+            timeout = parse_timeout(timeout)
+        except ValueError as e:
+            return Resp.error(str(e))
+
+        for key in keys:
+            value = self.db.lpop(key) if left else self.db.rpop(key)
+            if value is False:
+                return Resp.encode(False)
+            if value is not None:
+                self.rewrite = [[b'LPOP' if left else b'RPOP', key]]
+                return Resp.array([key, value])
+
+        if self.writer is None:
+            # 重放AOF时没有客户端，不阻塞，AOF中也只记录实际执行的弹出
+            return Resp.NIL_ARRAY
+        return BLOCKING.block(self, keys, timeout, left)
+
+    @command(5, 'write denyoom', 1, 2)
+    def LMOVE(self, args):
+        """LMOVE source destination LEFT|RIGHT LEFT|RIGHT"""
+        source, destination, wherefrom, whereto = args
+        try:
+            left, to_left = parse_side(wherefrom), parse_side(whereto)
+        except ValueError as e:
+            return Resp.error(str(e))
+        value = self.db.lmove(source, destination, left, to_left)
+        return Resp.encode(value, '$') if value is not None else Resp.NIL
+
+    @command(6, 'write denyoom blocking', 1, 2)
+    def BLMOVE(self, args):
+        """BLMOVE source destination LEFT|RIGHT LEFT|RIGHT timeout"""
+        source, destination, wherefrom, whereto, timeout = args
+        try:
+            left, to_left = parse_side(wherefrom), parse_side(whereto)
+            timeout = parse_timeout(timeout)
+        except ValueError as e:
+            return Resp.error(str(e))
+
+        value = self.db.lmove(source, destination, left, to_left)
+        if value is not None:
+            self.rewrite = [[b'LMOVE', *args[:4]]]
+            return Resp.encode(value, '$')
+        if self.writer is None:
+            return Resp.NIL
+        return BLOCKING.block(self, [source], timeout, left, destination, to_left)
+
+    @command(2, 'readonly fast')
+    def LLEN(self, args):
+        return Resp.encode(self.db.llen(args[0]))
+
+    @command(3, 'readonly')
+    def LINDEX(self, args):
+        key, index = args
 
         try:
             index = int(index)
@@ -300,20 +723,15 @@ class PedisServer:
             return Resp.error('value is not an integer')
         return Resp.encode(self.db.lindex(key, index), '$')
 
-    async def LSET(self, count):
-        if count != 3:
-            return Resp.error('wrong number of arguments for LSET command')
-
-        key = await self.get_key()
-        index = await self.get_key()
+    @command(4, 'write denyoom')
+    def LSET(self, args):
+        key, index, value = args
 
         try:
             index = int(index)
         except ValueError:
             return Resp.error('value is not an integer')
 
-        value = await self.get_key()
-
         ret = self.db.lset(key, index, value)
 
         if ret == 0:
@@ -323,90 +741,609 @@ class PedisServer:
         if ret == -1:
             return Resp.encode(False)
 
-    async def SADD(self, count):
-        if count < 2:
-            return Resp.error('wrong number of arguments for SADD command')
-
-        key = await self.get_key()
-
-        members = [await self.get_key() for _ in range(count-1)]
+    @command(-3, 'write denyoom fast')
+    def SADD(self, args):
+        key, *members = args
 
         return Resp.encode(self.db.sadd(key, members))
 
-    async def SPOP(self, count):
-        if count == 0 or count > 2:
-            return Resp.error('wrong number of arguments for SPOP command')
+    @command(-2, 'write fast')
+    def SPOP(self, args):
+        if len(args) > 2:
+            return arity_error('spop')
 
-        key = await self.get_key()
+        key = args[0]
 
-        if count == 1:
-            return Resp.encode(self.db.spop(key), '$')
+        if len(args) == 1:
+            ret = self.db.spop(key)
+            if isinstance(ret, bytes):
+                self.rewrite = [[b'SREM', key, ret]]
+            return Resp.encode(ret, '$')
 
         try:
-            count = int(await self.get_key())
+            count = int(args[1])
         except ValueError:
             return Resp.error('value is not an integer')
         ret = [self.db.spop(key) for _ in range(count)]
 
+        # 随机弹出的结果不确定，AOF中记录为删除具体的成员
+        members = [m for m in ret if isinstance(m, bytes)]
+        if members:
+            self.rewrite = [[b'SREM', key, *members]]
         return Resp.encode(ret)
 
-    async def SCARD(self, count):
-        if count != 1:
-            return Resp.error('wrong number of arguments for SCARD command')
-        key = await self.get_key()
-        return Resp.encode(self.db.scard(key))
+    @command(2, 'readonly fast')
+    def SCARD(self, args):
+        return Resp.encode(self.db.scard(args[0]))
+
+    @command(2, 'readonly')
+    def SMEMBERS(self, args):
+        return Resp.encode(self.db.smembers(args[0]))
+
+    @command(-3, 'write fast')
+    def SREM(self, args):
+        key, *values = args
+
+        return Resp.encode(self.db.srem(key, set(values)))
+
+    @command(-3, 'readonly')
+    def SSCAN(self, args):
+        return self.scan_container(self.db.sscan, args)
+
+    @command(-4, 'write denyoom fast')
+    def ZADD(self, args):
+        """ZADD key [NX|XX] [GT|LT] [CH] [INCR] score member [score member ...]"""
+        key = args[0]
+        opts = set()
+        i = 1
+        while i < len(args) and args[i].lower() in (b'nx', b'xx', b'gt', b'lt', b'ch', b'incr'):
+            opts.add(args[i].lower())
+            i += 1
+        rest = args[i:]
+        if not rest or len(rest) % 2:
+            return Resp.error('syntax error')
+        if b'nx' in opts and b'xx' in opts:
+            return Resp.error('XX and NX options at the same time are not compatible')
+        if len(opts & {b'nx', b'gt', b'lt'}) > 1:
+            return Resp.error('GT, LT, and/or NX options at the same time are not compatible')
+        incr = b'incr' in opts
+        if incr and len(rest) != 2:
+            return Resp.error('INCR option supports a single increment-element pair')
 
-    async def SMEMBERS(self, count):
-        if count != 1:
-            return Resp.error('wrong number of arguments for SMEMBERS command')
+        try:
+            pairs = [(parse_score(rest[j]), rest[j+1]) for j in range(0, len(rest), 2)]
+            ret = self.db.zadd(key, pairs, b'nx' in opts, b'xx' in opts, b'gt' in opts, b'lt' in opts, incr)
+        except ValueError as e:
+            return Resp.error(str(e))
+        if ret is False:
+            return Resp.encode(False)
 
-        key = await self.get_key()
+        added, changed, score = ret
+        if incr:
+            return Resp.encode(format_score(score), '$') if score is not None else Resp.NIL
+        return Resp.integer(added + changed if b'ch' in opts else added)
+
+    @command(4, 'write denyoom fast')
+    def ZINCRBY(self, args):
+        key, increment, member = args
+        return self.ZADD([key, b'INCR', increment, member])
+
+    @command(-3, 'write fast')
+    def ZREM(self, args):
+        key, *members = args
+        return Resp.encode(self.db.zrem(key, members))
+
+    @command(2, 'readonly fast')
+    def ZCARD(self, args):
+        return Resp.encode(self.db.zcard(args[0]))
+
+    @command(3, 'readonly fast')
+    def ZSCORE(self, args):
+        score = self.db.zscore(*args)
+        if score is False:
+            return Resp.encode(False)
+        return Resp.encode(format_score(score), '$') if score is not None else Resp.NIL
 
-        return Resp.encode(self.db.smembers(key))
+    @command(3, 'readonly fast')
+    def ZRANK(self, args, reverse=False):
+        rank = self.db.zrank(args[0], args[1], reverse)
+        if rank is None:
+            return Resp.NIL
+        return Resp.encode(rank)
 
-    async def SREM(self, count):
-        if count < 2:
-            return Resp.error('wrong number of arguments for REM command')
+    @command(3, 'readonly fast')
+    def ZREVRANK(self, args):
+        return self.ZRANK(args, True)
 
-        key = await self.get_key()
+    @command(4, 'readonly fast')
+    def ZCOUNT(self, args):
+        try:
+            low, high = parse_bound(args[1]), parse_bound(args[2])
+        except ValueError as e:
+            return Resp.error(str(e))
+        return Resp.encode(self.db.zcount(args[0], low, high))
+
+    @command(-4, 'readonly')
+    def ZRANGE(self, args):
+        """ZRANGE key start stop [BYSCORE] [REV] [LIMIT offset count] [WITHSCORES]"""
+        key, start, stop, *opts = args
+        byscore = rev = withscores = False
+        limit = None
+        i = 0
+        while i < len(opts):
+            opt = opts[i].lower()
+            if opt == b'byscore':
+                byscore = True
+            elif opt == b'rev':
+                rev = True
+            elif opt == b'withscores':
+                withscores = True
+            elif opt == b'limit' and i + 2 < len(opts):
+                limit = opts[i+1:i+3]
+                i += 2
+            else:
+                return Resp.error('syntax error')
+            i += 1
+
+        if byscore:
+            # REV时start、stop分别是最大值和最小值
+            if rev:
+                start, stop = stop, start
+            return self.zrange_by_score(key, start, stop, rev, limit, withscores)
+        if limit is not None:
+            return Resp.error('syntax error, LIMIT is only supported in combination with either BYSCORE or BYLEX')
+        return self.zrange_by_rank(key, start, stop, rev, withscores)
+
+    @command(-4, 'readonly')
+    def ZREVRANGE(self, args):
+        """ZREVRANGE key start stop [WITHSCORES]"""
+        key, start, stop, *opts = args
+        if opts and (len(opts) > 1 or opts[0].lower() != b'withscores'):
+            return Resp.error('syntax error')
+        return self.zrange_by_rank(key, start, stop, True, bool(opts))
+
+    @command(-4, 'readonly')
+    def ZRANGEBYSCORE(self, args, rev=False):
+        """ZRANGEBYSCORE key min max [WITHSCORES] [LIMIT offset count]"""
+        key, low, high, *opts = args
+        withscores = False
+        limit = None
+        i = 0
+        while i < len(opts):
+            opt = opts[i].lower()
+            if opt == b'withscores':
+                withscores = True
+            elif opt == b'limit' and i + 2 < len(opts):
+                limit = opts[i+1:i+3]
+                i += 2
+            else:
+                return Resp.error('syntax error')
+            i += 1
+        return self.zrange_by_score(key, low, high, rev, limit, withscores)
+
+    @command(-4, 'readonly')
+    def ZREVRANGEBYSCORE(self, args):
+        """ZREVRANGEBYSCORE key max min [WITHSCORES] [LIMIT offset count]"""
+        key, high, low, *opts = args
+        return self.ZRANGEBYSCORE([key, low, high, *opts], True)
+
+    @command(4, 'write')
+    def ZREMRANGEBYSCORE(self, args):
+        try:
+            low, high = parse_bound(args[1]), parse_bound(args[2])
+        except ValueError as e:
+            return Resp.error(str(e))
+        return Resp.encode(self.db.zremrangebyscore(args[0], low, high))
+
+    @command(-3, 'readonly')
+    def ZSCAN(self, args):
+        try:
+            cursor = scan.parse_cursor(args[1])
+            pattern, count, _ = scan.parse_args(args[2:])
+        except ValueError as e:
+            return Resp.error(str(e))
+        ret = self.db.zscan(args[0], cursor, count, pattern)
+        if ret is False:
+            return Resp.encode(False)
+        return Resp.array([b'%d' % ret[0], [x for member, score in ret[1] for x in (member, format_score(score))]])
 
-        values = {await self.get_key() for _ in range(count-1)}
+    def zrange_by_rank(self, key, start, stop, rev, withscores):
+        try:
+            start, stop = int(start), int(stop)
+        except ValueError:
+            return Resp.error('value is not an integer or out of range')
+        return self.zrange_reply(self.db.zrange(key, start, stop, rev), withscores)
 
-        return Resp.encode(self.db.srem(key, values))
+    def zrange_by_score(self, key, low, high, rev, limit, withscores):
+        try:
+            low, high = parse_bound(low), parse_bound(high)
+        except ValueError as e:
+            return Resp.error(str(e))
+        offset, count = 0, -1
+        if limit is not None:
+            try:
+                offset, count = int(limit[0]), int(limit[1])
+            except ValueError:
+                return Resp.error('value is not an integer or out of range')
+        return self.zrange_reply(self.db.zrangebyscore(key, low, high, rev, offset, count), withscores)
 
-    async def SAVE(self, *args):
-        self.db.save()
+    @staticmethod
+    def zrange_reply(items, withscores):
+        """items为(分值, 成员)列表"""
+        if items is False:
+            return Resp.encode(False)
+        if withscores:
+            return Resp.array([x for score, member in items for x in (member, format_score(score))])
+        return Resp.array([member for _, member in items])
+
+    @command(1, 'admin', 0, 0, 0)
+    def SAVE(self, args):
+        if SAVER.child is not None:
+            return Resp.error('Background save already in progress')
+        SAVER.save(self.db)
         return Resp.ok()
 
-    async def BGSAVE(self, *args):
-        self.db.bgsave()
-        return Resp.ok('Background saving started')
+    @command(-1, 'admin', 0, 0, 0)
+    def BGSAVE(self, args):
+        # 已有子进程在运行时不会同时再开一个，而是在其结束后再保存一次
+        return Resp.ok(f'Background saving {SAVER.bgsave(self.db)}')
+
+    @command(1, 'readonly fast', 0, 0, 0)
+    def LASTSAVE(self, args):
+        return Resp.integer(SAVER.last_save)
+
+    @command(1, 'admin', 0, 0, 0)
+    def BGREWRITEAOF(self, args):
+        if self.aof is None:
+            return Resp.error('AOF is not enabled')
+        status = self.aof.start_rewrite(self.db)
+        if status == 'in progress':
+            return Resp.error('Background append only file rewriting already in progress')
+        return Resp.ok(f'Background append only file rewriting {status}')
+
+    @command(-2, 'admin', 0, 0, 0)
+    def CONFIG(self, args):
+        """CONFIG RESETSTAT"""
+        sub = args[0].lower()
+        if sub == b'resetstat' and len(args) == 1:
+            reset_stats()
+            STATS.reset()
+            return Resp.ok()
+        return Resp.error(f"unknown subcommand '{args[0].decode(errors='replace')}'")
+
+    @command(-2, 'admin', 0, 0, 0)
+    def SLOWLOG(self, args):
+        """SLOWLOG GET [count] | LEN | RESET"""
+        sub = args[0].lower()
+        if sub == b'get' and len(args) <= 2:
+            count = 10
+            if len(args) == 2:
+                try:
+                    count = int(args[1])
+                except ValueError:
+                    count = -2
+                if count < -1:
+                    return Resp.error('count should be greater than or equal to -1')
+            return Resp.array(SLOWLOG.get(count))
+        if sub == b'len' and len(args) == 1:
+            return Resp.integer(len(SLOWLOG))
+        if sub == b'reset' and len(args) == 1:
+            SLOWLOG.reset()
+            return Resp.ok()
+        return Resp.error(f"unknown subcommand '{args[0].decode(errors='replace')}'")
+
+    @command(-2, 'admin', 0, 0, 0)
+    def LATENCY(self, args):
+        """LATENCY LATEST | HISTORY event | RESET [event ...]"""
+        sub = args[0].lower()
+        if sub == b'latest' and len(args) == 1:
+            return Resp.array(LATENCY.latest())
+        if sub == b'history' and len(args) == 2:
+            return Resp.array(LATENCY.history(args[1].decode(errors='replace')))
+        if sub == b'reset':
+            return Resp.integer(LATENCY.reset([name.decode(errors='replace') for name in args[1:]]))
+        return Resp.error(f"unknown subcommand '{args[0].decode(errors='replace')}'")
+
+    @command(-1, 'readonly', 0, 0, 0)
+    def INFO(self, args):
+        """INFO [section ...]，不带参数时不包括commandstats、latencystats，all、everything包括所有部分"""
+        sections = {
+            'server': self.info_server,
+            'clients': self.info_clients,
+            'memory': self.info_memory,
+            'persistence': self.info_persistence,
+            'stats': self.info_stats,
+            'commandstats': self.info_commandstats,
+            'latencystats': self.info_latencystats,
+            'keyspace': self.info_keyspace,
+        }
+        selected = set()
+        for name in [arg.decode(errors='replace').lower() for arg in args] or ['default']:
+            if name in ('all', 'everything'):
+                selected.update(sections)
+            elif name == 'default':
+                selected.update(sections)
+                selected -= {'commandstats', 'latencystats'}
+            elif name in sections:
+                selected.add(name)
+
+        lines = []
+        for name in sections:
+            if name not in selected:
+                continue
+            lines.append(f'# {name.capitalize()}')
+            lines.extend(f'{k}:{v}' for k, v in sections[name]().items())
+            lines.append('')
+        return Resp.encode('\r\n'.join(lines), '$')
+
+    def info_server(self):
+        now = time.time()
+        uptime = int(now - STATS.start_time)
+        return {
+            'redis_mode': 'cluster' if self.cluster is not None else 'standalone',
+            'os': f'{platform.system()} {platform.release()} {platform.machine()}',
+            'arch_bits': 64 if sys.maxsize > 2**32 else 32,
+            'multiplexing_api': multiplexing_api(),
+            'transport': TRANSPORT,
+            'python_version': platform.python_version(),
+            'process_id': os.getpid(),
+            'tcp_port': PORT,
+            'server_time_usec': int(now * 1000000),
+            'uptime_in_seconds': uptime,
+            'uptime_in_days': uptime // 86400,
+            'executable': sys.executable,
+        }
+
+    def info_clients(self):
+        return {
+            'connected_clients': STATS.connected_clients,
+        }
+
+    def info_memory(self):
+        rss = memory_rss()
+        peak = memory_peak()
+        return {
+            'used_memory': self.db.used_memory,
+            'used_memory_human': bytes_human(self.db.used_memory),
+            'used_memory_rss': rss,
+            'used_memory_rss_human': bytes_human(rss),
+            'used_memory_peak': peak,
+            'used_memory_peak_human': bytes_human(peak),
+            'maxmemory': MAXMEMORY,
+            'maxmemory_human': bytes_human(MAXMEMORY),
+            'maxmemory_policy': MAXMEMORY_POLICY,
+            'lazyfree_pending_objects': LAZYFREE.pending,
+        }
+
+    def info_stats(self):
+        return {
+            'total_connections_received': STATS.connections_received,
+            'total_commands_processed': total_calls(),
+            'instantaneous_ops_per_sec': STATS.ops_per_sec(),
+            'total_net_input_bytes': STATS.net_input_bytes,
+            'total_net_output_bytes': STATS.net_output_bytes,
+            'expired_keys': STATS.expired_keys,
+            'evicted_keys': STATS.evicted_keys,
+            'lazyfreed_objects': LAZYFREE.freed,
+            'pubsub_channels': len(PUBSUB.channels),
+            'pubsub_patterns': len(PUBSUB.patterns),
+            'client_output_buffer_limit_disconnections': STATS.output_buffer_disconnections,
+        }
+
+    def info_commandstats(self):
+        info = {}
+        for name, cmd in sorted(all_commands().items()):
+            if not cmd.calls and not cmd.rejected_calls:
+                continue
+            per_call = cmd.nsec / cmd.calls / 1000 if cmd.calls else 0
+            info[f'cmdstat_{name}'] = f'calls={cmd.calls},usec={cmd.nsec // 1000},usec_per_call={per_call:.2f},' \
+                                      f'rejected_calls={cmd.rejected_calls},failed_calls={cmd.failed_calls}'
+        return info
+
+    def info_latencystats(self):
+        """各命令耗时的分位数（微秒），由直方图估计"""
+        info = {}
+        for name, cmd in sorted(all_commands().items()):
+            if not cmd.histogram.total:
+                continue
+            info[f'latency_percentiles_usec_{name}'] = ','.join(
+                f'p{q:g}={cmd.histogram.percentile(q) / 1000:.3f}' for q in LATENCY_TRACKING_PERCENTILES)
+        return info
+
+    def info_keyspace(self):
+        if not self.db.KEYS:
+            return {}
+        return {'db0': f'keys={len(self.db.KEYS)},expires={self.db.volatile}'}
+
+    def info_persistence(self):
+        info = {'loading': 0}
+        info.update(SAVER.info(self.db))
+
+        aof_ = self.aof
+        info['aof_enabled'] = int(aof_ is not None)
+        if aof_ is not None:
+            info['aof_rewrite_in_progress'] = int(aof_.child is not None)
+            info['aof_rewrite_scheduled'] = int(aof_.scheduled)
+            info['aof_current_size'] = aof_.size
+            info['aof_base_size'] = aof_.base_size
+        return info
 
 
 async def handle(reader, writer):
     server = PedisServer(reader, writer, DB)
     client = writer.get_extra_info('peername')
     # print(f'get new client {client!r}')
-    await server._handle()
+    STATS.connections_received += 1
+    STATS.connected_clients += 1
+    try:
+        await server._handle()
+    except asyncio.CancelledError:
+        # 服务器关闭时仍在连接的客户端（包括进程间转发连接）直接断开
+        pass
+    finally:
+        STATS.connected_clients -= 1
+        server.disconnected()
     # print(client, 'leave')
     writer.close()
 
 
-async def main():
-    server = await asyncio.start_server(handle, '127.0.0.1', '12345')
+class PedisProtocol(asyncio.Protocol):
+    """
+    基于Protocol的连接处理，收到数据时直接回调data_received喂给解析器，
+    省掉StreamReader每次读取的缓冲区拷贝和Future，回复直接写入transport
+    """
+    def __init__(self):
+        self.transport = None
+        self.server = None
+        # 等待转发回复期间暂停执行后续命令
+        self.waiting = False
+        # 输出缓冲区超过上限时transport暂停写入通知
+        self.paused = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+        # 写缓冲区超出上限时暂停读取，慢客户端由此得到背压
+        transport.set_write_buffer_limits(CLIENT_OUTPUT_BUFFER_LIMIT)
+        self.server = PedisServer(None, transport, DB)
+        STATS.connections_received += 1
+        STATS.connected_clients += 1
+
+    def connection_lost(self, exc):
+        STATS.connected_clients -= 1
+        self.server.disconnected()
+
+    def data_received(self, data):
+        STATS.net_input_bytes += len(data)
+        self.server.parser.feed(data)
+        if not self.waiting:
+            self.process([])
+
+    def process(self, commands):
+        """执行commands以及缓冲区中所有完整命令，回复攒齐后一次性写出"""
+        server = self.server
+        try:
+            commands += server.parser.parse()
+        except RespError as e:
+            self.transport.write(Resp.error(f'Protocol error: {e}'))
+            self.transport.close()
+            return
+
+        out = []
+        for i, args in enumerate(commands):
+            info = server.execute(args)
+            if not isinstance(info, bytes):
+                # 转发给其他进程的命令或阻塞命令，等回复到了再按顺序执行后面的命令
+                self.waiting = True
+                if server.blocked is None:
+                    self.transport.pause_reading()
+                asyncio.ensure_future(self.wait(info, commands[i+1:]))
+                break
+            out.append(info)
+
+        server.flush_aof()
+        if out:
+            STATS.net_output_bytes += sum(map(len, out))
+            self.transport.writelines(out)
+
+    async def wait(self, fut, commands):
+        info = await fut
+        if self.transport.is_closing():
+            return
+        STATS.net_output_bytes += len(info)
+        self.transport.write(info)
+        self.waiting = False
+        if not self.paused:
+            self.transport.resume_reading()
+        self.process(commands)
+
+    def pause_writing(self):
+        self.paused = True
+        self.transport.pause_reading()
+
+    def resume_writing(self):
+        self.paused = False
+        if not self.waiting:
+            self.transport.resume_reading()
+
+
+async def start_server(host, port, reuse_port=None):
+    """按TRANSPORT选择基于Protocol或StreamReader/StreamWriter的服务器"""
+    if TRANSPORT == 'protocol':
+        return await asyncio.get_running_loop().create_server(
+            PedisProtocol, host, port, backlog=TCP_BACKLOG, reuse_port=reuse_port)
+    return await asyncio.start_server(handle, host, port, backlog=TCP_BACKLOG, reuse_port=reuse_port)
+
+
+def setup_event_loop(name=EVENT_LOOP):
+    """
+    按配置选择事件循环，需在asyncio.run之前调用，uvloop未安装时退回标准库的事件循环
+    :return: 实际使用的事件循环名称
+    """
+    if name == 'uvloop':
+        try:
+            import uvloop
+        except ImportError:
+            print('uvloop is not installed, fall back to asyncio event loop')
+            return 'asyncio'
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return name
 
-    host = server.sockets[0].getsockname()
-    print(f'Serving on {host}')
+
+def raise_open_files_limit():
+    """把打开文件数的软限制提高到硬限制，每个客户端连接占一个文件描述符"""
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft != hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+
+async def main(worker=0, workers=WORKERS):
+    """
+    :param worker: 多进程模式下当前进程的编号
+    :param workers: 工作进程数，大于1时只负责自己的槽，其他键转发或重定向
+    """
+    if APPEND_ONLY:
+        # 重放AOF时直接走命令处理流程，此时还未开启AOF记录
+        count = aof.load(AOF_FILE, PedisServer(None, None, DB).execute)
+        if count >= 0:
+            print(f'AOF loaded {count} commands')
+        else:
+            # 首次开启AOF，先把从快照恢复的数据写成AOF，保证AOF是完整的
+            aof.rewrite(DB, AOF_FILE)
+        PedisServer.aof = aof.AppendOnlyFile(AOF_FILE, APPEND_FSYNC)
+        asyncio.create_task(PedisServer.aof.cron(DB))
+
+    # 加载数据时不淘汰，超出的部分在之后的写命令前淘汰
+    if MAXMEMORY:
+        PedisServer.evictor = EVICTOR
+
+    raise_open_files_limit()
+    servers = [await start_server(HOST, PORT, reuse_port=workers > 1 or None)]
+    if workers > 1:
+        PedisServer.cluster = Cluster(worker, workers, HOST, PORT, FOREIGN_SLOT)
+        servers.append(await start_server(HOST, PedisServer.cluster.port))
+
+    for server in servers:
+        host = server.sockets[0].getsockname()
+        print(f'Serving on {host}')
 
     Timer(asyncio.get_running_loop())
+    asyncio.create_task(STATS.cron(total_calls))
+    asyncio.create_task(LATENCY.watch())
 
     try:
-        async with server:
-            await server.serve_forever()
+        await asyncio.gather(*(server.serve_forever() for server in servers))
     finally:
-        DB.save()
+        SAVER.kill()
+        SAVER.save(DB)
+        if PedisServer.aof is not None:
+            PedisServer.aof.close()
 
 if __name__ == '__main__':
+    setup_event_loop()
     asyncio.run(main())
 
 
@@ -0,0 +1,124 @@
+"""
+发布订阅：频道 -> 订阅的客户端，模式 -> (编译后的匹配函数, 订阅的客户端)，
+PUBLISH时每条消息只编码一次，同一份bytes写给所有订阅者
+"""
+from server.src.pattern import compile_pattern
+from server.src.resp_code import Resp
+
+
+# 订阅模式下允许执行的命令
+SUBSCRIBER_COMMANDS = frozenset(('subscribe', 'unsubscribe', 'psubscribe', 'punsubscribe', 'ping'))
+
+
+class PubSub:
+    def __init__(self):
+        # 频道 -> {客户端: None}，dict保持订阅的先后顺序
+        self.channels = {}
+        # 模式 -> (匹配函数, {客户端: None})
+        self.patterns = {}
+
+    def subscribe(self, client, channels):
+        """:return: 每个频道一条subscribe回复"""
+        out = []
+        for channel in channels:
+            if channel not in client.channels:
+                client.channels[channel] = None
+                clients = self.channels.get(channel)
+                if clients is None:
+                    clients = self.channels[channel] = {}
+                clients[client] = None
+            out.append(Resp.array([b'subscribe', channel, client.subscriptions()]))
+        client.subscribed = True
+        return b''.join(out)
+
+    def unsubscribe(self, client, channels):
+        """channels为空时退订所有频道，:return: 每个频道一条unsubscribe回复"""
+        if not channels:
+            channels = list(client.channels)
+            if not channels:
+                return Resp.array([b'unsubscribe', None, client.subscriptions()])
+        out = []
+        for channel in channels:
+            if client.channels.pop(channel, 0) is None:
+                clients = self.channels[channel]
+                del clients[client]
+                if not clients:
+                    del self.channels[channel]
+            out.append(Resp.array([b'unsubscribe', channel, client.subscriptions()]))
+        client.subscribed = client.subscriptions() > 0
+        return b''.join(out)
+
+    def psubscribe(self, client, patterns):
+        out = []
+        for pattern in patterns:
+            if pattern not in client.patterns:
+                client.patterns[pattern] = None
+                entry = self.patterns.get(pattern)
+                if entry is None:
+                    entry = self.patterns[pattern] = (compile_pattern(pattern), {})
+                entry[1][client] = None
+            out.append(Resp.array([b'psubscribe', pattern, client.subscriptions()]))
+        client.subscribed = True
+        return b''.join(out)
+
+    def punsubscribe(self, client, patterns):
+        if not patterns:
+            patterns = list(client.patterns)
+            if not patterns:
+                return Resp.array([b'punsubscribe', None, client.subscriptions()])
+        out = []
+        for pattern in patterns:
+            if client.patterns.pop(pattern, 0) is None:
+                clients = self.patterns[pattern][1]
+                del clients[client]
+                if not clients:
+                    del self.patterns[pattern]
+            out.append(Resp.array([b'punsubscribe', pattern, client.subscriptions()]))
+        client.subscribed = client.subscriptions() > 0
+        return b''.join(out)
+
+    def unsubscribe_all(self, client):
+        """客户端断开连接时退订所有频道和模式"""
+        if client.subscribed:
+            self.unsubscribe(client, ())
+            self.punsubscribe(client, ())
+
+    def publish(self, channel, message):
+        """
+        发布消息，每个订阅的频道或模式只编码一次
+        :return: 收到消息的客户端数
+        """
+        receivers = 0
+        # 断开慢订阅者时connection_lost在下一轮事件循环才调用，遍历期间字典不会改变
+        clients = self.channels.get(channel)
+        if clients:
+            data = Resp.array([b'message', channel, message])
+            for client in clients:
+                client.deliver(data)
+            receivers += len(clients)
+
+        for pattern, (matcher, clients) in self.patterns.items():
+            if matcher(channel):
+                data = Resp.array([b'pmessage', pattern, channel, message])
+                for client in clients:
+                    client.deliver(data)
+                receivers += len(clients)
+        return receivers
+
+    def active_channels(self, pattern=None):
+        """PUBSUB CHANNELS，至少有一个订阅者的频道"""
+        if pattern is None:
+            return list(self.channels)
+        matcher = compile_pattern(pattern)
+        return [channel for channel in self.channels if matcher(channel)]
+
+    def numsub(self, channels):
+        """PUBSUB NUMSUB，频道和订阅者数交替的列表"""
+        ret = []
+        for channel in channels:
+            ret.append(channel)
+            ret.append(len(self.channels.get(channel, ())))
+        return ret
+
+
+PUBSUB = PubSub()
@@ -1,9 +1,136 @@
 """
 RESP协议部分实现
 """
+from server.conf.settings import PROTO_MAX_BULK_LEN, PROTO_MAX_MULTIBULK_LEN, PROTO_INLINE_MAX_SIZE, \
+    CLIENT_QUERY_BUFFER_LIMIT
+
+
+class RespError(Exception):
+    """客户端发送的数据不符合RESP协议"""
+
+
+class RespParser:
+    """
+    增量式RESP请求解析器，所有数据都追加到同一个bytearray中，
+    每次解析出缓冲区中所有完整的命令帧，不完整的帧保留解析状态等待后续数据。
+    参数个数、参数长度、长度行和缓冲区大小超出settings中的限制时抛出RespError，避免客户端让服务器无限制地缓存数据
+    """
+    __slots__ = ('buf', 'args', 'multibulk', 'bulklen', 'argsize')
+
+    def __init__(self):
+        self.buf = bytearray()
+
+        # 当前未完成的命令帧：已解析的参数、剩余参数个数、当前参数长度
+        self.args = []
+        self.multibulk = 0
+        self.bulklen = -1
+        # 当前命令帧已解析的参数的总字节数
+        self.argsize = 0
+
+    def feed(self, data):
+        """追加从网络收到的数据"""
+        self.buf += data
+
+    def parse(self):
+        """
+        解析缓冲区中所有完整的命令
+        :return: 命令列表，每个命令为参数列表
+        协议错误时，若之前已经解析出命令则先返回，错误数据留在缓冲区，下次调用时抛出RespError
+        """
+        buf = self.buf
+        size = len(buf)
+        pos = 0
+        commands = []
+
+        # 参数直接从memoryview切片生成bytes，只拷贝一次，不做任何解码
+        view = memoryview(buf)
+        try:
+            while pos < size:
+                if not self.multibulk:
+                    if buf[pos] != 42:  # b'*'
+                        # 内联命令，如telnet直接输入的 PING\r\n
+                        end = buf.find(b'\n', pos)
+                        if end < 0:
+                            if size - pos > PROTO_INLINE_MAX_SIZE:
+                                raise RespError('too big inline request')
+                            break
+                        args = bytes(view[pos:end]).split()
+                        pos = end + 1
+                        if args:
+                            commands.append(args)
+                        continue
+
+                    end = buf.find(b'\r\n', pos)
+                    if end < 0:
+                        if size - pos > PROTO_INLINE_MAX_SIZE:
+                            raise RespError('too big mbulk count string')
+                        break
+                    count = self._number(buf, pos, end, 'invalid multibulk length')
+                    if count > PROTO_MAX_MULTIBULK_LEN:
+                        raise RespError('invalid multibulk length')
+                    pos = end + 2
+                    if count <= 0:
+                        continue
+                    self.multibulk = count
+                    self.args = []
+                    self.argsize = 0
+
+                while self.multibulk:
+                    if self.bulklen < 0:
+                        end = buf.find(b'\r\n', pos)
+                        if end < 0:
+                            if size - pos > PROTO_INLINE_MAX_SIZE:
+                                raise RespError('too big bulk count string')
+                            break
+                        if buf[pos] != 36:  # b'$'
+                            raise RespError(f"expected '$', got '{chr(buf[pos])}'")
+                        bulklen = self._number(buf, pos, end, 'invalid bulk length')
+                        if bulklen < 0 or bulklen > PROTO_MAX_BULK_LEN:
+                            raise RespError('invalid bulk length')
+                        self.bulklen = bulklen
+                        pos = end + 2
+
+                    end = pos + self.bulklen
+                    if end + 2 > size:
+                        break
+                    self.args.append(bytes(view[pos:end]))
+                    self.argsize += end - pos
+                    pos = end + 2
+                    self.bulklen = -1
+                    self.multibulk -= 1
+
+                if self.multibulk:
+                    break
+                commands.append(self.args)
+                self.args = []
+                self.argsize = 0
+
+            # 不完整的命令帧等待后续数据，已缓存的数据不能超过上限
+            if size - pos + self.argsize > CLIENT_QUERY_BUFFER_LIMIT:
+                raise RespError('query buffer limit exceeded')
+        except RespError:
+            if not commands:
+                raise
+        finally:
+            view.release()
+            del buf[:pos]
+
+        return commands
+
+    @staticmethod
+    def _number(buf, start, end, error):
+        """解析'*，$'等后面跟的数字，不是数字时以error为错误信息"""
+        try:
+            return int(buf[start+1:end])
+        except ValueError:
+            raise RespError(error) from None
 
 
 class Resp:
+    NIL = b'$-1\r\n'
+    NIL_ARRAY = b'*-1\r\n'
+    CRLF = b'\r\n'
+
     @staticmethod
     def encode(text, opt='*'):
         """
@@ -20,27 +147,48 @@ class Resp:
         if isinstance(text, int):
             return Resp.integer(text)
 
-        if isinstance(text, str):
+        if isinstance(text, (bytes, bytearray, memoryview, str)):
             text = [text]
 
         if not text:
             return Resp.ok('(empty list or set)')
         res = []
         if opt == '*':
-            res.append(f'*{len(text)}\r\n')
+            res.append(b'*%d\r\n' % len(text))
 
-        for tt in text:
+        Resp._extend(res, text)
+        return b''.join(res)
+
+    @staticmethod
+    def array(items):
+        """数组，元素可以是bytes、str、int、None或嵌套的list"""
+        res = [b'*%d\r\n' % len(items)]
+        Resp._extend(res, items)
+        return b''.join(res)
+
+    @staticmethod
+    def _extend(res, items):
+        for tt in items:
             if tt is None:
-                res.append('$-1\r\n')
+                res.append(Resp.NIL)
+                continue
+            if isinstance(tt, int):
+                res.append(b':%d\r\n' % tt)
+                continue
+            if isinstance(tt, (list, tuple)):
+                res.append(Resp.array(tt))
                 continue
-            res.append(f'${len(tt.encode())}\r\n')
-            res.append(tt+'\r\n')
-        return ''.join(res).encode()
+            if isinstance(tt, str):
+                tt = tt.encode()
+            # 值本身不拷贝，只在最后join时拷贝一次
+            res.append(b'$%d\r\n' % len(tt))
+            res.append(tt)
+            res.append(Resp.CRLF)
 
     @staticmethod
     def decode(byte: bytes):
         """解码"""
-        return byte.decode().split('\r\n')
+        return byte.split(b'\r\n')
 
     @staticmethod
     def error(info, op='ERR'):
@@ -55,11 +203,11 @@ class Resp:
     @staticmethod
     def integer(num):
         """传输整数"""
-        return f':{num}\r\n'.encode()
+        return b':%d\r\n' % num
 
 
 if __name__ == '__main__':
-    a = Resp.encode('set\n a b'.split(' '))
+    a = Resp.encode(b'set\n a b'.split(b' '))
     print(a, Resp.decode(a))
 
 
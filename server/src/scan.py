@@ -0,0 +1,213 @@
+"""
+SCAN系列命令的游标遍历，每次调用只做有限的工作，遍历期间数据变化也保证不漏掉一直存在的元素
+"""
+from bisect import bisect_left, insort
+from itertools import dropwhile, islice, takewhile
+import random
+
+
+# 键空间按hash分到的槽数，SCAN的游标即下一个要遍历的槽号
+SCAN_SLOTS = 16384
+
+# hash、set、zset元素个数超过该值时才建立槽索引，否则一次返回全部元素
+SCAN_SMALL = 128
+
+# 前缀遍历的游标中保存的键的最大长度，更长的只保存前缀，使游标的十进制位数不超过int()的默认上限
+PREFIX_CURSOR_KEY = 1024
+
+
+class KeySlots:
+    """
+    键空间的槽索引，按hash把键分到固定数量的槽中，SCAN每次返回若干个完整的槽。
+    键所在的槽不会变，所以遍历期间一直存在的键一定会被返回，且只返回一次
+    """
+    __slots__ = ('slots', 'used')
+
+    def __init__(self):
+        # 槽号 -> 键集合，只保存非空的槽
+        self.slots = {}
+        # 非空槽号，有序，遍历时跳过空槽
+        self.used = []
+
+    def add(self, key):
+        slot = hash(key) % SCAN_SLOTS
+        keys = self.slots.get(slot)
+        if keys is None:
+            keys = self.slots[slot] = set()
+            insort(self.used, slot)
+        keys.add(key)
+
+    def remove(self, key):
+        slot = hash(key) % SCAN_SLOTS
+        keys = self.slots.get(slot)
+        if keys is None:
+            return
+        keys.discard(key)
+        if not keys:
+            del self.slots[slot]
+            del self.used[bisect_left(self.used, slot)]
+
+    def sample(self, count):
+        """从随机的非空槽开始取连续几个槽中的键，凑够count个为止，用于淘汰时抽样"""
+        used = self.used
+        if not used:
+            return []
+        i = random.randrange(len(used))
+        keys = []
+        for _ in range(len(used)):
+            keys.extend(islice(self.slots[used[i]], count - len(keys)))
+            if len(keys) >= count:
+                break
+            i = (i + 1) % len(used)
+        return keys
+
+    def scan(self, cursor, count):
+        """
+        从游标对应的槽开始遍历，凑够count个键为止
+        :return: (下一个游标，遍历结束时为0, 键列表)
+        """
+        used = self.used
+        i = bisect_left(used, cursor)
+        keys = []
+        while i < len(used) and len(keys) < count:
+            keys.extend(self.slots[used[i]])
+            i += 1
+        return (used[i] if i < len(used) else 0), keys
+
+
+class MemberSlots(KeySlots):
+    """
+    hash、set、zset成员的槽索引，槽的划分与键空间相同，HSCAN等的游标即下一个槽号。
+    成员较多时才由容器建立并维护，每个槽的成员很少，用list保存比set省内存
+    """
+    __slots__ = ()
+
+    def add(self, member):
+        """调用前需确认成员不在索引中"""
+        slot = hash(member) % SCAN_SLOTS
+        members = self.slots.get(slot)
+        if members is None:
+            members = self.slots[slot] = []
+            insort(self.used, slot)
+        members.append(member)
+
+    def remove(self, member):
+        slot = hash(member) % SCAN_SLOTS
+        members = self.slots.get(slot)
+        if members is None:
+            return
+        try:
+            members.remove(member)
+        except ValueError:
+            return
+        if not members:
+            del self.slots[slot]
+            del self.used[bisect_left(self.used, slot)]
+
+
+def member_slots(members):
+    """为已有的成员建立槽索引"""
+    slots = MemberSlots()
+    for member in members:
+        slots.add(member)
+    return slots
+
+
+def scan_members(members, slots, cursor, count):
+    """
+    按槽遍历hash、set、zset的成员，游标只是槽号，服务器不保存任何状态，
+    成员所在的槽不随编码转换和增删改变，遍历期间一直存在的成员一定会被返回
+    :param slots: 容器的槽索引，成员不多时没有索引，直接筛选出槽号不小于游标的成员一次返回
+    :return: (下一个游标, 成员列表)
+    """
+    if slots is not None:
+        return slots.scan(cursor, count)
+    if not cursor:
+        return 0, list(members)
+    return 0, [m for m in members if hash(m) % SCAN_SLOTS >= cursor]
+
+
+def prefix_scan(index, prefix, cursor, count):
+    """
+    在有序键索引上按前缀遍历，只访问以前缀开头的键。游标中保存上次返回的最后一个键，服务器不保存任何状态，
+    每次从该键之后继续，遍历期间一直存在的键一定会被返回。
+    游标为SCAN_SLOTS加上(标记字节 + 键)按大端转成的整数，不小于SCAN_SLOTS，与槽游标区分开
+    :param index: 有序键索引SortedList
+    :return: (下一个游标, 以prefix开头的键列表)
+    """
+    start = None
+    if cursor >= SCAN_SLOTS:
+        exclusive, start = _decode_prefix_cursor(cursor)
+    if start is None or start < prefix:
+        it = index.irange(prefix)
+    elif exclusive:
+        it = index.irange(start, inclusive=False)
+    else:
+        # 游标中只有键的前缀，跳过上次已经全部返回的以它开头的键
+        it = dropwhile(lambda key: key.startswith(start), index.irange(start))
+    it = takewhile(lambda key: key.startswith(prefix), it)
+    keys = list(islice(it, count))
+    if len(keys) < count:
+        return 0, keys
+
+    last = keys[-1]
+    if len(last) <= PREFIX_CURSOR_KEY:
+        return _encode_prefix_cursor(True, last), keys
+    # 键太长时游标只保存它的前缀，本次把以该前缀开头的键全部返回，下次整体跳过，保证遍历能向前推进
+    head = last[:PREFIX_CURSOR_KEY]
+    keys.extend(takewhile(lambda key: key.startswith(head), it))
+    return _encode_prefix_cursor(False, head), keys
+
+
+def _encode_prefix_cursor(exclusive, key):
+    return SCAN_SLOTS + int.from_bytes((b'\x01' if exclusive else b'\x02') + key, 'big')
+
+
+def _decode_prefix_cursor(cursor):
+    """:return: (是否从键之后开始, 键)"""
+    n = cursor - SCAN_SLOTS
+    data = n.to_bytes((n.bit_length() + 7) // 8, 'big')
+    if not data:
+        return True, None
+    return data[0] == 1, data[1:]
+
+
+def parse_args(args, with_type=False):
+    """
+    解析 [MATCH pattern] [COUNT count] [TYPE type]
+    :return: (pattern, count, type)，格式错误时抛出ValueError
+    """
+    pattern, count, tp = None, 10, None
+    i = 0
+    while i < len(args):
+        opt = args[i].lower()
+        if i + 1 >= len(args):
+            raise ValueError('syntax error')
+        if opt == b'match':
+            pattern = args[i+1]
+            if pattern == b'*':
+                pattern = None
+        elif opt == b'count':
+            try:
+                count = int(args[i+1])
+            except ValueError:
+                raise ValueError('value is not an integer or out of range') from None
+            if count < 1:
+                raise ValueError('syntax error')
+        elif opt == b'type' and with_type:
+            tp = args[i+1].decode(errors='replace').lower()
+        else:
+            raise ValueError('syntax error')
+        i += 2
+    return pattern, count, tp
+
+
+def parse_cursor(cursor):
+    """游标为非负整数"""
+    try:
+        cursor = int(cursor)
+    except ValueError:
+        cursor = -1
+    if cursor < 0:
+        raise ValueError('invalid cursor')
+    return cursor
@@ -0,0 +1,58 @@
+"""
+慢查询日志，参照redis的SLOWLOG：执行时间超过SLOWLOG_LOG_SLOWER_THAN微秒的命令记入固定长度的环形缓冲区，
+参数个数和每个参数的长度都有上限，避免大参数占用内存
+"""
+import time
+from collections import deque
+
+from server.conf.settings import SLOWLOG_LOG_SLOWER_THAN, SLOWLOG_MAX_LEN
+
+
+# 每条记录最多保存的参数个数，以及每个参数最多保存的字节数
+SLOWLOG_ENTRY_MAX_ARGC = 32
+SLOWLOG_ENTRY_MAX_STRING = 128
+
+
+class SlowLog:
+    def __init__(self, max_len=SLOWLOG_MAX_LEN):
+        # 新的记录在左边，超出长度时从右边丢弃最旧的
+        self.entries = deque(maxlen=max_len)
+        self.next_id = 0
+
+    def add(self, args, usec, client=''):
+        """
+        :param args: 完整的命令参数，包括命令名
+        :param usec: 执行时间（微秒）
+        :param client: 客户端地址ip:port
+        """
+        argc = min(len(args), SLOWLOG_ENTRY_MAX_ARGC)
+        saved = []
+        for i in range(argc):
+            if argc != len(args) and i == argc - 1:
+                saved.append(b'... (%d more arguments)' % (len(args) - argc + 1))
+                break
+            arg = args[i]
+            if len(arg) > SLOWLOG_ENTRY_MAX_STRING:
+                arg = arg[:SLOWLOG_ENTRY_MAX_STRING] + b'... (%d more bytes)' % (len(arg) - SLOWLOG_ENTRY_MAX_STRING)
+            saved.append(arg)
+
+        self.entries.appendleft([self.next_id, int(time.time()), usec, saved, client, ''])
+        self.next_id += 1
+
+    def get(self, count=10):
+        """最近的count条记录，count为负数时返回全部"""
+        if count < 0 or count >= len(self.entries):
+            return list(self.entries)
+        return [self.entries[i] for i in range(count)]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def reset(self):
+        self.entries.clear()
+
+
+# 慢查询阈值（纳秒），关闭时为None
+SLOWLOG_NS = SLOWLOG_LOG_SLOWER_THAN * 1000 if SLOWLOG_LOG_SLOWER_THAN >= 0 else None
+
+SLOWLOG = SlowLog()
@@ -0,0 +1,228 @@
+"""
+快照文件格式，逐个键流式写入和读取，不依赖pickle和类路径
+
+文件结构：
+    PEDIS + 4位版本号
+    [0xFC + 8字节毫秒过期时间戳] + 类型(1字节) + 键 + 值，每个键一条记录
+    0xFF + 4字节CRC32（前面所有字节的校验和）
+长度编码参照redis rdb：00xxxxxx 6位，01xxxxxx xxxxxxxx 14位，0x80 + 4字节，0x81 + 8字节
+字符串为长度 + 原始字节；hash为字段数 + 字段值交替；list、set为元素个数 + 元素；
+zset为成员数 + 成员和8字节double分值交替（版本2起）
+"""
+import os
+import struct
+import zlib
+
+
+MAGIC = b'PEDIS'
+VERSION = 2
+
+OPCODE_EXPIRE = 0xFC
+OPCODE_EOF = 0xFF
+
+# 与RedisKey中的类型编号一致
+TYPE_STRING = 0
+TYPE_HASH = 1
+TYPE_LIST = 2
+TYPE_SET = 3
+TYPE_ZSET = 4
+
+# 读写缓冲区大小，内存占用与数据量无关
+CHUNK = 256 * 1024
+
+
+class SnapshotError(Exception):
+    """快照文件格式错误或已损坏"""
+
+
+def _len(n):
+    if n < 0x40:
+        return bytes((n,))
+    if n < 0x4000:
+        return bytes((0x40 | n >> 8, n & 0xFF))
+    if n <= 0xFFFFFFFF:
+        return b'\x80' + n.to_bytes(4, 'big')
+    return b'\x81' + n.to_bytes(8, 'big')
+
+
+class SnapshotWriter:
+    """流式写入，数据先攒在缓冲区，满了再计算校验和写入文件"""
+    def __init__(self, f):
+        self.f = f
+        self.buf = bytearray()
+        self.crc = 0
+        self.buf += MAGIC + b'%04d' % VERSION
+
+    def _flush(self):
+        self.crc = zlib.crc32(self.buf, self.crc)
+        self.f.write(self.buf)
+        self.buf.clear()
+
+    def _bytes(self, data):
+        buf = self.buf
+        buf += _len(len(data))
+        buf += data
+
+    def write(self, key, tp, value, when=None):
+        """写入一个键，when为过期时间戳（秒）"""
+        buf = self.buf
+        if when is not None:
+            buf.append(OPCODE_EXPIRE)
+            buf += struct.pack('>q', int(when * 1000))
+        buf.append(tp)
+        self._bytes(key)
+
+        if tp == TYPE_STRING:
+            self._bytes(value)
+        elif tp == TYPE_HASH:
+            buf += _len(len(value))
+            for field, v in value.items():
+                self._bytes(field)
+                self._bytes(v)
+                if len(buf) >= CHUNK:
+                    self._flush()
+        elif tp == TYPE_ZSET:
+            buf += _len(len(value))
+            for member, score in value:
+                self._bytes(member)
+                buf += struct.pack('>d', score)
+                if len(buf) >= CHUNK:
+                    self._flush()
+        else:
+            buf += _len(len(value))
+            for item in value:
+                self._bytes(item)
+                if len(buf) >= CHUNK:
+                    self._flush()
+
+        if len(buf) >= CHUNK:
+            self._flush()
+
+    def close(self):
+        """写入结束标志和校验和"""
+        self.buf.append(OPCODE_EOF)
+        self._flush()
+        self.f.write(struct.pack('>I', self.crc))
+
+
+class SnapshotReader:
+    """流式读取，只保留一个读缓冲区，边读边计算校验和"""
+    def __init__(self, f):
+        self.f = f
+        self.buf = b''
+        self.pos = 0
+        # 已计算过校验和的位置
+        self.checked = 0
+        self.crc = 0
+
+        header = self.read(len(MAGIC) + 4)
+        if header[:len(MAGIC)] != MAGIC:
+            raise SnapshotError('not a pedis snapshot file')
+        try:
+            version = int(header[len(MAGIC):])
+        except ValueError:
+            raise SnapshotError('bad snapshot version') from None
+        if version > VERSION:
+            raise SnapshotError(f'unsupported snapshot version {version}')
+
+    def _check(self):
+        self.crc = zlib.crc32(memoryview(self.buf)[self.checked:self.pos], self.crc)
+        self.checked = self.pos
+
+    def read(self, n):
+        pos = self.pos
+        if pos + n <= len(self.buf):
+            self.pos = pos + n
+            return self.buf[pos:pos+n]
+
+        self._check()
+        rest = self.buf[pos:]
+        data = self.f.read(max(n - len(rest), CHUNK))
+        self.buf = rest + data
+        self.pos = self.checked = 0
+        if n > len(self.buf):
+            raise SnapshotError('unexpected end of snapshot file')
+        self.pos = n
+        return self.buf[:n]
+
+    def read_len(self):
+        b = self.read(1)[0]
+        kind = b >> 6
+        if kind == 0:
+            return b
+        if kind == 1:
+            return (b & 0x3F) << 8 | self.read(1)[0]
+        if b == 0x80:
+            return int.from_bytes(self.read(4), 'big')
+        if b == 0x81:
+            return int.from_bytes(self.read(8), 'big')
+        raise SnapshotError(f'bad length encoding {b:#x}')
+
+    def read_bytes(self):
+        return self.read(self.read_len())
+
+    def __iter__(self):
+        """逐个返回(键, 类型, 值, 过期时间戳)，hash值为(字段, 值)列表，list、set值为元素列表，zset值为(成员, 分值)列表"""
+        while True:
+            when = None
+            op = self.read(1)[0]
+            if op == OPCODE_EOF:
+                self._check()
+                checksum = struct.unpack('>I', self.read(4))[0]
+                if checksum != self.crc:
+                    raise SnapshotError('snapshot checksum mismatch')
+                return
+            if op == OPCODE_EXPIRE:
+                when = struct.unpack('>q', self.read(8))[0] / 1000
+                op = self.read(1)[0]
+
+            key = self.read_bytes()
+            if op == TYPE_STRING:
+                value = self.read_bytes()
+            elif op == TYPE_HASH:
+                value = [(self.read_bytes(), self.read_bytes()) for _ in range(self.read_len())]
+            elif op in (TYPE_LIST, TYPE_SET):
+                value = [self.read_bytes() for _ in range(self.read_len())]
+            elif op == TYPE_ZSET:
+                value = [(self.read_bytes(), struct.unpack('>d', self.read(8))[0]) for _ in range(self.read_len())]
+            else:
+                raise SnapshotError(f'unknown value type {op}')
+            yield key, op, value, when
+
+
+def temp_file(filename, pid):
+    """pid进程保存快照时使用的临时文件"""
+    return os.path.join(os.path.dirname(filename), f'temp-{pid}.pdb')
+
+
+def dump(db, filename):
+    """先写临时文件并fsync，再原子替换，写入过程中宕机不会破坏原有快照"""
+    temp = temp_file(filename, os.getpid())
+    try:
+        with open(temp, 'wb') as f:
+            writer = SnapshotWriter(f)
+            for key, tp, value, when in db.iter_data():
+                writer.write(key, tp, value, when)
+            writer.close()
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, filename)
+    except BaseException:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+
+
+def load(db, filename):
+    """
+    流式加载快照到db中，文件不存在时返回False，文件损坏时抛出SnapshotError
+    """
+    try:
+        f = open(filename, 'rb')
+    except FileNotFoundError:
+        return False
+
+    with f:
+        for key, tp, value, when in SnapshotReader(f):
+            db.restore(key, tp, value, when)
+    return True
@@ -0,0 +1,189 @@
+"""
+分块有序列表，元素按顺序存放在多个小列表中，插入删除只移动一个小列表，
+另外用树状数组记录各块长度，按位置查找和求排名都是O(log n)，用于有序的键索引和有序集合
+"""
+from bisect import bisect_left, bisect_right, insort
+
+
+# 每块最多的元素个数，超出后对半拆分
+BLOCK_SIZE = 1000
+
+
+class SortedList:
+    """元素不重复，需要可比较"""
+    __slots__ = ('blocks', 'maxes', 'size', 'tree')
+
+    def __init__(self, iterable=()):
+        # 有序的块，以及每块的最大元素，用于二分查找元素所在的块
+        self.blocks = []
+        self.maxes = []
+        self.size = 0
+        # 块长度的树状数组，块增删时置为None，用到时重建
+        self.tree = None
+        for value in sorted(iterable):
+            self.add(value)
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for block in self.blocks:
+            yield from block
+
+    def __contains__(self, value):
+        maxes = self.maxes
+        i = bisect_left(maxes, value)
+        if i == len(maxes):
+            return False
+        block = self.blocks[i]
+        j = bisect_left(block, value)
+        return block[j] == value
+
+    def add(self, value):
+        maxes, blocks = self.maxes, self.blocks
+        if not maxes:
+            blocks.append([value])
+            maxes.append(value)
+            self.tree = None
+        else:
+            i = bisect_left(maxes, value)
+            if i == len(maxes):
+                i -= 1
+                blocks[i].append(value)
+                maxes[i] = value
+            else:
+                insort(blocks[i], value)
+            if len(blocks[i]) > BLOCK_SIZE:
+                self._split(i)
+            else:
+                self._update(i, 1)
+        self.size += 1
+
+    def _split(self, i):
+        block = self.blocks[i]
+        half = block[BLOCK_SIZE // 2:]
+        del block[BLOCK_SIZE // 2:]
+        self.blocks.insert(i + 1, half)
+        self.maxes[i] = block[-1]
+        self.maxes.insert(i + 1, half[-1])
+        self.tree = None
+
+    def discard(self, value):
+        """:return: 元素存在并被删除时返回True"""
+        maxes = self.maxes
+        i = bisect_left(maxes, value)
+        if i == len(maxes):
+            return False
+        block = self.blocks[i]
+        j = bisect_left(block, value)
+        if block[j] != value:
+            return False
+
+        del block[j]
+        self.size -= 1
+        if not block:
+            del self.blocks[i]
+            del maxes[i]
+            self.tree = None
+        else:
+            if j == len(block):
+                maxes[i] = block[-1]
+            self._update(i, -1)
+        return True
+
+    def irange(self, start, inclusive=True):
+        """从start开始（不包括start时inclusive为False）按顺序返回元素，迭代期间不能修改列表"""
+        maxes = self.maxes
+        search = bisect_left if inclusive else bisect_right
+        i = search(maxes, start)
+        if i == len(maxes):
+            return
+        blocks = self.blocks
+        block = blocks[i]
+        yield from block[search(block, start):]
+        for block in blocks[i+1:]:
+            yield from block
+
+    def _build(self):
+        tree = [0]
+        tree.extend(map(len, self.blocks))
+        n = len(self.blocks)
+        for i in range(1, n + 1):
+            j = i + (i & -i)
+            if j <= n:
+                tree[j] += tree[i]
+        self.tree = tree
+
+    def _update(self, i, delta):
+        """第i块长度变化delta"""
+        tree = self.tree
+        if tree is None:
+            return
+        i += 1
+        n = len(tree)
+        while i < n:
+            tree[i] += delta
+            i += i & -i
+
+    def _offset(self, i):
+        """前i块的元素总数，即第i块第一个元素的位置"""
+        if self.tree is None:
+            self._build()
+        tree = self.tree
+        total = 0
+        while i:
+            total += tree[i]
+            i -= i & -i
+        return total
+
+    def _locate(self, index):
+        """位置index所在的(块号, 块内位置)"""
+        if self.tree is None:
+            self._build()
+        tree = self.tree
+        n = len(tree) - 1
+        pos = 0
+        step = 1 << n.bit_length()
+        while step:
+            nxt = pos + step
+            if nxt <= n and tree[nxt] <= index:
+                pos = nxt
+                index -= tree[nxt]
+            step >>= 1
+        return pos, index
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError('SortedList index out of range')
+        i, j = self._locate(index)
+        return self.blocks[i][j]
+
+    def bisect_left(self, value):
+        """小于value的元素个数，value存在时即其位置"""
+        i = bisect_left(self.maxes, value)
+        if i == len(self.maxes):
+            return self.size
+        return self._offset(i) + bisect_left(self.blocks[i], value)
+
+    def bisect_right(self, value):
+        """不大于value的元素个数"""
+        i = bisect_right(self.maxes, value)
+        if i == len(self.maxes):
+            return self.size
+        return self._offset(i) + bisect_right(self.blocks[i], value)
+
+    def islice(self, start, stop):
+        """位置在[start, stop)之间的元素列表"""
+        start = max(start, 0)
+        stop = min(stop, self.size)
+        if start >= stop:
+            return []
+        i, j = self._locate(start)
+        blocks = self.blocks
+        ret = blocks[i][j:j + stop - start]
+        while len(ret) < stop - start:
+            i += 1
+            ret.extend(blocks[i][:stop - start - len(ret)])
+        return ret
@@ -0,0 +1,147 @@
+"""
+运行统计，供INFO使用：连接数、网络流量、每秒命令数，以及命令执行耗时的直方图
+"""
+import asyncio
+import os
+import sys
+import time
+from collections import deque
+
+
+# 直方图每个2的幂区间等分的桶数为2**SUB_BITS
+SUB_BITS = 5
+# 超过2**MAX_BITS的数值都记在最后一个桶中，纳秒为单位时约18分钟
+MAX_BITS = 40
+
+
+class Histogram:
+    """
+    参照HDR直方图的对数线性分桶：每个2的幂区间再等分为2**SUB_BITS个桶，相对误差不超过1/2**SUB_BITS，
+    桶数固定，记录一次只需几次位运算和一次列表自增
+    """
+    __slots__ = ('counts',)
+
+    SIZE = ((MAX_BITS - SUB_BITS) << SUB_BITS) + 1
+
+    def __init__(self):
+        self.counts = [0] * self.SIZE
+
+    def record(self, value):
+        """value为非负整数"""
+        shift = value.bit_length() - SUB_BITS - 1
+        if shift <= 0:
+            self.counts[value] += 1
+        elif shift < MAX_BITS - SUB_BITS - 1:
+            self.counts[(shift << SUB_BITS) + (value >> shift)] += 1
+        else:
+            self.counts[-1] += 1
+
+    @property
+    def total(self):
+        return sum(self.counts)
+
+    @staticmethod
+    def upper_bound(index):
+        """桶中数值的上界"""
+        shift = (index >> SUB_BITS) - 1
+        if shift <= 0:
+            return index
+        return ((index - (shift << SUB_BITS) + 1) << shift) - 1
+
+    def percentile(self, q):
+        """q为0到100，:return: 至少q%的数值不超过的桶上界，没有记录时返回0"""
+        total = self.total
+        if not total:
+            return 0
+        target = max(1, total * q / 100)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return self.upper_bound(index)
+        return self.upper_bound(self.SIZE - 1)
+
+
+class Stats:
+    """INFO stats、clients中的计数"""
+
+    # 每隔多少秒采样一次命令数，用最近SAMPLES次采样计算每秒命令数
+    SAMPLE_INTERVAL = 0.1
+    SAMPLES = 16
+
+    def __init__(self):
+        self.start_time = time.time()
+        self.connected_clients = 0
+        self.reset()
+
+    def reset(self):
+        """CONFIG RESETSTAT"""
+        self.connections_received = 0
+        self.net_input_bytes = 0
+        self.net_output_bytes = 0
+        self.expired_keys = 0
+        self.evicted_keys = 0
+        # 输出缓冲区超出限制被断开的订阅者
+        self.output_buffer_disconnections = 0
+        self.samples = deque(maxlen=self.SAMPLES)
+        self.last_sample = None
+
+    def sample(self, calls, now):
+        """记录一次采样，calls为到目前为止执行的命令总数"""
+        if self.last_sample is not None:
+            last_calls, last_time = self.last_sample
+            if now > last_time:
+                self.samples.append((calls - last_calls) / (now - last_time))
+        self.last_sample = calls, now
+
+    def ops_per_sec(self):
+        if not self.samples:
+            return 0
+        return int(sum(self.samples) / len(self.samples))
+
+    async def cron(self, total_calls):
+        """定时采样，total_calls返回当前的命令总数"""
+        while True:
+            await asyncio.sleep(self.SAMPLE_INTERVAL)
+            self.sample(total_calls(), time.monotonic())
+
+
+STATS = Stats()
+
+
+def multiplexing_api():
+    """事件循环底层的IO多路复用方式"""
+    loop = asyncio.get_running_loop()
+    selector = getattr(loop, '_selector', None)
+    if selector is None:
+        # uvloop等非标准库的事件循环
+        return type(loop).__module__.split('.')[0]
+    return type(selector).__name__.replace('Selector', '').lower()
+
+
+def memory_rss():
+    """进程当前占用的物理内存（字节），/proc不可用时返回峰值"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return memory_peak()
+
+
+def memory_peak():
+    """进程占用物理内存的峰值（字节）"""
+    try:
+        import resource
+    except ImportError:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux下单位为KB，macOS下为字节
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def bytes_human(n):
+    """与redis的*_human字段一致，如1.50M"""
+    for unit in ('B', 'K', 'M', 'G', 'T'):
+        if n < 1024 or unit == 'T':
+            return f'{n}B' if unit == 'B' else f'{n:.2f}{unit}'
+        n /= 1024
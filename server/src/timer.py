@@ -2,63 +2,191 @@
 处理时间事件，包括数据同步策略，键失效时间处理
 """
 import asyncio
+import heapq
+import math
+import random
 import time
+from itertools import islice
 
 from server.src.data_struct import RedisData
+from server.src.bgsave import SAVER
+from server.src.stats import STATS
+from server.src.latency import LATENCY
+from server.src.lazyfree import LAZYFREE, release_nested
 from server.conf.settings import *
 
 DB = RedisData()
 
 
+class ExpireQueue:
+    """
+    按到期时间分桶的最小堆，同一个时间刻度内到期的键放在同一个桶中，堆中只保存桶的刻度。
+    每个键只占用一个桶位置，不再为每个键创建asyncio任务，键的数量不影响事件循环的定时器
+    """
+    __slots__ = ('resolution', 'buckets', 'heap', 'where')
+
+    def __init__(self, resolution=EXPIRE_INTERVAL):
+        self.resolution = resolution
+
+        # 刻度 -> 该刻度内到期的键集合
+        self.buckets = {}
+        # 桶刻度的最小堆，桶被清空后刻度可能残留，弹出时跳过即可
+        self.heap = []
+        # 键 -> 所在桶的刻度，用于重新设置过期时间和取消过期
+        self.where = {}
+
+    def __len__(self):
+        return len(self.where)
+
+    def __contains__(self, key):
+        return key in self.where
+
+    def add(self, key, when):
+        """添加或更新键的到期时间戳"""
+        # 向上取整，保证桶被处理时桶内的键都已到期
+        tick = math.ceil(when / self.resolution)
+        old = self.where.get(key)
+        if old == tick:
+            return
+        if old is not None:
+            self._remove(key, old)
+
+        bucket = self.buckets.get(tick)
+        if bucket is None:
+            bucket = self.buckets[tick] = set()
+            heapq.heappush(self.heap, tick)
+        bucket.add(key)
+        self.where[key] = tick
+
+    def sample(self, count):
+        """从随机的桶中取最多count个键，用于volatile策略的淘汰抽样，键可能已被删除或取消过期，由调用方确认"""
+        heap = self.heap
+        buckets = self.buckets
+        keys = []
+        # 堆中可能残留已清空的桶，多试几次
+        for _ in range(count * 2):
+            if not heap or len(keys) >= count:
+                break
+            bucket = buckets.get(heap[random.randrange(len(heap))])
+            if bucket:
+                keys.extend(islice(bucket, count - len(keys)))
+        return keys
+
+    def discard(self, key):
+        """取消键的过期"""
+        tick = self.where.pop(key, None)
+        if tick is not None:
+            self._remove(key, tick)
+
+    def _remove(self, key, tick):
+        bucket = self.buckets[tick]
+        bucket.discard(key)
+        if not bucket:
+            del self.buckets[tick]
+            # 清空的桶的刻度残留在堆中，残留的比有效的多时重建堆
+            if len(self.heap) > 2 * len(self.buckets) + 64:
+                self.heap = list(self.buckets)
+                heapq.heapify(self.heap)
+
+    def clear(self, lazy=False):
+        """FLUSHALL时清空，lazy时交给后台线程释放"""
+        buckets, where = self.buckets, self.where
+        self.buckets = {}
+        self.heap = []
+        self.where = {}
+        if lazy:
+            LAZYFREE.submit(buckets, release_nested)
+            LAZYFREE.submit(where)
+
+    def pop_expired(self, now, count):
+        """从到期的桶中按到期先后弹出最多count个键"""
+        tick = now / self.resolution
+        heap = self.heap
+        buckets = self.buckets
+        keys = []
+        while heap and heap[0] <= tick and len(keys) < count:
+            bucket = buckets.get(heap[0])
+            if bucket is None:
+                # 已被清空的桶残留的刻度
+                heapq.heappop(heap)
+                continue
+            while bucket and len(keys) < count:
+                key = bucket.pop()
+                del self.where[key]
+                keys.append(key)
+            if not bucket:
+                del buckets[heapq.heappop(heap)]
+        return keys
+
+
 class Timer:
-    _keys = DB.EXPIRES
-    _task = {}
+    _queue = ExpireQueue()
 
     def __init__(self, loop=None):
+        DB.expires = self._queue
         if loop is not None:
             asyncio.set_event_loop(loop)
             self.async_task()
             self.save_task()
 
     def async_task(self):
-        """首次启动时执行，目的是把过期的键删除，还未过期的添加计时事件"""
-        for k in list(self._keys.keys()):
-            if self._keys[k] > time.time():
-                self._task[k] = asyncio.create_task(self.down(k))
+        """首次启动时执行，目的是把过期的键删除，还未过期的加入过期队列，并启动过期处理"""
+        now = time.time()
+        for k, when in list(DB.iter_expires()):
+            if when > now:
+                self._queue.add(k, when)
             else:
-                self._keys.pop(k)
-
-    async def down(self, key):
-        """失效计时"""
-        try:
-            await asyncio.sleep(self._keys[key]-time.time())
-
-            # 删除策略-------立即删除
-            self._keys.pop(key)
+                DB.del_((k,), LAZYFREE_LAZY_EXPIRE)
+                STATS.expired_keys += 1
+        asyncio.create_task(self.expire_cycle(EXPIRE_INTERVAL))
 
-            # 清除任务
-            del self._task[key]
+    async def expire_cycle(self, t):
+        """所有键共用的过期处理，每t秒执行一次主动过期"""
+        while True:
+            await asyncio.sleep(t)
+            # 键的访问时间以秒为单位，由定时任务更新，访问键时不用再取当前时间
+            DB.clock = int(time.time())
+            with LATENCY.measure('expire-cycle'):
+                self.active_expire_cycle(time.time())
 
-        except asyncio.CancelledError:
-            # 取消过期事件
-            del self._task[key]
+    def active_expire_cycle(self, now):
+        """
+        主动过期，配合RedisData访问时的惰性删除使用。
+        每轮从最早到期的键中取ACTIVE_EXPIRE_KEYS个，真正过期的超过ACTIVE_EXPIRE_STALE%就继续下一轮，
+        总耗时不超过时间预算，剩余的到期键留到下次处理，不会长时间阻塞事件循环
+        """
+        queue = self._queue
+        deadline = time.perf_counter() + EXPIRE_INTERVAL * ACTIVE_EXPIRE_CYCLE_PERC / 100
+        while True:
+            sample = queue.pop_expired(now, ACTIVE_EXPIRE_KEYS)
+            if not sample:
+                break
+
+            expired = 0
+            for key in sample:
+                # 键的过期时间可能已被修改或键已被删除（包括被惰性删除），所以要再次确认
+                when = DB.get_expire(key)
+                if when is None:
+                    continue
+                if when <= now:
+                    DB.del_((key,), LAZYFREE_LAZY_EXPIRE)
+                    expired += 1
+                else:
+                    queue.add(key, when)
+
+            STATS.expired_keys += expired
+            if expired * 100 <= len(sample) * ACTIVE_EXPIRE_STALE:
+                break
+            if time.perf_counter() > deadline:
+                break
 
     def persist(self, key):
-        """取消对键的失效设置"""
-        if key in self._task:
-            self._task[key].cancel()
-            del self._keys[key]
-            return 1
-        return 0
+        """取消对键的失效设置，DB同时从过期队列中移除"""
+        return int(DB.persist(key))
 
     def expire(self, key):
-        """设置键失效时间"""
-
-        # 如果当前键存在于⏲事件中，则取消并重新开始新计时事件
-        if key in self._task:
-            self._task[key].cancel()
-
-        self._task[key] = asyncio.create_task(self.down(key))
+        """设置键失效时间，重复设置时移动到新的桶中"""
+        self._queue.add(key, DB.get_expire(key))
 
     async def save_any(self, t=100):
         """
@@ -68,9 +196,8 @@ class Timer:
         """
         while True:
             await asyncio.sleep(t)
-            if DB.KEYS.modify > 0:
-                DB.bgsave()
-                DB.KEYS.modify = 0
+            if DB.modify > 0 and SAVER.child is None:
+                SAVER.bgsave(DB)
 
     async def save_per_sec(self, count):
         """
@@ -80,9 +207,8 @@ class Timer:
         """
         while True:
             await asyncio.sleep(1)
-            if DB.KEYS.modify >= count:
-                DB.bgsave()
-                DB.KEYS.modify = 0
+            if DB.modify >= count and SAVER.child is None:
+                SAVER.bgsave(DB)
 
     async def save_per_min(self, count):
         """
@@ -92,13 +218,19 @@ class Timer:
         """
         while True:
             await asyncio.sleep(60)
-            if DB.KEYS.modify >= count:
-                DB.bgsave()
-                DB.KEYS.modify = 0
+            if DB.modify >= count and SAVER.child is None:
+                SAVER.bgsave(DB)
+
+    async def check_child(self, t=0.1):
+        """每t秒检查后台保存的子进程是否结束"""
+        while True:
+            await asyncio.sleep(t)
+            SAVER.check(DB)
 
     def save_task(self):
         """数据持久化策略"""
-        DB.KEYS.modify = 0
+        DB.modify = 0
+        asyncio.create_task(self.check_child())
         asyncio.create_task(self.save_any(ASYNC_TIME))
         asyncio.create_task(self.save_per_sec(SEC_COUNT))
         asyncio.create_task(self.save_per_min(MIN_COUNT))
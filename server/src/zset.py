@@ -0,0 +1,147 @@
+"""
+有序集合，字典保存成员到分值的映射，分块有序列表按(分值, 成员)排序，
+增删、求排名、按排名和分值取范围都是O(log n)
+"""
+import math
+
+from server.src.scan import SCAN_SMALL, member_slots
+from server.src.sortedlist import SortedList
+
+
+class _Top:
+    """比任何成员都大，按分值查找时作为(分值, TOP)的上界"""
+    def __lt__(self, other):
+        return False
+
+    def __gt__(self, other):
+        return True
+
+
+TOP = _Top()
+
+
+class Zset:
+    __slots__ = ('scores', 'index', 'slots')
+
+    def __init__(self):
+        self.scores = {}
+        self.index = SortedList()
+        # 成员超过SCAN_SMALL个后建立的槽索引，供ZSCAN使用
+        self.slots = None
+
+    def __len__(self):
+        return len(self.scores)
+
+    def __iter__(self):
+        """按分值顺序返回(成员, 分值)"""
+        for score, member in self.index:
+            yield member, score
+
+    def score(self, member):
+        return self.scores.get(member)
+
+    def add(self, member, score):
+        """添加成员或更新分值，:return: 有变化时返回True"""
+        old = self.scores.get(member)
+        if old is not None:
+            if old == score:
+                return False
+            self.index.discard((old, member))
+        elif self.slots is not None:
+            self.slots.add(member)
+        self.scores[member] = score
+        self.index.add((score, member))
+        if self.slots is None and len(self.scores) > SCAN_SMALL:
+            self.slots = member_slots(self.scores)
+        return True
+
+    def remove(self, member):
+        score = self.scores.pop(member, None)
+        if score is None:
+            return False
+        self.index.discard((score, member))
+        if self.slots is not None:
+            self.slots.remove(member)
+        return True
+
+    def rank(self, member, reverse=False):
+        score = self.scores.get(member)
+        if score is None:
+            return None
+        rank = self.index.bisect_left((score, member))
+        return len(self.scores) - 1 - rank if reverse else rank
+
+    def range_by_rank(self, start, stop, reverse=False):
+        """排名在[start, stop]之间的(分值, 成员)列表，负数表示倒数，与redis一致"""
+        n = len(self.scores)
+        if start < 0:
+            start += n
+        if stop < 0:
+            stop += n
+        start = max(start, 0)
+        if start > stop or start >= n:
+            return []
+        stop = min(stop, n - 1)
+        if not reverse:
+            return self.index.islice(start, stop + 1)
+        items = self.index.islice(n - 1 - stop, n - start)
+        items.reverse()
+        return items
+
+    def _positions(self, low, high):
+        """分值在low、high范围内的元素位置[start, end)，low、high为(分值, 是否不包括)"""
+        index = self.index
+        start = index.bisect_left((low[0], TOP)) if low[1] else index.bisect_left((low[0],))
+        end = index.bisect_left((high[0],)) if high[1] else index.bisect_left((high[0], TOP))
+        return start, end
+
+    def count(self, low, high):
+        start, end = self._positions(low, high)
+        return max(end - start, 0)
+
+    def range_by_score(self, low, high, reverse=False, offset=0, count=-1):
+        """
+        分值在范围内的(分值, 成员)列表，reverse时从大到小，offset、count同LIMIT
+        """
+        start, end = self._positions(low, high)
+        if end <= start or offset < 0:
+            return []
+        if not reverse:
+            lo = start + offset
+            hi = end if count < 0 else min(end, lo + count)
+            return self.index.islice(lo, hi)
+        hi = end - offset
+        lo = start if count < 0 else max(start, hi - count)
+        items = self.index.islice(lo, hi)
+        items.reverse()
+        return items
+
+
+def parse_score(value):
+    """分值，支持inf、-inf，不能是nan"""
+    try:
+        score = float(value)
+    except ValueError:
+        score = math.nan
+    if math.isnan(score):
+        raise ValueError('value is not a valid float')
+    return score
+
+
+def parse_bound(value):
+    """
+    分值范围的一端，(开头表示不包括
+    :return: (分值, 是否不包括)
+    """
+    exclusive = value[:1] == b'('
+    try:
+        return parse_score(value[1:] if exclusive else value), exclusive
+    except ValueError:
+        raise ValueError('min or max is not a float') from None
+
+
+def format_score(score):
+    """分值回复给客户端的形式，整数不带小数点，其他为能精确还原的最短形式"""
+    if score.is_integer() and abs(score) < 1e17:
+        return b'%d' % score
+    return repr(score).encode()
@@ -0,0 +1,122 @@
+from collections import deque
+import unittest
+
+from server.src.encoding import ZipHash, ZipList, IntSet, HashTable, HashSet, as_int, encoding_of, \
+    hash_update, list_push, list_set, set_add, set_remove
+from server.conf.settings import HASH_MAX_ZIPLIST_ENTRIES, HASH_MAX_ZIPLIST_VALUE, \
+    LIST_MAX_ZIPLIST_ENTRIES, LIST_MAX_ZIPLIST_VALUE, SET_MAX_INTSET_ENTRIES
+
+
+def fields(n, start=0):
+    return {b'f%d' % i: b'v' for i in range(start, start + n)}
+
+
+class TestHash(unittest.TestCase):
+    def test_entries(self):
+        h, added = hash_update(None, fields(HASH_MAX_ZIPLIST_ENTRIES))
+        self.assertIs(type(h), ZipHash)
+        self.assertEqual(added, HASH_MAX_ZIPLIST_ENTRIES)
+
+        # 只改已有字段不转换
+        h, added = hash_update(h, fields(10))
+        self.assertIs(type(h), ZipHash)
+        self.assertEqual(added, 0)
+
+        h, added = hash_update(h, fields(1, HASH_MAX_ZIPLIST_ENTRIES))
+        self.assertIs(type(h), HashTable)
+        self.assertEqual(added, 1)
+        self.assertEqual(len(h), HASH_MAX_ZIPLIST_ENTRIES + 1)
+        self.assertEqual(encoding_of(1, h), 'hashtable')
+
+    def test_value_length(self):
+        h, _ = hash_update(None, {b'f': b'v' * HASH_MAX_ZIPLIST_VALUE})
+        self.assertIs(type(h), ZipHash)
+        h, _ = hash_update(h, {b'f': b'v' * (HASH_MAX_ZIPLIST_VALUE + 1)})
+        self.assertIs(type(h), HashTable)
+        self.assertEqual(h[b'f'], b'v' * (HASH_MAX_ZIPLIST_VALUE + 1))
+
+        h, _ = hash_update(None, {b'f' * (HASH_MAX_ZIPLIST_VALUE + 1): b'v'})
+        self.assertIs(type(h), HashTable)
+
+    def test_zip_hash(self):
+        # 值和字段相同时只按字段查找
+        h, _ = hash_update(None, {b'a': b'b', b'b': b'c'})
+        self.assertEqual(h.get(b'b'), b'c')
+        self.assertNotIn(b'c', h)
+        self.assertEqual(h.pop(b'a'), b'b')
+        self.assertEqual(list(h.items()), [(b'b', b'c')])
+
+
+class TestList(unittest.TestCase):
+    def test_entries(self):
+        lst = list_push(None, [b'a'] * LIST_MAX_ZIPLIST_ENTRIES)
+        self.assertIs(type(lst), ZipList)
+        lst = list_push(lst, [b'b'], left=True)
+        self.assertIs(type(lst), deque)
+        self.assertEqual(lst[0], b'b')
+        self.assertEqual(encoding_of(2, lst), 'quicklist')
+
+    def test_push_order(self):
+        lst = list_push(None, [b'a', b'b', b'c'], left=True)
+        self.assertEqual(list(lst), [b'c', b'b', b'a'])
+        lst = list_push(lst, [b'd', b'e'])
+        self.assertEqual(list(lst), [b'c', b'b', b'a', b'd', b'e'])
+
+    def test_value_length(self):
+        lst = list_push(None, [b'v' * (LIST_MAX_ZIPLIST_VALUE + 1)])
+        self.assertIs(type(lst), deque)
+
+    def test_set(self):
+        lst = list_push(None, [b'a', b'b'])
+        lst, old = list_set(lst, -1, b'v' * LIST_MAX_ZIPLIST_VALUE)
+        self.assertIs(type(lst), ZipList)
+        self.assertEqual(old, b'b')
+
+        lst, old = list_set(lst, 0, b'v' * (LIST_MAX_ZIPLIST_VALUE + 1))
+        self.assertIs(type(lst), deque)
+        self.assertEqual(old, b'a')
+        self.assertEqual(list(lst), [b'v' * (LIST_MAX_ZIPLIST_VALUE + 1), b'v' * LIST_MAX_ZIPLIST_VALUE])
+
+        with self.assertRaises(IndexError):
+            list_set(lst, 2, b'x')
+
+
+class TestSet(unittest.TestCase):
+    def test_intset(self):
+        s, added = set_add(None, [b'3', b'-1', b'3', b'10'])
+        self.assertIs(type(s), IntSet)
+        self.assertEqual(added, 3)
+        self.assertEqual(list(s), [b'-1', b'3', b'10'])
+        self.assertIn(b'10', s)
+        self.assertNotIn(b'010', s)
+        self.assertEqual(encoding_of(3, s), 'intset')
+
+    def test_not_int(self):
+        s, _ = set_add(None, [b'1', b'2'])
+        # 非规范形式的整数按字符串保存
+        s, added = set_add(s, [b'01'])
+        self.assertIs(type(s), HashSet)
+        self.assertEqual(added, 1)
+        self.assertEqual(s, {b'1', b'2', b'01'})
+
+    def test_entries(self):
+        s, _ = set_add(None, [b'%d' % i for i in range(SET_MAX_INTSET_ENTRIES)])
+        self.assertIs(type(s), IntSet)
+        s, added = set_add(s, [b'%d' % SET_MAX_INTSET_ENTRIES])
+        self.assertIs(type(s), HashSet)
+        self.assertEqual(added, 1)
+        self.assertEqual(len(s), SET_MAX_INTSET_ENTRIES + 1)
+
+    def test_remove(self):
+        s, _ = set_add(None, [b'1', b'2', b'3'])
+        self.assertEqual(set_remove(s, [b'1', b'x', b'4', b'3']), 2)
+        self.assertEqual(list(s), [b'2'])
+
+    def test_as_int(self):
+        self.assertEqual(as_int(b'-9223372036854775808'), -2**63)
+        for value in (b'9223372036854775808', b'+1', b'01', b' 1', b'', b'1.0'):
+            self.assertIsNone(as_int(value), value)
+
+
+if __name__ == '__main__':
+    unittest.main()
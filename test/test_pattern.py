@@ -0,0 +1,55 @@
+import unittest
+
+from server.src.pattern import match, split_prefix
+
+
+class TestPattern(unittest.TestCase):
+    def assertMatches(self, pattern, matched, unmatched=()):
+        for string in matched:
+            self.assertTrue(match(pattern, string), (pattern, string))
+        for string in unmatched:
+            self.assertFalse(match(pattern, string), (pattern, string))
+
+    def test_literal_and_prefix(self):
+        self.assertMatches(b'key', [b'key'], [b'ke', b'key1'])
+        self.assertMatches(b'user:*', [b'user:', b'user:1:name'], [b'user', b'xuser:1'])
+        self.assertMatches(b'*', [b'', b'a\nb'])
+
+    def test_wildcards(self):
+        self.assertMatches(b'h?llo', [b'hello', b'hallo'], [b'hllo', b'heello'])
+        self.assertMatches(b'h*llo', [b'hllo', b'heeeello'], [b'hell'])
+        self.assertMatches(b'*:name', [b'user:1:name', b':name'], [b'user:1:age'])
+        # 换行也是普通字符
+        self.assertMatches(b'a?b', [b'a\nb'])
+
+    def test_classes(self):
+        self.assertMatches(b'h[ae]llo', [b'hello', b'hallo'], [b'hillo', b'hllo'])
+        self.assertMatches(b'h[^e]llo', [b'hallo', b'hbllo'], [b'hello'])
+        self.assertMatches(b'h[a-c]llo', [b'hallo', b'hcllo'], [b'hdllo'])
+        # 范围两端反了也可以
+        self.assertMatches(b'[z-a]', [b'm'], [b'A'])
+        self.assertMatches(b'[]', [], [b'a', b''])
+        self.assertMatches(b'[^]', [b'a', b']'], [b''])
+        # 没有闭合的]时到模式结尾为止
+        self.assertMatches(b'[abc', [b'b'], [b'[abc'])
+        # 正则中的特殊字符按字面匹配
+        self.assertMatches(b'[.]', [b'.'], [b'a'])
+
+    def test_escapes(self):
+        self.assertMatches(b'a\\*b', [b'a*b'], [b'axb'])
+        self.assertMatches(b'a\\?b', [b'a?b'], [b'axb'])
+        self.assertMatches(b'\\[a]', [b'[a]'], [b'a'])
+        self.assertMatches(b'[\\]]', [b']'], [b'\\'])
+        self.assertMatches(b'[a\\-z]', [b'-', b'a', b'z'], [b'm'])
+        self.assertMatches(b'a.b+(c)', [b'a.b+(c)'], [b'axbb(c)'])
+
+    def test_split_prefix(self):
+        self.assertEqual(split_prefix(b'user:*'), (b'user:', b'*'))
+        self.assertEqual(split_prefix(b'user:\\*:*'), (b'user:*:', b'*'))
+        self.assertEqual(split_prefix(b'key'), (b'key', b''))
+        self.assertEqual(split_prefix(b'[a]bc'), (b'', b'[a]bc'))
+        self.assertEqual(split_prefix(b'a?c'), (b'a', b'?c'))
+
+
+if __name__ == '__main__':
+    unittest.main()
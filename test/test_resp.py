@@ -0,0 +1,86 @@
+import unittest
+from unittest import mock
+
+from server.src.resp_code import RespParser, RespError
+from server.conf.settings import PROTO_INLINE_MAX_SIZE, PROTO_MAX_BULK_LEN, PROTO_MAX_MULTIBULK_LEN
+
+
+def parse(*chunks):
+    """逐块喂给解析器，返回每次解析出的命令"""
+    parser = RespParser()
+    ret = []
+    for chunk in chunks:
+        parser.feed(chunk)
+        ret.append(parser.parse())
+    return ret
+
+
+class TestRespParser(unittest.TestCase):
+    def test_pipeline(self):
+        data = b'*1\r\n$4\r\nPING\r\n*3\r\n$3\r\nSET\r\n$1\r\nk\r\n$0\r\n\r\n'
+        self.assertEqual(parse(data), [[[b'PING'], [b'SET', b'k', b'']]])
+
+    def test_split_frames(self):
+        data = b'*2\r\n$3\r\nGET\r\n$5\r\nhello\r\n*1\r\n$4\r\nPING\r\n'
+        # 在每个位置切开，结果都与一次收到相同
+        for i in range(1, len(data)):
+            commands = [cmd for cmds in parse(data[:i], data[i:]) for cmd in cmds]
+            self.assertEqual(commands, [[b'GET', b'hello'], [b'PING']], i)
+
+        # 逐字节收到
+        commands = [cmd for cmds in parse(*[data[i:i+1] for i in range(len(data))]) for cmd in cmds]
+        self.assertEqual(commands, [[b'GET', b'hello'], [b'PING']])
+
+    def test_binary_arg(self):
+        value = b'a\r\nb\x00\xff'
+        self.assertEqual(parse(b'*1\r\n$%d\r\n%s\r\n' % (len(value), value)), [[[value]]])
+
+    def test_inline(self):
+        self.assertEqual(parse(b'PING\r\nSET k  v\n\r\n'), [[[b'PING'], [b'SET', b'k', b'v']]])
+
+    def test_empty_multibulk(self):
+        self.assertEqual(parse(b'*0\r\n*-1\r\n*1\r\n$4\r\nPING\r\n'), [[[b'PING']]])
+
+    def assertRespError(self, data, message):
+        parser = RespParser()
+        parser.feed(data)
+        with self.assertRaises(RespError) as cm:
+            parser.parse()
+        self.assertEqual(str(cm.exception), message)
+
+    def test_invalid_length(self):
+        self.assertRespError(b'*x\r\n', 'invalid multibulk length')
+        self.assertRespError(b'*%d\r\n' % (PROTO_MAX_MULTIBULK_LEN + 1), 'invalid multibulk length')
+        self.assertRespError(b'*1\r\n$x\r\n', 'invalid bulk length')
+        self.assertRespError(b'*1\r\n$-1\r\n', 'invalid bulk length')
+        self.assertRespError(b'*1\r\n$%d\r\n' % (PROTO_MAX_BULK_LEN + 1), 'invalid bulk length')
+        self.assertRespError(b'*1\r\n:1\r\n', "expected '$', got ':'")
+
+    def test_too_big_line(self):
+        line = b'x' * (PROTO_INLINE_MAX_SIZE + 1)
+        self.assertRespError(line, 'too big inline request')
+        self.assertRespError(b'*' + line, 'too big mbulk count string')
+        self.assertRespError(b'*1\r\n$' + line, 'too big bulk count string')
+
+    def test_query_buffer_limit(self):
+        with mock.patch('server.src.resp_code.CLIENT_QUERY_BUFFER_LIMIT', 100):
+            # 已解析的参数也计入未完成的命令帧
+            self.assertRespError(b'*3\r\n$60\r\n%s\r\n$60\r\n%s' % (b'a' * 60, b'b' * 50), 'query buffer limit exceeded')
+
+            # 完整的帧解析后不再占用缓冲区
+            parser = RespParser()
+            for _ in range(10):
+                parser.feed(b'*1\r\n$60\r\n%s\r\n' % (b'a' * 60))
+                self.assertEqual(parser.parse(), [[b'a' * 60]])
+
+    def test_error_after_commands(self):
+        """错误之前的命令先返回，下次解析时再报错"""
+        parser = RespParser()
+        parser.feed(b'*1\r\n$4\r\nPING\r\n*x\r\n')
+        self.assertEqual(parser.parse(), [[b'PING']])
+        with self.assertRaises(RespError):
+            parser.parse()
+
+
+if __name__ == '__main__':
+    unittest.main()
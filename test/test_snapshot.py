@@ -0,0 +1,76 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from server.src import snapshot
+from server.src.snapshot import SnapshotError
+
+
+class Store:
+    """只实现快照读写用到的iter_data、restore"""
+    def __init__(self, items=()):
+        self.items = list(items)
+
+    def iter_data(self):
+        return iter(self.items)
+
+    def restore(self, key, tp, value, when=None):
+        self.items.append((key, tp, value, when))
+
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.file = os.path.join(self.dir, 'dump.pdb')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_round_trip(self):
+        when = round(time.time() + 100, 3)
+        items = [
+            (b'str', 0, b'v' * 70000, None),
+            (b'hash', 1, {b'f%d' % i: b'%d' % i for i in range(100)}, when),
+            (b'list', 2, [b'', b'a' * 100, b'\r\n'], None),
+            (b'set', 3, [b'%d' % i for i in range(20000)], None),
+            (b'zset', 4, [(b'a', -1.5), (b'b', float('inf'))], when),
+        ]
+        snapshot.dump(Store(items), self.file)
+        self.assertEqual(os.listdir(self.dir), ['dump.pdb'])
+
+        db = Store()
+        self.assertTrue(snapshot.load(db, self.file))
+        # hash读出为(字段, 值)列表
+        expected = [(key, tp, list(value.items()) if tp == 1 else value, when) for key, tp, value, when in items]
+        self.assertEqual(db.items, expected)
+
+    def test_missing_file(self):
+        self.assertFalse(snapshot.load(Store(), self.file))
+
+    def assertLoadError(self, data, message):
+        with open(self.file, 'wb') as f:
+            f.write(data)
+        with self.assertRaises(SnapshotError) as cm:
+            snapshot.load(Store(), self.file)
+        self.assertEqual(str(cm.exception), message)
+
+    def test_checksum_mismatch(self):
+        snapshot.dump(Store([(b'key', 0, b'value', None)]), self.file)
+        with open(self.file, 'rb') as f:
+            data = bytearray(f.read())
+        # 改动值中的一个字节
+        data[data.index(b'value')] ^= 1
+        self.assertLoadError(bytes(data), 'snapshot checksum mismatch')
+
+    def test_corrupted(self):
+        snapshot.dump(Store([(b'key', 0, b'value', None)]), self.file)
+        with open(self.file, 'rb') as f:
+            data = f.read()
+        self.assertLoadError(b'REDIS0009', 'not a pedis snapshot file')
+        self.assertLoadError(data[:-6], 'unexpected end of snapshot file')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+
+from server.src.timer import ExpireQueue
+
+
+class TestExpireQueue(unittest.TestCase):
+    def setUp(self):
+        self.queue = ExpireQueue(resolution=1)
+
+    def test_pop_expired(self):
+        queue = self.queue
+        queue.add(b'a', 10)
+        queue.add(b'b', 5)
+        queue.add(b'c', 5.5)
+        queue.add(b'd', 20)
+        self.assertEqual(len(queue), 4)
+
+        self.assertEqual(queue.pop_expired(4, 10), [])
+        # 5.5向上取整到刻度6，时间6时才到期
+        self.assertEqual(queue.pop_expired(5, 10), [b'b'])
+        self.assertEqual(queue.pop_expired(10, 10), [b'c', b'a'])
+        self.assertEqual(len(queue), 1)
+        self.assertIn(b'd', queue)
+        self.assertNotIn(b'a', queue)
+
+    def test_pop_count(self):
+        queue = self.queue
+        for i in range(10):
+            queue.add(b'%d' % i, 1)
+        first = queue.pop_expired(1, 4)
+        self.assertEqual(len(first), 4)
+        rest = queue.pop_expired(1, 100)
+        self.assertEqual(sorted(first + rest), sorted(b'%d' % i for i in range(10)))
+        self.assertFalse(queue.buckets)
+        self.assertFalse(queue.heap)
+
+    def test_readd(self):
+        queue = self.queue
+        queue.add(b'a', 5)
+        queue.add(b'a', 50)
+        self.assertEqual(len(queue), 1)
+        self.assertEqual(queue.pop_expired(10, 10), [])
+        self.assertEqual(queue.pop_expired(50, 10), [b'a'])
+
+    def test_discard(self):
+        queue = self.queue
+        queue.add(b'a', 5)
+        queue.add(b'b', 5)
+        queue.discard(b'a')
+        queue.discard(b'missing')
+        self.assertNotIn(b'a', queue)
+        self.assertEqual(queue.pop_expired(5, 10), [b'b'])
+
+    def test_discard_compacts_heap(self):
+        """清空的桶残留在堆中，残留过多时重建堆"""
+        queue = self.queue
+        for i in range(1000):
+            queue.add(i, i)
+        for i in range(999):
+            queue.discard(i)
+        self.assertLessEqual(len(queue.heap), 2 * len(queue.buckets) + 64)
+        self.assertEqual(queue.pop_expired(1000, 10), [999])
+
+    def test_clear(self):
+        queue = self.queue
+        queue.add(b'a', 5)
+        queue.clear()
+        self.assertEqual(len(queue), 0)
+        self.assertEqual(queue.pop_expired(5, 10), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
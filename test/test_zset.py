@@ -0,0 +1,135 @@
+import bisect
+import random
+import unittest
+from unittest import mock
+
+from server.src.sortedlist import SortedList
+from server.src.zset import Zset, parse_bound
+
+
+class TestSortedList(unittest.TestCase):
+    def setUp(self):
+        # 块很小时才会拆分、删空多个块
+        patcher = mock.patch('server.src.sortedlist.BLOCK_SIZE', 4)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def check(self, sl, ref):
+        self.assertEqual(len(sl), len(ref))
+        self.assertEqual(list(sl), ref)
+        self.assertEqual(sl.maxes, [block[-1] for block in sl.blocks])
+        for i, value in enumerate(ref):
+            self.assertEqual(sl[i], value)
+            self.assertEqual(sl[i - len(ref)], value)
+        for value in range(-1, 202):
+            self.assertEqual(sl.bisect_left(value), bisect.bisect_left(ref, value))
+            self.assertEqual(sl.bisect_right(value), bisect.bisect_right(ref, value))
+
+    def test_random_ops(self):
+        rand = random.Random(1)
+        sl = SortedList()
+        ref = []
+        for _ in range(1000):
+            value = rand.randrange(200)
+            if value in ref:
+                self.assertTrue(sl.discard(value))
+                ref.remove(value)
+            else:
+                sl.add(value)
+                bisect.insort(ref, value)
+        self.assertGreater(len(sl.blocks), 10)
+        self.check(sl, ref)
+        self.assertFalse(sl.discard(1000))
+
+        for value in list(ref):
+            sl.discard(value)
+        self.check(sl, [])
+        self.assertEqual(sl.blocks, [])
+
+    def test_index_error(self):
+        sl = SortedList(range(10))
+        with self.assertRaises(IndexError):
+            sl[10]
+        with self.assertRaises(IndexError):
+            sl[-11]
+
+    def test_islice(self):
+        sl = SortedList(range(30))
+        self.assertEqual(sl.islice(3, 17), list(range(3, 17)))
+        self.assertEqual(sl.islice(-5, 2), [0, 1])
+        self.assertEqual(sl.islice(25, 100), list(range(25, 30)))
+        self.assertEqual(sl.islice(10, 10), [])
+        self.assertEqual(sl.islice(20, 10), [])
+
+    def test_irange(self):
+        sl = SortedList(range(0, 30, 2))
+        self.assertEqual(list(sl.irange(10)), list(range(10, 30, 2)))
+        self.assertEqual(list(sl.irange(10, inclusive=False)), list(range(12, 30, 2)))
+        self.assertEqual(list(sl.irange(11)), list(range(12, 30, 2)))
+        self.assertEqual(list(sl.irange(28, inclusive=False)), [])
+        self.assertEqual(list(sl.irange(-1)), list(range(0, 30, 2)))
+
+
+class TestZset(unittest.TestCase):
+    def setUp(self):
+        self.zset = Zset()
+        for i, member in enumerate([b'a', b'b', b'c', b'd', b'e']):
+            self.zset.add(member, float(i))
+        # 分值相同时按成员排序
+        self.zset.add(b'c2', 2.0)
+
+    def test_add_remove(self):
+        zset = self.zset
+        self.assertFalse(zset.add(b'a', 0.0))
+        self.assertTrue(zset.add(b'a', 10.0))
+        self.assertEqual(zset.rank(b'a'), 5)
+        self.assertTrue(zset.remove(b'a'))
+        self.assertFalse(zset.remove(b'a'))
+        self.assertEqual(len(zset), 5)
+        self.assertEqual(zset.score(b'a'), None)
+
+    def test_rank(self):
+        zset = self.zset
+        self.assertEqual([zset.rank(m) for m in (b'a', b'c', b'c2', b'e')], [0, 2, 3, 5])
+        self.assertEqual(zset.rank(b'a', reverse=True), 5)
+        self.assertEqual(zset.rank(b'e', reverse=True), 0)
+        self.assertIsNone(zset.rank(b'x'))
+
+    def members(self, items):
+        return [member for _, member in items]
+
+    def test_range_by_rank(self):
+        zset = self.zset
+        self.assertEqual(self.members(zset.range_by_rank(0, -1)), [b'a', b'b', b'c', b'c2', b'd', b'e'])
+        self.assertEqual(self.members(zset.range_by_rank(1, 2)), [b'b', b'c'])
+        self.assertEqual(self.members(zset.range_by_rank(-2, 100)), [b'd', b'e'])
+        self.assertEqual(self.members(zset.range_by_rank(-100, 0)), [b'a'])
+        self.assertEqual(zset.range_by_rank(6, 10), [])
+        self.assertEqual(zset.range_by_rank(3, 2), [])
+        self.assertEqual(self.members(zset.range_by_rank(0, 1, reverse=True)), [b'e', b'd'])
+        self.assertEqual(self.members(zset.range_by_rank(-1, -1, reverse=True)), [b'a'])
+
+    def test_range_by_score(self):
+        zset = self.zset
+        self.assertEqual(self.members(zset.range_by_score((2, False), (3, False))), [b'c', b'c2', b'd'])
+        self.assertEqual(self.members(zset.range_by_score((2, True), (3, False))), [b'd'])
+        self.assertEqual(self.members(zset.range_by_score((2, False), (3, True))), [b'c', b'c2'])
+        self.assertEqual(zset.range_by_score((3, True), (3, True)), [])
+        self.assertEqual(zset.range_by_score((4, False), (1, False)), [])
+        self.assertEqual(len(zset.range_by_score(parse_bound(b'-inf'), parse_bound(b'+inf'))), 6)
+        self.assertEqual(self.members(zset.range_by_score((0, False), (4, False), offset=1, count=2)), [b'b', b'c'])
+        self.assertEqual(self.members(zset.range_by_score((0, False), (4, False), reverse=True, offset=1, count=2)),
+                         [b'd', b'c2'])
+        self.assertEqual(zset.range_by_score((0, False), (4, False), offset=-1), [])
+        self.assertEqual(zset.range_by_score((0, False), (4, False), offset=10), [])
+
+    def test_count(self):
+        zset = self.zset
+        self.assertEqual(zset.count((2, False), (2, False)), 2)
+        self.assertEqual(zset.count((2, True), (2, False)), 0)
+        self.assertEqual(zset.count(parse_bound(b'(0'), parse_bound(b'4')), 5)
+        self.assertEqual(zset.count((5, False), (0, False)), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()